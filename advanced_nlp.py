@@ -14,6 +14,14 @@ import random
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
+from llm_client import (
+    HAS_ANTHROPIC, HAS_OPENAI, is_anthropic_available, is_openai_available,
+    create_message_async, create_chat_completion_async, cacheable,
+)
+from prompt_builder import build_transcript, CONTEXT_TOKEN_BUDGET
+from metrics import record_cache
+from emotion_classifier import classify as classify_emotions
+
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,237 +44,324 @@ class NLPModels:
     GPT4_LATEST = "gpt-4o"  # Najnowszy model OpenAI
     CLAUDE_LEGACY = "claude-3-opus-20240229"  # Starszy, ale bardziej zaawansowany model Claude
 
-# Inicjalizacja API klientów
-HAS_ANTHROPIC = False
-anthropic_client = None
+# Klienci API są współdzieleni przez llm_client (pula połączeń, limity czasu, ponawianie)
+NLP_READ_TIMEOUT = float(os.environ.get("NLP_READ_TIMEOUT", 20.0))
+
+# Analiza stanu emocjonalnego przed pytaniem kontekstowym: "lexicon" (lokalny klasyfikator
+# emotion_classifier, bez wywołania API) albo "llm" (Claude, a w razie błędu OpenAI)
+EMOTION_ANALYZER = os.environ.get("EMOTION_ANALYZER", "lexicon").lower()
+
+EMOTIONAL_ANALYSIS_SYSTEM_PROMPT = """
+            Jesteś psychologiem specjalizującym się w analizie emocjonalnej. Przeanalizuj podaną 
+            konwersację terapeutyczną i określ dominujące emocje, ogólny stan emocjonalny 
+            oraz sugerowane obszary, na których powinna skupić się dalsza rozmowa.
+            
+            Zwróć odpowiedź jako JSON w następującym formacie:
+            {
+                "dominant_emotions": ["emocja1", "emocja2", ...],
+                "emotional_state": "ogólny stan (np. positive, negative, mixed, neutral)",
+                "suggested_focus_areas": ["obszar1", "obszar2", ...]
+            }
+            """
 
-try:
-    from anthropic import Anthropic
-    HAS_ANTHROPIC = True
+EMOTIONAL_ANALYSIS_KEYS = ["dominant_emotions", "emotional_state", "suggested_focus_areas"]
+
+INITIAL_QUESTION_PROMPT = """
+    Wygeneruj jedno głębokie, refleksyjne pytanie terapeutyczne w języku polskim, 
+    które mogłoby rozpocząć rozmowę z nowym użytkownikiem aplikacji wsparcia psychologicznego.
     
-    # Inicjalizacja klienta Anthropic Claude
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if api_key:
-        anthropic_client = Anthropic(api_key=api_key)
-        logger.info("Zainicjalizowano klienta Advanced NLP z Anthropic API")
-    else:
-        logger.warning("Brak klucza API Anthropic (ANTHROPIC_API_KEY)")
-except ImportError as e:
-    logger.warning(f"Nie można zaimportować pakietu Anthropic: {str(e)}")
-except Exception as e:
-    logger.warning(f"Anthropic API jest niedostępne: {str(e)}")
-
-# Inicjalizacja OpenAI
-HAS_OPENAI = False
-openai_client = None
-
-try:
-    from openai import OpenAI
-    HAS_OPENAI = True
+    Pytanie powinno być empatyczne, otwarte i zachęcające do głębszej refleksji nad sobą
+    i swoim samopoczuciem.
     
-    # Inicjalizacja klienta OpenAI
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if api_key:
-        openai_client = OpenAI(api_key=api_key)
-        logger.info("Zainicjalizowano klienta Advanced NLP z OpenAI API")
-    else:
-        logger.warning("Brak klucza API OpenAI (OPENAI_API_KEY)")
-except Exception as e:
-    logger.warning(f"OpenAI API jest niedostępne: {str(e)}")
-
-def analyze_emotional_state(context: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """
-    Analizuje stan emocjonalny użytkownika na podstawie kontekstu rozmowy.
+    Unikaj pytań zamkniętych i powierzchownych. Pytanie powinno być napisane w drugiej
+    osobie liczby pojedynczej (Ty).
     
+    Odpowiedz tylko samym pytaniem, bez dodatkowego tekstu.
+    """
+
+# Dostępne stany emocjonalne i sugerowane typy pytań
+QUESTION_STRATEGIES = {
+    "positive": "Zadaj pytanie, które zachęci do refleksji nad pozytywnymi aspektami życia lub doświadczeniami.",
+    "negative": "Zadaj empatyczne pytanie, które pomoże w analizie trudnych emocji, ale z perspektywą konstruktywnego rozwiązania.",
+    "mixed": "Zadaj pytanie, które pozwoli na zrównoważenie sprzecznych emocji i znalezienie harmonii.",
+    "neutral": "Zadaj pytanie, które zgłębi tematy ważne dla osobistego rozwoju i samoświadomości."
+}
+
+async def _ask_providers_async(claude_request: Dict[str, Any], openai_request: Dict[str, Any], parse, label: str):
+    """
+    Wywołuje Claude, a w razie błędu lub nieprawidłowej odpowiedzi OpenAI.
+
     Args:
-        context: Lista poprzednich elementów konwersacji.
-               Każdy element to słownik z kluczami 'question', 'response' i 'date'.
-    
+        claude_request: Parametry create_message_async
+        openai_request: Parametry create_chat_completion_async
+        parse: Funkcja zamieniająca tekst odpowiedzi na wynik (None = odpowiedź nieprawidłowa)
+        label: Opis operacji do logów
+
     Returns:
-        Dict z analizą stanu emocjonalnego, zawierającą:
-            - dominant_emotions (list): Dominujące emocje
-            - emotional_state (str): Ogólny stan emocjonalny
-            - suggested_focus_areas (list): Sugerowane obszary do skupienia się
+        Wynik `parse` albo None, jeśli żaden dostawca nie zwrócił prawidłowej odpowiedzi
+    """
+    # Strategia 1: Użyj Claude jeśli dostępny (preferowany)
+    if is_anthropic_available():
+        try:
+            message = await create_message_async(**claude_request)
+            result = parse(message.content[0].text)
+            if result is not None:
+                return result
+        except Exception as e:
+            logger.error(f"Błąd podczas {label} z Claude: {str(e)}")
+
+    # Strategia 2: Użyj OpenAI jako backup
+    if is_openai_available():
+        try:
+            response = await create_chat_completion_async(**openai_request)
+            result = parse(response.choices[0].message.content)
+            if result is not None:
+                return result
+        except Exception as e:
+            logger.error(f"Błąd podczas {label} z OpenAI: {str(e)}")
+
+    return None
+
+def _parse_question(content: str) -> Optional[str]:
+    return content.strip() or None
+
+def _parse_emotional_analysis(content: str) -> Optional[Dict[str, Any]]:
+    """Wydobywa JSON analizy emocjonalnej; None, jeśli brakuje wymaganych kluczy."""
+    content = content.strip()
+    if content.startswith("```json") and content.endswith("```"):
+        content = content[7:-3].strip()
+
+    analysis = json.loads(content)
+    if all(key in analysis for key in EMOTIONAL_ANALYSIS_KEYS):
+        return analysis
+    return None
+
+def _emotional_analysis_input(context: List[Dict[str, Any]]):
+    """
+    Przygotowuje analizę emocjonalną kontekstu.
+
+    Returns:
+        tuple: (gotowa analiza - z cache'a lub dla zbyt krótkiego kontekstu - albo None,
+                klucz cache'a, tekst rozmowy)
     """
     if not context or len(context) < 2:
         return {
             "dominant_emotions": [],
             "emotional_state": "neutral",
             "suggested_focus_areas": ["samoświadomość", "refleksja"]
-        }
+        }, None, None
     
     # Przygotowanie tekstu do analizy
-    conversation_text = ""
-    for item in context[-5:]:  # Użyj tylko ostatnich 5 wpisów
-        if item.get("question") and item.get("response"):
-            conversation_text += f"Pytanie: {item['question']}\n"
-            conversation_text += f"Odpowiedź: {item['response']}\n\n"
+    # Użyj tylko ostatnich 5 wpisów, przyciętych do budżetu tokenów
+    entries = [item for item in context[-5:] if item.get("question") and item.get("response")]
+    conversation_text, _ = build_transcript(
+        entries,
+        lambda item: f"Pytanie: {item['question']}\nOdpowiedź: {item['response']}\n\n",
+        CONTEXT_TOKEN_BUDGET,
+    )
     
     # Cache'owanie na podstawie zawartości rozmowy
     cache_key = hash(conversation_text)
-    if cache_key in question_cache:
+    cached = cache_key in question_cache
+    record_cache("emotional_analysis", cached)
+    if cached:
         logger.info("Używam zbuforowanej analizy emocjonalnej")
-        return question_cache[cache_key]
-    
-    # Domyślna analiza na wypadek błędów
-    default_analysis = {
-        "dominant_emotions": ["refleksyjność"],
-        "emotional_state": "neutral",
-        "suggested_focus_areas": ["samoświadomość", "refleksja"]
-    }
-    
-    # Spróbuj użyć Claude do analizy (najlepszy wybór)
-    if HAS_ANTHROPIC and anthropic_client:
-        try:
-            system_prompt = """
-            Jesteś psychologiem specjalizującym się w analizie emocjonalnej. Przeanalizuj podaną 
-            konwersację terapeutyczną i określ dominujące emocje, ogólny stan emocjonalny 
-            oraz sugerowane obszary, na których powinna skupić się dalsza rozmowa.
-            
-            Zwróć odpowiedź jako JSON w następującym formacie:
-            {
-                "dominant_emotions": ["emocja1", "emocja2", ...],
-                "emotional_state": "ogólny stan (np. positive, negative, mixed, neutral)",
-                "suggested_focus_areas": ["obszar1", "obszar2", ...]
-            }
-            """
-            
-            logger.info("Próba analizy emocjonalnej z Claude")
-            
-            message = anthropic_client.messages.create(
-                model=NLPModels.CLAUDE_LATEST,
-                max_tokens=300,
-                temperature=0.2,
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": conversation_text}
-                ]
-            )
-            
-            content = message.content[0].text.strip()
-            
-            # Wydobycie JSON z odpowiedzi
-            if content.startswith("```json") and content.endswith("```"):
-                content = content[7:-3].strip()
-            
-            analysis = json.loads(content)
-            
-            # Sprawdzenie, czy mamy wszystkie wymagane klucze
-            required_keys = ["dominant_emotions", "emotional_state", "suggested_focus_areas"]
-            if all(key in analysis for key in required_keys):
-                # Dodaj do cache
-                question_cache[cache_key] = analysis
-                return analysis
-        
-        except Exception as e:
-            logger.error(f"Błąd podczas analizy emocjonalnej z Claude: {str(e)}")
-            # Kontynuuj do OpenAI lub fallbacku
-    
-    # Jako backup użyj OpenAI
-    if HAS_OPENAI and openai_client:
-        try:
-            system_prompt = """
-            Jesteś psychologiem specjalizującym się w analizie emocjonalnej. Przeanalizuj podaną 
-            konwersację terapeutyczną i określ dominujące emocje, ogólny stan emocjonalny 
-            oraz sugerowane obszary, na których powinna skupić się dalsza rozmowa.
-            
-            Zwróć odpowiedź jako JSON w następującym formacie:
-            {
-                "dominant_emotions": ["emocja1", "emocja2", ...],
-                "emotional_state": "ogólny stan (np. positive, negative, mixed, neutral)",
-                "suggested_focus_areas": ["obszar1", "obszar2", ...]
-            }
-            """
-            
-            logger.info("Próba analizy emocjonalnej z OpenAI")
-            
-            response = openai_client.chat.completions.create(
-                model=NLPModels.GPT4_LATEST,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": conversation_text}
-                ],
-                response_format={"type": "json_object"}
-            )
-            
-            analysis = json.loads(response.choices[0].message.content)
-            
-            # Sprawdzenie, czy mamy wszystkie wymagane klucze
-            required_keys = ["dominant_emotions", "emotional_state", "suggested_focus_areas"]
-            if all(key in analysis for key in required_keys):
-                # Dodaj do cache
-                question_cache[cache_key] = analysis
-                return analysis
-                
-        except Exception as e:
-            logger.error(f"Błąd podczas analizy emocjonalnej z OpenAI: {str(e)}")
-    
-    # Jeśli wszystko zawiedzie, użyj domyślnej analizy
-    return default_analysis
+        return question_cache[cache_key], cache_key, conversation_text
+    return None, cache_key, conversation_text
 
-def generate_advanced_question(context: Optional[List[Dict[str, Any]]] = None) -> Tuple[str, Dict[str, Any]]:
+def _emotional_analysis_requests(conversation_text: str):
+    claude_request = dict(
+        model=NLPModels.CLAUDE_LATEST,
+        read_timeout=NLP_READ_TIMEOUT,
+        max_tokens=300,
+        temperature=0.2,
+        system=[cacheable(EMOTIONAL_ANALYSIS_SYSTEM_PROMPT)],
+        messages=[
+            {"role": "user", "content": conversation_text}
+        ]
+    )
+    openai_request = dict(
+        model=NLPModels.GPT4_LATEST,
+        read_timeout=NLP_READ_TIMEOUT,
+        messages=[
+            {"role": "system", "content": EMOTIONAL_ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": conversation_text}
+        ],
+        response_format={"type": "json_object"}
+    )
+    return claude_request, openai_request
+
+def _remember_emotional_analysis(cache_key, analysis: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Zapisuje analizę w cache'u; bez analizy zwraca analizę domyślną."""
+    if analysis is None:
+        # Jeśli wszystko zawiedzie, użyj domyślnej analizy
+        return {
+            "dominant_emotions": ["refleksyjność"],
+            "emotional_state": "neutral",
+            "suggested_focus_areas": ["samoświadomość", "refleksja"]
+        }
+    question_cache[cache_key] = analysis
+    return analysis
+
+async def analyze_emotional_state_async(context: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Generuje zaawansowane pytanie terapeutyczne z wykorzystaniem najnowszych modeli NLP.
+    Analizuje stan emocjonalny użytkownika na podstawie kontekstu rozmowy.
     
     Args:
         context: Lista poprzednich elementów konwersacji.
                Każdy element to słownik z kluczami 'question', 'response' i 'date'.
     
     Returns:
-        Tuple zawierający:
-            - wygenerowane pytanie (str)
-            - metadane o generowaniu (dict)
+        Dict z analizą stanu emocjonalnego, zawierającą:
+            - dominant_emotions (list): Dominujące emocje
+            - emotional_state (str): Ogólny stan emocjonalny
+            - suggested_focus_areas (list): Sugerowane obszary do skupienia się
     """
-    # Jeśli nie ma kontekstu, wygeneruj pytanie inicjujące
-    if not context or len(context) == 0:
-        if random.random() < 0.7 and (HAS_ANTHROPIC or HAS_OPENAI):
-            initial_question = _generate_initial_question()
-            return initial_question, {"model": "advanced", "context_used": False}
-        else:
-            # Losowe pytanie z domyślnych
-            return random.choice(DEFAULT_QUESTIONS), {"model": "default", "context_used": False}
+    if EMOTION_ANALYZER == "lexicon":
+        return classify_emotions(context)
+
+    analysis, cache_key, conversation_text = _emotional_analysis_input(context)
+    if analysis is not None:
+        return analysis
+
+    analysis = await _ask_providers_async(*_emotional_analysis_requests(conversation_text),
+                                          _parse_emotional_analysis, "analizy emocjonalnej")
+    return _remember_emotional_analysis(cache_key, analysis)
+
+# Stały prompt systemowy pytania kontekstowego (prefiks cache'a promptu); strategia
+# i obszary zależne od stanu emocjonalnego trafiają na koniec wiadomości użytkownika
+CONTEXTUAL_QUESTION_SYSTEM_PROMPT = """
+    Jesteś doświadczonym polskim psychoterapeutą prowadzącym terapeutyczną rozmowę.
+    Twoim zadaniem jest wygenerowanie pojedynczego, głębokiego pytania w języku polskim,
+    które będzie kontynuacją rozmowy z pacjentem.
     
-    # Analizuj stan emocjonalny na podstawie kontekstu
-    emotional_analysis = analyze_emotional_state(context)
+    Na podstawie dostarczonego fragmentu rozmowy, stwórz pytanie, które:
+    1. Bezpośrednio odnosi się do tematów poruszonych przez pacjenta
+    2. Uwzględnia strategię podaną na końcu wiadomości
+    3. Skupia się na jednym lub więcej z obszarów podanych na końcu wiadomości
+    4. Jest sformułowane w sposób otwarty (nie może być odpowiedzią tak/nie)
+    5. Nie zawiera osądów ani założeń
+    6. Jest empatyczne i pełne zrozumienia
     
+    Wygeneruj wyłącznie jedno pytanie, bez wprowadzenia ani wyjaśnień.
+    """
+
+def _initial_question_requests():
+    claude_request = dict(
+        model=NLPModels.CLAUDE_LATEST,
+        read_timeout=NLP_READ_TIMEOUT,
+        max_tokens=150,
+        temperature=0.7,
+        system="Jesteś empatycznym polskim psychoterapeutą specjalizującym się w terapii poznawczo-behawioralnej i refleksyjnym podejściu do problemów życiowych.",
+        messages=[
+            {"role": "user", "content": INITIAL_QUESTION_PROMPT}
+        ]
+    )
+    openai_request = dict(
+        model=NLPModels.GPT4_LATEST,
+        read_timeout=NLP_READ_TIMEOUT,
+        messages=[
+            {"role": "system", "content": "Jesteś empatycznym polskim psychoterapeutą specjalizującym się w zadawaniu pytań, które skłaniają do głębokiej refleksji."},
+            {"role": "user", "content": INITIAL_QUESTION_PROMPT}
+        ],
+        max_tokens=150,
+        temperature=0.7
+    )
+    return claude_request, openai_request
+
+def _contextual_question_requests(conversation_text: str, emotion_strategy: str, focus_areas: str):
+    guidance = f"\n\nStrategia pytania: {emotion_strategy}\nObszary: {focus_areas}"
+    claude_request = dict(
+        model=NLPModels.CLAUDE_LATEST,
+        read_timeout=NLP_READ_TIMEOUT,
+        max_tokens=200,
+        temperature=0.7,
+        system=[cacheable(CONTEXTUAL_QUESTION_SYSTEM_PROMPT)],
+        messages=[
+            {"role": "user", "content": conversation_text + guidance}
+        ]
+    )
+    openai_request = dict(
+        model=NLPModels.GPT4_LATEST,
+        read_timeout=NLP_READ_TIMEOUT,
+        messages=[
+            {"role": "system", "content": CONTEXTUAL_QUESTION_SYSTEM_PROMPT},
+            {"role": "user", "content": conversation_text + guidance}
+        ],
+        max_tokens=200,
+        temperature=0.7
+    )
+    return claude_request, openai_request
+
+def _advanced_question_input(context: List[Dict[str, Any]]):
+    """
+    Przygotowuje tekst rozmowy do pytania kontekstowego.
+
+    Returns:
+        tuple: (pytanie z cache'a albo None, klucz cache'a, tekst rozmowy)
+    """
     # Przygotowanie kontekstu rozmowy
-    conversation_text = ""
-    for item in context[-5:]:  # Użyj tylko ostatnich 5 wpisów
-        if item.get("question") and item.get("response"):
-            conversation_text += f"Pytanie: {item['question']}\n"
-            conversation_text += f"Odpowiedź: {item['response']}\n"
-            conversation_text += f"Data: {item['date']}\n\n"
+    # Użyj tylko ostatnich 5 wpisów, przyciętych do budżetu tokenów
+    entries = [item for item in context[-5:] if item.get("question") and item.get("response")]
+    conversation_text, _ = build_transcript(
+        entries,
+        lambda item: f"Pytanie: {item['question']}\nOdpowiedź: {item['response']}\nData: {item['date']}\n\n",
+        CONTEXT_TOKEN_BUDGET,
+    )
     
     # Cache'owanie na podstawie zawartości rozmowy
     cache_key = hash(conversation_text)
-    if cache_key in question_cache:
+    cached = cache_key in question_cache
+    record_cache("advanced_question", cached)
+    if cached:
         logger.info("Używam zbuforowanego pytania")
-        cached_question = question_cache[cache_key]
-        return cached_question, {"model": "cached", "context_used": True, "emotional_analysis": emotional_analysis}
-    
-    # Dostępne stany emocjonalne i sugerowane typy pytań
-    question_strategies = {
-        "positive": "Zadaj pytanie, które zachęci do refleksji nad pozytywnymi aspektami życia lub doświadczeniami.",
-        "negative": "Zadaj empatyczne pytanie, które pomoże w analizie trudnych emocji, ale z perspektywą konstruktywnego rozwiązania.",
-        "mixed": "Zadaj pytanie, które pozwoli na zrównoważenie sprzecznych emocji i znalezienie harmonii.",
-        "neutral": "Zadaj pytanie, które zgłębi tematy ważne dla osobistego rozwoju i samoświadomości."
-    }
-    
+        return question_cache[cache_key], cache_key, conversation_text
+    return None, cache_key, conversation_text
+
+def _question_focus(emotional_analysis: Dict[str, Any]) -> Tuple[str, str]:
+    """Strategia pytania i obszary do skupienia się wynikające z analizy emocjonalnej."""
     # Domyślna strategia
-    emotion_strategy = question_strategies.get(
+    emotion_strategy = QUESTION_STRATEGIES.get(
         emotional_analysis.get("emotional_state", "neutral"), 
-        question_strategies["neutral"]
+        QUESTION_STRATEGIES["neutral"]
     )
     
     # Obszary sugerowane do skupienia się
     focus_areas = emotional_analysis.get("suggested_focus_areas", ["samoświadomość"])
-    focus_areas_text = ", ".join(focus_areas)
+    return emotion_strategy, ", ".join(focus_areas)
+
+def _use_generated_initial_question() -> bool:
+    return random.random() < 0.7 and (is_anthropic_available() or is_openai_available())
+
+async def generate_advanced_question_async(context: Optional[List[Dict[str, Any]]] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Generuje zaawansowane pytanie terapeutyczne z wykorzystaniem najnowszych modeli NLP.
     
-    generated_question = _generate_contextual_question(
-        conversation_text, 
-        emotion_strategy, 
-        focus_areas_text
-    )
+    Args:
+        context: Lista poprzednich elementów konwersacji.
+               Każdy element to słownik z kluczami 'question', 'response' i 'date'.
+    
+    Returns:
+        Tuple zawierający:
+            - wygenerowane pytanie (str)
+            - metadane o generowaniu (dict)
+    """
+    # Jeśli nie ma kontekstu, wygeneruj pytanie inicjujące
+    if not context:
+        if _use_generated_initial_question():
+            return await _generate_initial_question_async(), {"model": "advanced", "context_used": False}
+        # Losowe pytanie z domyślnych
+        return random.choice(DEFAULT_QUESTIONS), {"model": "default", "context_used": False}
+    
+    # Analizuj stan emocjonalny na podstawie kontekstu
+    emotional_analysis = await analyze_emotional_state_async(context)
+    
+    cached_question, cache_key, conversation_text = _advanced_question_input(context)
+    if cached_question is not None:
+        return cached_question, {"model": "cached", "context_used": True, "emotional_analysis": emotional_analysis}
+    
+    generated_question = await _generate_contextual_question_async(conversation_text,
+                                                                   *_question_focus(emotional_analysis))
     
     # Dodaj do cache
     if generated_question:
@@ -278,62 +373,14 @@ def generate_advanced_question(context: Optional[List[Dict[str, Any]]] = None) -
         "emotional_analysis": emotional_analysis
     }
 
-def _generate_initial_question() -> str:
+async def _generate_initial_question_async() -> str:
     """Generuje pierwsze pytanie terapeutyczne bez kontekstu wcześniejszej rozmowy."""
+    question = await _ask_providers_async(*_initial_question_requests(), _parse_question, "generowania pytania inicjującego")
     
-    prompt = """
-    Wygeneruj jedno głębokie, refleksyjne pytanie terapeutyczne w języku polskim, 
-    które mogłoby rozpocząć rozmowę z nowym użytkownikiem aplikacji wsparcia psychologicznego.
-    
-    Pytanie powinno być empatyczne, otwarte i zachęcające do głębszej refleksji nad sobą
-    i swoim samopoczuciem.
-    
-    Unikaj pytań zamkniętych i powierzchownych. Pytanie powinno być napisane w drugiej
-    osobie liczby pojedynczej (Ty).
-    
-    Odpowiedz tylko samym pytaniem, bez dodatkowego tekstu.
-    """
-    
-    # Strategia 1: Użyj Claude jeśli dostępny (preferowany)
-    if HAS_ANTHROPIC and anthropic_client:
-        try:
-            message = anthropic_client.messages.create(
-                model=NLPModels.CLAUDE_LATEST,
-                max_tokens=150,
-                temperature=0.7,
-                system="Jesteś empatycznym polskim psychoterapeutą specjalizującym się w terapii poznawczo-behawioralnej i refleksyjnym podejściu do problemów życiowych.",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            return message.content[0].text.strip()
-        
-        except Exception as e:
-            logger.error(f"Błąd podczas generowania pytania inicjującego z Claude: {str(e)}")
-    
-    # Strategia 2: Użyj OpenAI jako backup
-    if HAS_OPENAI and openai_client:
-        try:
-            response = openai_client.chat.completions.create(
-                model=NLPModels.GPT4_LATEST,
-                messages=[
-                    {"role": "system", "content": "Jesteś empatycznym polskim psychoterapeutą specjalizującym się w zadawaniu pytań, które skłaniają do głębokiej refleksji."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=150,
-                temperature=0.7
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            logger.error(f"Błąd podczas generowania pytania inicjującego z OpenAI: {str(e)}")
-    
-    # Strategia 3: Użyj domyślnego pytania, jeśli wszystko zawiedzie
-    return random.choice(DEFAULT_QUESTIONS)
+    # Użyj domyślnego pytania, jeśli wszystko zawiedzie
+    return question or random.choice(DEFAULT_QUESTIONS)
 
-def _generate_contextual_question(conversation_text: str, emotion_strategy: str, focus_areas: str) -> Optional[str]:
+async def _generate_contextual_question_async(conversation_text: str, emotion_strategy: str, focus_areas: str) -> Optional[str]:
     """
     Generuje kontekstowe pytanie na podstawie analizy rozmowy i stanu emocjonalnego.
     
@@ -345,58 +392,6 @@ def _generate_contextual_question(conversation_text: str, emotion_strategy: str,
     Returns:
         Wygenerowane pytanie lub None w przypadku błędu
     """
-    
-    system_prompt = f"""
-    Jesteś doświadczonym polskim psychoterapeutą prowadzącym terapeutyczną rozmowę.
-    Twoim zadaniem jest wygenerowanie pojedynczego, głębokiego pytania w języku polskim,
-    które będzie kontynuacją rozmowy z pacjentem.
-    
-    Na podstawie dostarczonego fragmentu rozmowy, stwórz pytanie, które:
-    1. Bezpośrednio odnosi się do tematów poruszonych przez pacjenta
-    2. {emotion_strategy}
-    3. Skupia się na jednym lub więcej z następujących obszarów: {focus_areas}
-    4. Jest sformułowane w sposób otwarty (nie może być odpowiedzią tak/nie)
-    5. Nie zawiera osądów ani założeń
-    6. Jest empatyczne i pełne zrozumienia
-    
-    Wygeneruj wyłącznie jedno pytanie, bez wprowadzenia ani wyjaśnień.
-    """
-    
-    # Strategia 1: Użyj Claude jeśli dostępny (preferowany)
-    if HAS_ANTHROPIC and anthropic_client:
-        try:
-            message = anthropic_client.messages.create(
-                model=NLPModels.CLAUDE_LATEST,
-                max_tokens=200,
-                temperature=0.7,
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": conversation_text}
-                ]
-            )
-            
-            return message.content[0].text.strip()
-        
-        except Exception as e:
-            logger.error(f"Błąd podczas generowania kontekstowego pytania z Claude: {str(e)}")
-    
-    # Strategia 2: Użyj OpenAI jako backup
-    if HAS_OPENAI and openai_client:
-        try:
-            response = openai_client.chat.completions.create(
-                model=NLPModels.GPT4_LATEST,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": conversation_text}
-                ],
-                max_tokens=200,
-                temperature=0.7
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            logger.error(f"Błąd podczas generowania kontekstowego pytania z OpenAI: {str(e)}")
-    
-    # Jeśli wszystko zawiedzie, zwróć None (caller powinien użyć domyślnego pytania)
-    return None
\ No newline at end of file
+    return await _ask_providers_async(
+        *_contextual_question_requests(conversation_text, emotion_strategy, focus_areas),
+        _parse_question, "generowania kontekstowego pytania")
@@ -1,10 +1,10 @@
 import os
+import asyncio
 import logging
 from datetime import datetime
 from flask import Flask, render_template, request, redirect, url_for, flash, session
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
-from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Configure logging
@@ -17,7 +17,10 @@ db = SQLAlchemy(model_class=Base)
 # create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key_for_development")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
+# Liczba zaufanych proxy przed aplikacją: request.remote_addr (m.in. limit prób logowania na adres IP)
+# to adres klienta z X-Forwarded-For dodany przez ostatnie z nich; 0 przy wystawieniu bez proxy
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 1))
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=1, x_host=1)  # needed for url_for to generate with https
 
 # Configure SQLite database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///therapy.db")
@@ -27,21 +30,46 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Budżet czasu (s) na wywołania LLM przy renderowaniu strony głównej
+INDEX_DEADLINE_SECONDS = float(os.environ.get("INDEX_DEADLINE_SECONDS", 2.5))
+
 # initialize the app with the extension
 db.init_app(app)
 
-with app.app_context():
-    # Import models and create tables
-    from models import User, Conversation, PsychologicalAnalysis
-    db.create_all()
+# Metryki Prometheus (/metrics) i pomiar czasu żądań
+import metrics
+metrics.init_app(app)
+
+# Rozbicie czasu żądań na fazy, profilowanie na żądanie administratora i log wolnych żądań
+import profiling
+profiling.init_app(app)
+
+# Spany żądań, zapytań SQL, wywołań LLM i renderowania (OTLP/JSON do TRACE_FILE)
+import tracing
+tracing.init_app(app, db)
+
+# Budżet zapytań SQL na żądanie i wykrywanie N+1
+import query_budget
+query_budget.init_app(app, db)
+
+# Rozgrzewanie i endpoint gotowości /readyz (schemat tworzy python init_db.py)
+import warmup
+warmup.init_app(app, db)
+
+# Import models
+from models import User, Conversation, PsychologicalAnalysis
 
 # Import therapy functionality
 from therapy import generate_question
-from claude_api import generate_claude_question
-from psychology import generate_psychological_insight, get_emotional_intelligence_score
+from claude_api import generate_claude_question_async
+from psychology import (generate_psychological_insight_async, build_analysis, store_analysis, get_answer_watermark,
+                        is_default_analysis)
 from visualization import generate_emotion_chart, generate_emotional_intelligence_progress
 from wordcloud_analyzer import analyze_user_responses_keywords
 
+# Hashowanie haseł w osobnej puli wątków i limit prób logowania
+import passwords
+
 # Placeholder for quote generation - replace with actual API integration
 def generate_therapeutic_quote():
     quotes = [
@@ -61,9 +89,14 @@ def inject_now():
     return {'now': datetime.now()}
 
 # Routes
+# Widoki wywołujące LLM są asynchroniczne (flask[async]): wywołania API czekają na pętli
+# zdarzeń llm_client, więc pytanie i cytat są pobierane równolegle bez dodatkowych wątków.
+# Widok nadal zajmuje wątek workera gunicorna (gthread) do końca żądania.
 @app.route('/')
-def index():
+async def index():
     if 'user_id' in session:
+        from llm_client import Deadline
+        deadline = Deadline(INDEX_DEADLINE_SECONDS)
         user_id = session['user_id']
         from models import User, Conversation
         user = User.query.get(user_id)
@@ -73,7 +106,8 @@ def index():
 
         # Get conversation history for context
         conversation_history = Conversation.query.filter_by(user_id=user_id).order_by(Conversation.timestamp.desc()).limit(5).all()
-        context = [{"question": c.question, "response": c.response, "date": c.timestamp} for c in conversation_history]
+        context = [{"id": c.id, "question": c.question, "response": c.response, "date": c.timestamp}
+                   for c in conversation_history]
 
         # Check if we need a new question (if last entry has a response or no entries exist)
         new_question = None
@@ -85,20 +119,30 @@ def index():
                 session.pop('user_id', None)
                 return redirect(url_for('login'))
 
-            # Użyj Claude do generowania pytania, jeśli dostępny, lub standardowego mechanizmu
-            try:
-                new_question = generate_claude_question(context if context else None)
-                if not new_question or len(new_question.strip()) == 0:
-                    from therapy import DEFAULT_FIRST_QUESTIONS
-                    import random
-                    new_question = random.choice(DEFAULT_FIRST_QUESTIONS)
-                    logging.warning("Otrzymano puste pytanie - użyto pytania domyślnego")
-            except Exception as e:
+            # Pytanie i cytat są niezależne: generowane równolegle we wspólnym budżecie czasu
+            # (deadline), każde z własnym zastępstwem, gdy nie zdąży. Użyj Claude do generowania
+            # pytania, jeśli dostępny, lub standardowego mechanizmu
+            from quotes import generate_therapeutic_quote_async
+            new_question, quote = await asyncio.gather(
+                generate_claude_question_async(context if context else None, deadline=deadline, user_id=user_id),
+                generate_therapeutic_quote_async(deadline=deadline),
+                return_exceptions=True,
+            )
+            if isinstance(new_question, Exception):
                 # W przypadku jakichkolwiek błędów użyj domyślnego pytania
-                logging.error(f"Błąd podczas generowania pytania: {str(e)}")
+                logging.error(f"Błąd podczas generowania pytania: {str(new_question)}")
+                from therapy import DEFAULT_FIRST_QUESTIONS
+                import random
+                new_question = random.choice(DEFAULT_FIRST_QUESTIONS)
+            elif not new_question or len(new_question.strip()) == 0:
                 from therapy import DEFAULT_FIRST_QUESTIONS
                 import random
                 new_question = random.choice(DEFAULT_FIRST_QUESTIONS)
+                logging.warning("Otrzymano puste pytanie - użyto pytania domyślnego")
+            if isinstance(quote, Exception):
+                # Szablon wyświetla wtedy cytat domyślny
+                logging.error(f"Błąd podczas generowania cytatu: {str(quote)}")
+                quote = None
 
             # Create a new conversation entry with the question
             new_conversation = Conversation(
@@ -111,10 +155,6 @@ def index():
                 db.session.add(new_conversation)
                 db.session.commit()
                 last_conversation = new_conversation
-
-                # Generate therapeutic quote
-                from quotes import generate_therapeutic_quote
-                quote = generate_therapeutic_quote()
                 return render_template('index.html', user=user, conversation=last_conversation, quote=quote)
             except Exception as e:
                 db.session.rollback()
@@ -171,14 +211,43 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
 
+        ip = request.remote_addr
+
+        # Limit prób sprawdzany przed liczeniem skrótu
+        if passwords.login_retry_after(username, ip):
+            metrics.LOGIN_ATTEMPTS.labels("throttled").inc()
+            flash('Zbyt wiele nieudanych prób logowania. Spróbuj ponownie za kilka minut.', 'danger')
+            return render_template('login.html'), 429
+
         from models import User
         user = User.query.filter_by(username=username).first()
 
-        if user and check_password_hash(user.password_hash, password):
-            session['user_id'] = user.id
+        try:
+            valid = passwords.verify_password(user.password_hash if user else None, password)
+            user_id = user.id if valid else None
+        except passwords.PasswordHashingBusy:
+            metrics.LOGIN_ATTEMPTS.labels("busy").inc()
+            flash('Serwer jest chwilowo przeciążony. Spróbuj zalogować się ponownie za chwilę.', 'warning')
+            return render_template('login.html'), 503
+
+        if valid and passwords.needs_rehash(user.password_hash):
+            # Zmienione parametry skrótu - przeliczenie przy okazji udanego logowania
+            try:
+                user.password_hash = passwords.hash_password(password)
+                db.session.commit()
+            except passwords.PasswordHashingBusy:
+                # Hasło jest poprawne - logowanie trwa dalej, skrót zostanie przeliczony przy kolejnym
+                logging.info(f"Pominięto przeliczenie skrótu hasła użytkownika {user_id} (kolejka hashowania pełna)")
+
+        if valid:
+            passwords.record_login_success(username)
+            metrics.LOGIN_ATTEMPTS.labels("success").inc()
+            session['user_id'] = user_id
             flash('Zalogowano pomyślnie!', 'success')
             return redirect(url_for('index'))
         else:
+            passwords.record_login_failure(username, ip)
+            metrics.LOGIN_ATTEMPTS.labels("failure").inc()
             flash('Nieprawidłowa nazwa użytkownika lub hasło.', 'danger')
 
     return render_template('login.html')
@@ -199,10 +268,16 @@ def register():
         elif existing_email:
             flash('Email jest już zarejestrowany.', 'danger')
         else:
+            try:
+                password_hash = passwords.hash_password(password)
+            except passwords.PasswordHashingBusy:
+                flash('Serwer jest chwilowo przeciążony. Spróbuj ponownie za chwilę.', 'warning')
+                return render_template('register.html'), 503
+
             new_user = User(
                 username=username,
                 email=email,
-                password_hash=generate_password_hash(password)
+                password_hash=password_hash
             )
             db.session.add(new_user)
             db.session.commit()
@@ -213,7 +288,7 @@ def register():
     return render_template('register.html')
 
 @app.route('/analysis')
-def analysis():
+async def analysis():
     if 'user_id' not in session:
         flash('Musisz być zalogowany, aby zobaczyć analizę psychologiczną.', 'danger')
         return redirect(url_for('index'))
@@ -225,42 +300,41 @@ def analysis():
     # Sprawdź, czy chcemy wygenerować nową analizę
     regenerate = request.args.get('regenerate') == 'True'
 
+    # Najnowsza odpowiedź użytkownika - odczytana przed generowaniem, więc odpowiedź
+    # zapisana w trakcie generowania najwyżej wymusi kolejną analizę, a nie zostanie pominięta
+    watermark_id, watermark_at = get_answer_watermark(user_id, db)
+
     # Pobierz najnowszą analizę lub wygeneruj nową
+    previous_analysis = PsychologicalAnalysis.query.filter_by(user_id=user_id).order_by(PsychologicalAnalysis.timestamp.desc()).first()
     latest_analysis = None
     if not regenerate:
-        latest_analysis = PsychologicalAnalysis.query.filter_by(user_id=user_id).order_by(PsychologicalAnalysis.timestamp.desc()).first()
+        latest_analysis = previous_analysis
         
-        # Sprawdź czy analiza jest aktualna (nie starsza niż ostatnia odpowiedź)
-        if latest_analysis:
-            last_response = Conversation.query.filter_by(user_id=user_id, response=None).order_by(Conversation.timestamp.desc()).first()
-            if last_response and last_response.timestamp > latest_analysis.timestamp:
-                latest_analysis = None  # Wymusi nową analizę
+        # Sprawdź czy analiza obejmuje najnowszą odpowiedź
+        if latest_analysis and latest_analysis.is_stale(watermark_id):
+            latest_analysis = None  # Wymusi nową analizę
 
     # Jeśli nie mamy analizy lub chcemy ją zregenerować
     if not latest_analysis or regenerate:
         try:
             # Generuj nową analizę
-            analysis_data = generate_psychological_insight(user_id, db)
+            analysis_data = await generate_psychological_insight_async(user_id, db)
 
             # Sprawdź, czy otrzymano komunikat o błędzie API w insights
             has_api_error = any("API" in insight for insight in analysis_data.get("insights", []))
 
-            # Oblicz wynik inteligencji emocjonalnej
-            ei_score = get_emotional_intelligence_score(analysis_data)
-
-            # Zapisz analizę w bazie danych
-            new_analysis = PsychologicalAnalysis(
-                user_id=user_id,
-                emotional_intelligence_score=ei_score
-            )
-            new_analysis.set_analysis(analysis_data)
-
-            db.session.add(new_analysis)
-            db.session.commit()
-
-            latest_analysis = new_analysis
-
-            if regenerate:
+            if is_default_analysis(analysis_data):
+                # Analiza zastępcza (błąd API) nie jest zapisywana (jak w batch_analysis) - historia
+                # i wykresy nie rosną przy każdym wejściu, a kolejne wejście spróbuje ponownie.
+                # Wyświetlana jest poprzednia analiza, a bez niej - dane zastępcze.
+                latest_analysis = previous_analysis or build_analysis(user_id, analysis_data)
+                if regenerate:
+                    flash('Nie udało się zaktualizować analizy - usługi AI są chwilowo niedostępne.', 'warning')
+            else:
+                # Zapisz analizę w bazie danych (z wynikiem inteligencji emocjonalnej i wynikami cech osobowości)
+                latest_analysis = store_analysis(user_id, analysis_data, db, watermark=(watermark_id, watermark_at))
+
+            if regenerate and latest_analysis is not previous_analysis:
                 if has_api_error:
                     flash('Twoja analiza została częściowo zaktualizowana. Wystąpiły problemy z usługami AI - używamy mechanizmu awaryjnego.', 'warning')
                 else:
@@ -268,22 +342,14 @@ def analysis():
         except Exception as e:
             logging.error(f"Błąd podczas generowania analizy: {str(e)}")
             flash('Wystąpił błąd podczas generowania analizy. Spróbuj ponownie później.', 'danger')
+            latest_analysis = latest_analysis or previous_analysis
             if latest_analysis is None:
-                # Jeśli nie mamy żadnej analizy, utwórz minimalną z komunikatem o błędzie
+                # Jeśli nie mamy żadnej analizy, wyświetl (bez zapisu) minimalną z komunikatem o błędzie
                 from psychology import DEFAULT_ANALYSIS
                 analysis_data = DEFAULT_ANALYSIS.copy()
                 analysis_data["insights"] = ["Wystąpił błąd podczas generowania analizy. Spróbuj ponownie później."]
 
-                new_analysis = PsychologicalAnalysis(
-                    user_id=user_id,
-                    emotional_intelligence_score=50
-                )
-                new_analysis.set_analysis(analysis_data)
-
-                db.session.add(new_analysis)
-                db.session.commit()
-
-                latest_analysis = new_analysis
+                latest_analysis = build_analysis(user_id, analysis_data, ei_score=50)
 
     # Przygotuj dane dla szablonu
     try:
@@ -404,17 +470,20 @@ def test_reminder():
 
     user_id = session['user_id']
     from models import User
-    from reminders import send_reminder
+    from reminders import enqueue_reminder, deliver_in_background
 
     user = User.query.get(user_id)
 
-    # Wyślij testowe przypomnienie
-    success, error = send_reminder(user)
+    # Dodaj testowe przypomnienie do kolejki - wysyłka odbywa się poza żądaniem HTTP.
+    # Klucz z dokładnością do minuty chroni przed podwójnym kliknięciem.
+    idempotency_key = f"test:{user.id}:{datetime.now().strftime('%Y%m%d%H%M')}"
+    _, created = enqueue_reminder(user, idempotency_key)
 
-    if success:
-        flash('Testowe powiadomienie zostało wysłane pomyślnie.', 'success')
+    if created:
+        deliver_in_background(app)
+        flash('Testowe powiadomienie zostało dodane do kolejki. Status wysyłki pojawi się w historii przypomnień.', 'info')
     else:
-        flash(f'Błąd podczas wysyłania powiadomienia: {error}', 'danger')
+        flash('Testowe powiadomienie jest już w kolejce.', 'info')
 
     return redirect(url_for('reminder_settings'))
 
@@ -422,4 +491,17 @@ def test_reminder():
 def logout():
     session.pop('user_id', None)
     flash('Wylogowano pomyślnie.', 'success')
-    return redirect(url_for('index'))
\ No newline at end of file
+    return redirect(url_for('index'))
+
+def start_background_services():
+    """
+    Uruchamia wątki działające w tle w bieżącym procesie.
+
+    Wołane po fork w każdym workerze (gunicorn.conf.py: post_worker_init)
+    lub przez serwer deweloperski - wątki nie przetrwałyby fork z procesu nadrzędnego.
+    """
+    # Harmonogram przypomnień jako wątek w aplikacji (alternatywa dla osobnego procesu scheduler.py).
+    # Przy wielu workerach wysyła tylko ten, który trzyma dzierżawę w bazie danych.
+    if os.environ.get("REMINDER_SCHEDULER_IN_APP", "").lower() in ("1", "true", "yes"):
+        from scheduler import start_scheduler_thread
+        start_scheduler_thread(app)
@@ -0,0 +1,101 @@
+"""
+Wypełnienie tabeli EmotionIntensity dla analiz zapisanych przed jej wprowadzeniem.
+
+Analizy są czytane partiami po kluczu głównym (WHERE id > ostatnie_id).
+Dla każdej partii dotychczasowe wiersze intensywności są usuwane i wstawiane
+ponownie jednym INSERT (executemany), więc skrypt można bezpiecznie uruchamiać
+wielokrotnie.
+
+Przykłady:
+    python backfill_emotion_intensities.py
+    python backfill_emotion_intensities.py --batch-size 5000
+"""
+
+import json
+import time
+import logging
+import argparse
+
+from sqlalchemy import select, delete, bindparam
+
+from visualization import extract_emotion_intensities
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def backfill(engine, batch_size=1000):
+    """
+    Odbudowuje intensywności emocji wszystkich analiz.
+
+    Args:
+        engine: Silnik SQLAlchemy
+        batch_size (int): Liczba analiz w partii
+
+    Returns:
+        dict: Podsumowanie (liczba analiz, wstawionych wierszy, czas)
+    """
+    from models import PsychologicalAnalysis, EmotionIntensity
+
+    analysis_table = PsychologicalAnalysis.__table__
+    intensity_table = EmotionIntensity.__table__
+    select_batch = (select(analysis_table.c.id, analysis_table.c.user_id,
+                           analysis_table.c.timestamp, analysis_table.c.analysis_data)
+                    .where(analysis_table.c.id > bindparam("last_id"))
+                    .order_by(analysis_table.c.id)
+                    .limit(batch_size))
+
+    summary = {"analyses": 0, "rows": 0, "invalid": 0}
+    start = time.perf_counter()
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            analyses = conn.execute(select_batch, {"last_id": last_id}).all()
+        if not analyses:
+            break
+        first_id, last_id = analyses[0].id, analyses[-1].id
+
+        rows = []
+        for analysis in analyses:
+            try:
+                data = json.loads(analysis.analysis_data)
+            except (TypeError, ValueError):
+                summary["invalid"] += 1
+                continue
+            if not isinstance(data, dict):
+                summary["invalid"] += 1
+                continue
+            rows.extend({
+                "analysis_id": analysis.id,
+                "user_id": analysis.user_id,
+                "timestamp": analysis.timestamp,
+                "emotion": emotion,
+                "intensity": intensity,
+            } for emotion, intensity in extract_emotion_intensities(data))
+
+        with engine.begin() as conn:
+            conn.execute(delete(intensity_table).where(intensity_table.c.analysis_id.between(first_id, last_id)))
+            if rows:
+                conn.execute(intensity_table.insert(), rows)
+
+        summary["analyses"] += len(analyses)
+        summary["rows"] += len(rows)
+        logger.info(f"Przetworzono {summary['analyses']} analiz (do id {last_id}), "
+                    f"zapisano {summary['rows']} intensywności")
+
+    elapsed = time.perf_counter() - start
+    summary["elapsed_s"] = elapsed
+    summary["analyses_per_s"] = summary["analyses"] / elapsed if elapsed else 0.0
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wypełnienie tabeli intensywności emocji z zapisanych analiz")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Liczba analiz w partii")
+    args = parser.parse_args()
+
+    from app import app, db
+    with app.app_context():
+        result = backfill(db.engine, batch_size=args.batch_size)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,410 @@
+"""
+Wsadowa analiza psychologiczna użytkowników poza godzinami szczytu.
+
+Analiza jest wykonywana dla użytkowników, których najnowsza odpowiedź nie jest
+objęta żadną zapisaną analizą (znacznik PsychologicalAnalysis.last_conversation_id),
+więc wejście na /analysis w godzinach szczytu nie wymaga już wywołania LLM.
+
+Tryby:
+    threads - analyze_user_responses_async dla wielu użytkowników naraz (BATCH_ANALYSIS_WORKERS
+              wątków, wspólna pula połączeń i polityka ponawiania llm_client),
+    batch   - jedna partia Anthropic Message Batches API na stronę użytkowników
+              (tańsze, wyniki zwykle w ciągu minut-godzin; lokalnie: fake_llm_server.py).
+
+Użytkownicy są przeglądani stronami po ID (keyset), a po każdej stronie stan
+jest zapisywany w pliku checkpoint. Przerwane uruchomienie (SIGTERM, koniec okna
+BATCH_ANALYSIS_WINDOW) jest wznawiane od zapisanego miejsca, łącznie z odbiorem
+wyników wysłanej już partii. Analiza użytkownika zapisana przed przerwaniem
+przesuwa jego znacznik, więc nie jest powtarzana.
+
+Przykłady:
+    python batch_analysis.py --mode threads --workers 8
+    python batch_analysis.py --mode batch --ignore-window
+    LLM_BASE_URL=http://127.0.0.1:8089 python batch_analysis.py --mode batch --restart
+"""
+
+import os
+import json
+import time
+import signal
+import logging
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dt_time
+
+from sqlalchemy import select, func, or_
+
+from tracing import span
+from metrics import BATCH_ANALYSES
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Liczba równoległych analiz w trybie threads
+BATCH_ANALYSIS_WORKERS = int(os.environ.get("BATCH_ANALYSIS_WORKERS", 4))
+
+# Liczba użytkowników przeglądanych na stronę (w trybie batch: maksymalny rozmiar jednej partii)
+BATCH_ANALYSIS_PAGE_SIZE = int(os.environ.get("BATCH_ANALYSIS_PAGE_SIZE", 200))
+
+# Okno czasowe poza szczytem (czas lokalny serwera), np. "01:00-06:00"; pusta wartość = bez ograniczeń
+BATCH_ANALYSIS_WINDOW = os.environ.get("BATCH_ANALYSIS_WINDOW", "01:00-06:00")
+
+# Plik stanu (domyślnie <instance>/batch_analysis_checkpoint.json)
+BATCH_ANALYSIS_CHECKPOINT = os.environ.get("BATCH_ANALYSIS_CHECKPOINT")
+
+# Odstęp między sprawdzeniami stanu partii Message Batches (s)
+BATCH_POLL_INTERVAL = float(os.environ.get("BATCH_POLL_INTERVAL", 30))
+
+# Minimalna liczba odpowiedzi potrzebna do analizy
+MIN_RESPONSES = 2
+
+_stop_event = threading.Event()
+
+
+def parse_window(spec):
+    """Zwraca (początek, koniec) okna "HH:MM-HH:MM" albo None dla pustej wartości."""
+    if not spec:
+        return None
+    start, end = spec.split("-", 1)
+    return dt_time.fromisoformat(start.strip()), dt_time.fromisoformat(end.strip())
+
+
+def in_window(window, now=None):
+    """Sprawdza, czy bieżąca godzina mieści się w oknie (także oknie przechodzącym przez północ)."""
+    if window is None:
+        return True
+    current = (now or datetime.now()).time()
+    start, end = window
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+class Checkpoint:
+    """Stan uruchomienia zapisywany atomowo do pliku JSON."""
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.state = {
+            "mode": mode,
+            "last_user_id": 0,
+            "started_at": datetime.now().isoformat(),
+            "completed_at": None,
+            "scanned": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "elapsed_s": 0.0,
+            "pending_batch": None,
+        }
+
+    def load(self):
+        """Wczytuje niedokończone uruchomienie; zwraca True, jeśli jest co wznawiać."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return False
+        except ValueError as e:
+            logger.error(f"Nieczytelny plik checkpoint {self.path}, zaczynam od początku: {str(e)}")
+            return False
+        if saved.get("completed_at"):
+            return False
+        if saved.get("mode") != self.state["mode"] and saved.get("pending_batch"):
+            logger.warning(f"Checkpoint dotyczy trybu {saved.get('mode')} - wznawiam w tym trybie, "
+                           f"by odebrać wysłaną partię")
+        self.state.update(saved)
+        return True
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def select_stale_users(db, after_user_id, page_size):
+    """
+    Zwraca stronę użytkowników z nieprzeanalizowanymi odpowiedziami.
+
+    Strona obejmuje kolejnych `page_size` użytkowników po ID (keyset), więc koszt
+    zapytań nie rośnie z liczbą już przejrzanych stron.
+
+    Returns:
+        tuple: (lista ID użytkowników do analizy, ostatnie przejrzane ID albo None na końcu tabeli)
+    """
+    from models import User, Conversation, PsychologicalAnalysis
+
+    user_ids = db.session.execute(
+        select(User.id).where(User.id > after_user_id).order_by(User.id).limit(page_size)
+    ).scalars().all()
+    if not user_ids:
+        return [], None
+    first_id, last_id = user_ids[0], user_ids[-1]
+
+    answers = (select(Conversation.user_id,
+                      func.max(Conversation.id).label("latest_id"),
+                      func.count(Conversation.id).label("answers"))
+               .where(Conversation.user_id.between(first_id, last_id), Conversation.response.isnot(None))
+               .group_by(Conversation.user_id)
+               .subquery())
+    covered = (select(PsychologicalAnalysis.user_id,
+                      func.max(PsychologicalAnalysis.last_conversation_id).label("covered_id"))
+               .where(PsychologicalAnalysis.user_id.between(first_id, last_id))
+               .group_by(PsychologicalAnalysis.user_id)
+               .subquery())
+    stale = db.session.execute(
+        select(answers.c.user_id)
+        .outerjoin(covered, covered.c.user_id == answers.c.user_id)
+        .where(answers.c.answers >= MIN_RESPONSES,
+               or_(covered.c.covered_id.is_(None), covered.c.covered_id < answers.c.latest_id))
+        .order_by(answers.c.user_id)
+    ).scalars().all()
+    return stale, last_id
+
+
+def _analyze_user(app, user_id):
+    """Analizuje i zapisuje jednego użytkownika (tryb threads); zwraca (sukces, czas)."""
+    from app import db
+    from psychology import (get_answer_watermark, generate_psychological_insight_async, store_analysis,
+                            is_default_analysis)
+
+    start = time.perf_counter()
+    with app.app_context(), span("batch_analysis.user", attributes={"user.id": user_id}) as current:
+        try:
+            watermark = get_answer_watermark(user_id, db)
+            analysis = asyncio.run(generate_psychological_insight_async(user_id, db, use_cache=False))
+            if is_default_analysis(analysis):
+                # Dane zastępcze (błąd API) nie są zapisywane - użytkownik zostanie przeanalizowany ponownie
+                current.set_attribute("batch_analysis.outcome", "fallback")
+                return False, time.perf_counter() - start
+            store_analysis(user_id, analysis, db, watermark=watermark)
+            return True, time.perf_counter() - start
+        except Exception as e:
+            db.session.rollback()
+            current.record_exception(e)
+            logger.error(f"Błąd analizy wsadowej użytkownika {user_id}: {str(e)}")
+            return False, time.perf_counter() - start
+
+
+def _run_threads_page(app, executor, user_ids, latencies):
+    succeeded = 0
+    for ok, seconds in executor.map(lambda uid: _analyze_user(app, uid), user_ids):
+        latencies.append(seconds)
+        succeeded += ok
+        BATCH_ANALYSES.labels(mode="threads", outcome="success" if ok else "failure").inc()
+    return succeeded, len(user_ids) - succeeded
+
+
+def _submit_batch(user_ids):
+    """Buduje i wysyła partię Message Batches dla użytkowników; zwraca opis partii do checkpointu."""
+    from app import db
+    from psychology import load_user_responses, get_answer_watermark, build_analysis_request
+    from llm_client import create_message_batch
+
+    requests = []
+    users = {}
+    for user_id in user_ids:
+        watermark_id, watermark_at = get_answer_watermark(user_id, db)
+        custom_id = f"user-{user_id}"
+        requests.append({"custom_id": custom_id, "params": build_analysis_request(load_user_responses(user_id, db))})
+        users[custom_id] = [user_id, watermark_id, watermark_at.isoformat() if watermark_at else None]
+
+    batch = create_message_batch(requests)
+    logger.info(f"Wysłano partię {batch.id} z analizami {len(requests)} użytkowników")
+    return {"id": batch.id, "submitted_at": datetime.now().isoformat(), "users": users}
+
+
+def _collect_batch(pending):
+    """Czeka na zakończenie partii i zapisuje jej wyniki; zwraca (sukcesy, porażki)."""
+    from app import db
+    from psychology import parse_analysis_content, store_analysis
+    from llm_client import retrieve_message_batch, message_batch_results
+
+    while True:
+        batch = retrieve_message_batch(pending["id"])
+        if batch.processing_status == "ended":
+            break
+        if _stop_event.wait(BATCH_POLL_INTERVAL):
+            raise KeyboardInterrupt("Przerwano oczekiwanie na partię")
+        logger.info(f"Partia {pending['id']}: {batch.request_counts.processing} żądań w toku")
+
+    succeeded = 0
+    seen = set()
+    for item in message_batch_results(pending["id"]):
+        entry = pending["users"].get(item.custom_id)
+        if entry is None:
+            continue
+        seen.add(item.custom_id)
+        user_id, watermark_id, watermark_at = entry
+
+        analysis = None
+        if item.result.type == "succeeded":
+            analysis = parse_analysis_content(item.result.message.content[0].text)
+        else:
+            logger.warning(f"Analiza użytkownika {user_id} w partii nie powiodła się: {item.result.type}")
+
+        if analysis is not None:
+            try:
+                store_analysis(user_id, analysis, db, watermark=(
+                    watermark_id, datetime.fromisoformat(watermark_at) if watermark_at else None))
+                succeeded += 1
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Nie można zapisać analizy użytkownika {user_id}: {str(e)}")
+                analysis = None
+        BATCH_ANALYSES.labels(mode="batch", outcome="success" if analysis is not None else "failure").inc()
+
+    failed = len(pending["users"]) - succeeded
+    missing = len(pending["users"]) - len(seen)
+    if missing:
+        logger.warning(f"Partia {pending['id']}: brak wyników dla {missing} użytkowników")
+    return succeeded, failed
+
+
+def run(app, mode="threads", workers=None, page_size=None, window=None, checkpoint_path=None,
+        restart=False, max_users=None):
+    """
+    Przetwarza użytkowników z nieaktualną analizą.
+
+    Args:
+        app: Aplikacja Flask
+        mode (str): 'threads' albo 'batch'
+        workers (int, optional): Liczba wątków w trybie threads
+        page_size (int, optional): Liczba użytkowników na stronę (partię)
+        window (tuple, optional): Okno czasowe z parse_window (None = bez ograniczeń)
+        checkpoint_path (str, optional): Plik stanu
+        restart (bool): Ignoruj zapisany stan i zacznij od początku
+        max_users (int, optional): Zakończ po przeanalizowaniu tylu użytkowników
+
+    Returns:
+        dict: Raport przepustowości
+    """
+    from app import db
+
+    workers = workers or BATCH_ANALYSIS_WORKERS
+    page_size = page_size or BATCH_ANALYSIS_PAGE_SIZE
+    checkpoint_path = checkpoint_path or BATCH_ANALYSIS_CHECKPOINT or os.path.join(
+        app.instance_path, "batch_analysis_checkpoint.json")
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+
+    checkpoint = Checkpoint(checkpoint_path, mode)
+    if not restart and checkpoint.load():
+        mode = checkpoint.state["mode"]
+        logger.info(f"Wznawiam analizę wsadową od użytkownika {checkpoint.state['last_user_id']}")
+    state = checkpoint.state
+
+    latencies = []
+    run_start = time.perf_counter()
+    previous_elapsed = state["elapsed_s"]
+    run_counts = {"succeeded": 0, "failed": 0}
+    stop_reason = "completed"
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-analysis") if mode == "threads" else None
+
+    def record(succeeded, failed):
+        run_counts["succeeded"] += succeeded
+        run_counts["failed"] += failed
+        state["succeeded"] += succeeded
+        state["failed"] += failed
+
+    try:
+        with app.app_context():
+            if state.get("pending_batch"):
+                record(*_collect_batch(state["pending_batch"]))
+                state["pending_batch"] = None
+                checkpoint.save()
+
+            while True:
+                if _stop_event.is_set():
+                    stop_reason = "stopped"
+                    break
+                if not in_window(window):
+                    stop_reason = "outside_window"
+                    break
+                if max_users is not None and run_counts["succeeded"] + run_counts["failed"] >= max_users:
+                    stop_reason = "max_users"
+                    break
+
+                user_ids, last_id = select_stale_users(db, state["last_user_id"], page_size)
+                db.session.remove()
+                if last_id is None:
+                    state["completed_at"] = datetime.now().isoformat()
+                    break
+                remaining = None if max_users is None else max_users - run_counts["succeeded"] - run_counts["failed"]
+                if remaining is not None and len(user_ids) > remaining:
+                    # Niedokończona strona: następne uruchomienie zaczyna od pierwszego pominiętego użytkownika
+                    user_ids = user_ids[:remaining]
+                    last_id = user_ids[-1]
+
+                if user_ids:
+                    if mode == "threads":
+                        record(*_run_threads_page(app, executor, user_ids, latencies))
+                    else:
+                        state["pending_batch"] = _submit_batch(user_ids)
+                        state["last_user_id"] = last_id
+                        checkpoint.save()
+                        record(*_collect_batch(state["pending_batch"]))
+                        state["pending_batch"] = None
+
+                state["last_user_id"] = last_id
+                state["scanned"] += len(user_ids)
+                state["elapsed_s"] = previous_elapsed + time.perf_counter() - run_start
+                checkpoint.save()
+    except KeyboardInterrupt:
+        stop_reason = "stopped"
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        state["elapsed_s"] = previous_elapsed + time.perf_counter() - run_start
+        checkpoint.save()
+
+    elapsed = time.perf_counter() - run_start
+    processed = run_counts["succeeded"] + run_counts["failed"]
+    report = {
+        "mode": mode,
+        "stop_reason": stop_reason,
+        "processed": processed,
+        "succeeded": run_counts["succeeded"],
+        "failed": run_counts["failed"],
+        "elapsed_s": round(elapsed, 3),
+        "users_per_min": round(processed / elapsed * 60, 2) if elapsed else 0.0,
+        "last_user_id": state["last_user_id"],
+        "total_succeeded": state["succeeded"],
+        "total_failed": state["failed"],
+    }
+    if latencies:
+        ordered = sorted(latencies)
+        report["latency_mean_s"] = round(sum(ordered) / len(ordered), 3)
+        report["latency_p95_s"] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3)
+    logger.info(f"Analiza wsadowa ({mode}) zakończona: {stop_reason}, {report['succeeded']}/{processed} analiz, "
+                f"{report['users_per_min']} użytkowników/min")
+    return report
+
+
+def _handle_signal(signum, frame):
+    logger.info(f"Otrzymano sygnał {signum} - kończę po bieżącej stronie")
+    _stop_event.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wsadowa analiza psychologiczna użytkowników")
+    parser.add_argument("--mode", choices=["threads", "batch"], default="threads")
+    parser.add_argument("--workers", type=int, help="Liczba wątków w trybie threads")
+    parser.add_argument("--page-size", type=int, help="Liczba użytkowników na stronę (partię)")
+    parser.add_argument("--window", default=BATCH_ANALYSIS_WINDOW, help='Okno czasowe, np. "01:00-06:00"')
+    parser.add_argument("--ignore-window", action="store_true", help="Uruchom niezależnie od okna czasowego")
+    parser.add_argument("--checkpoint", help="Plik stanu")
+    parser.add_argument("--restart", action="store_true", help="Zacznij od początku zamiast wznawiać")
+    parser.add_argument("--max-users", type=int, help="Zakończ po tylu analizach")
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+    from app import app
+    result = run(app, mode=args.mode, workers=args.workers, page_size=args.page_size,
+                 window=None if args.ignore_window else parse_window(args.window),
+                 checkpoint_path=args.checkpoint, restart=args.restart, max_users=args.max_users)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,6 @@
+"""
+Narzędzia do pomiaru wydajności aplikacji (testy obciążeniowe i benchmarki).
+
+Uruchamiane z katalogu głównego repozytorium, np.:
+    python -m benchmarks.loadtest --help
+"""
@@ -0,0 +1,246 @@
+"""
+Benchmark zapytań SQL wykonywanych na gorących ścieżkach aplikacji.
+
+Dla każdego rozmiaru danych (łączna liczba rozmów) tworzy świeżą bazę, wypełnia ją
+generatorem seed_data (ze stałą liczbą rozmów na użytkownika), a następnie mierzy
+każde zapytanie z app.index, app.history, app.analysis, psychology, visualization,
+wordcloud_analyzer i reminders oraz zapisuje jego plan wykonania.
+
+Zapytanie jest oznaczane (flagged), jeśli jego koszt rośnie z rozmiarem całej
+tabeli zamiast z rozmiarem danych użytkownika: nachylenie log(czas)/log(rozmiar)
+przekracza próg albo plan zawiera pełny skan dużej tabeli.
+
+Przykłady:
+    python -m benchmarks.db_hotpaths --sizes 1000,100000 --output db_bench.json
+    python -m benchmarks.db_hotpaths --database-url postgresql://localhost/bench --sizes 1000,100000,10000000
+
+UWAGA: baza wskazana przez --database-url jest czyszczona przed każdym rozmiarem.
+"""
+
+import os
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+
+from sqlalchemy import create_engine, select, func
+
+from app import db
+from models import User, Conversation, PsychologicalAnalysis, EmotionIntensity, ReminderLog, NotificationOutbox
+from seed_data import seed
+
+SLOPE_THRESHOLD = 0.3  # 0 = koszt niezależny od rozmiaru tabeli, 1 = liniowy względem tabeli
+LARGE_TABLES = ("conversation", "psychological_analysis", "emotion_intensity", "user", "reminder_log")
+
+
+def _answered(user_id):
+    return (select(Conversation)
+            .where(Conversation.user_id == user_id, Conversation.response.isnot(None)))
+
+
+# Nazwa -> (zakres, funkcja budująca zapytanie dla użytkownika).
+# Zakres 'user' oznacza, że koszt powinien zależeć tylko od danych użytkownika.
+HOT_QUERIES = {
+    "app.index:user": ("user", lambda uid: select(User).where(User.id == uid)),
+    "app.index:last_conversation": ("user", lambda uid: select(Conversation)
+                                    .where(Conversation.user_id == uid)
+                                    .order_by(Conversation.timestamp.desc()).limit(1)),
+    "app.index:conversation_history": ("user", lambda uid: select(Conversation)
+                                       .where(Conversation.user_id == uid)
+                                       .order_by(Conversation.timestamp.desc()).limit(5)),
+    "app.history:answered_conversations": ("user", lambda uid: _answered(uid)
+                                           .order_by(Conversation.timestamp.desc())),
+    "app.analysis:latest_analysis": ("user", lambda uid: select(PsychologicalAnalysis)
+                                     .where(PsychologicalAnalysis.user_id == uid)
+                                     .order_by(PsychologicalAnalysis.timestamp.desc()).limit(1)),
+    "app.analysis:answer_watermark": ("user", lambda uid: select(Conversation.id, Conversation.timestamp)
+                                      .where(Conversation.user_id == uid, Conversation.response.isnot(None))
+                                      .order_by(Conversation.id.desc()).limit(1)),
+    "app.analysis:all_analyses": ("user", lambda uid: select(PsychologicalAnalysis)
+                                  .where(PsychologicalAnalysis.user_id == uid)
+                                  .order_by(PsychologicalAnalysis.timestamp.asc())),
+    "visualization.generate_emotion_chart:emotion_series": ("user", lambda uid: select(
+        EmotionIntensity.emotion, EmotionIntensity.timestamp, EmotionIntensity.intensity)
+        .where(EmotionIntensity.user_id == uid)
+        .order_by(EmotionIntensity.timestamp, EmotionIntensity.id)),
+    "app.reminder_settings:reminder_logs": ("user", lambda uid: select(ReminderLog)
+                                            .where(ReminderLog.user_id == uid)
+                                            .order_by(ReminderLog.timestamp.desc()).limit(10)),
+    "psychology.load_user_responses": ("user", lambda uid: _answered(uid)
+                                       .order_by(Conversation.timestamp.asc())),
+    "wordcloud_analyzer.analyze_user_responses_keywords": ("user", lambda uid: _answered(uid)
+                                                           .order_by(Conversation.timestamp.asc())),
+    "reminders.check_and_send_due_reminders:users": ("global", lambda uid: select(User)
+                                                     .where(User.reminder_enabled.is_(True))),
+    "reminders.deliver_pending_notifications:batch": ("global", lambda uid: select(NotificationOutbox)
+                                                      .where(NotificationOutbox.status == "pending",
+                                                             NotificationOutbox.available_at <= datetime.now())
+                                                      .order_by(NotificationOutbox.id.asc()).limit(50)),
+}
+
+
+def _compile(statement, engine):
+    """Zwraca (sql, parametry) w formacie sterownika bazy."""
+    compiled = statement.compile(dialect=engine.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    return compiled.string, params
+
+
+def explain(conn, statement, engine):
+    """Plan wykonania zapytania w formie listy wierszy tekstowych (lub JSON dla PostgreSQL)."""
+    sql, params = _compile(statement, engine)
+    if engine.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        return [row[-1] for row in rows]
+    if engine.dialect.name == "postgresql":
+        row = conn.exec_driver_sql("EXPLAIN (FORMAT JSON, ANALYZE, BUFFERS) " + sql, params).fetchone()
+        return row[0]
+    return []
+
+
+def has_full_scan(plan, dialect):
+    """Czy plan zawiera pełny skan którejś z dużych tabel."""
+    if dialect == "sqlite":
+        for line in plan:
+            # "SCAN conversation" bez indeksu; "SCAN ... USING INDEX" lub "SEARCH" są w porządku
+            if line.startswith("SCAN ") and "USING" not in line:
+                if line.split()[1].strip('"') in LARGE_TABLES:
+                    return True
+        return False
+    if dialect == "postgresql":
+        return any(node.get("Node Type") == "Seq Scan" and node.get("Relation Name") in LARGE_TABLES
+                   for node in _plan_nodes(plan))
+    return False
+
+
+def _plan_nodes(plan):
+    """Przechodzi rekurencyjnie po węzłach planu PostgreSQL (FORMAT JSON)."""
+    if isinstance(plan, list):
+        for item in plan:
+            yield from _plan_nodes(item)
+    elif isinstance(plan, dict):
+        node = plan.get("Plan", plan)
+        yield node
+        for child in node.get("Plans", []):
+            yield from _plan_nodes(child)
+
+
+def time_query(conn, statement_factory, user_ids, runs):
+    """Mierzy czas wykonania (z pobraniem wyników) dla próbki użytkowników."""
+    timings = []
+    for i in range(runs):
+        statement = statement_factory(user_ids[i % len(user_ids)])
+        start = time.perf_counter()
+        conn.execute(statement).fetchall()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "median_ms": 1000 * statistics.median(timings),
+        "p95_ms": 1000 * timings[min(len(timings) - 1, int(0.95 * len(timings)))],
+        "min_ms": 1000 * timings[0],
+    }
+
+
+def prepare_database(database_url, size, conversations_per_user, seed_value):
+    """Tworzy świeżą bazę i wypełnia ją danymi o zadanej liczbie rozmów."""
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="db-bench-"), f"bench_{size}.db")
+        database_url = f"sqlite:///{path}"
+
+    engine = create_engine(database_url)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+
+    users = max(1, int(round(size / conversations_per_user)))
+    summary = seed(engine, users=users, conversations_per_user=conversations_per_user,
+                   distribution="fixed", batch_size=20000, seed=seed_value)
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    return engine, summary
+
+
+def run_benchmark(sizes, database_url=None, conversations_per_user=100, runs=30, sample_users=20, seed_value=42):
+    """
+    Uruchamia benchmark dla wszystkich rozmiarów.
+
+    Returns:
+        dict: Wyniki (czasy i plany dla każdego rozmiaru oraz ocena skalowania)
+    """
+    results = {"sizes": {}, "queries": {}}
+
+    for size in sizes:
+        engine, seed_summary = prepare_database(database_url, size, conversations_per_user, seed_value)
+        with engine.connect() as conn:
+            max_user = conn.execute(select(func.max(User.id))).scalar()
+            rng = random.Random(seed_value)
+            user_ids = [rng.randint(1, max_user) for _ in range(sample_users)]
+
+            size_result = {"seed": seed_summary, "queries": {}}
+            for name, (scope, factory) in HOT_QUERIES.items():
+                # Rozgrzewka (cache stron bazy)
+                conn.execute(factory(user_ids[0])).fetchall()
+                timing = time_query(conn, factory, user_ids, runs)
+                plan = explain(conn, factory(user_ids[0]), engine)
+                size_result["queries"][name] = dict(timing, plan=plan,
+                                                    full_scan=has_full_scan(plan, engine.dialect.name))
+        results["sizes"][str(size)] = size_result
+        engine.dispose()
+
+    # Ocena skalowania: nachylenie w skali log-log między najmniejszym a największym rozmiarem
+    smallest, largest = str(min(sizes)), str(max(sizes))
+    for name, (scope, _) in HOT_QUERIES.items():
+        small = results["sizes"][smallest]["queries"][name]
+        large = results["sizes"][largest]["queries"][name]
+        slope = None
+        if smallest != largest and small["median_ms"] > 0:
+            slope = math.log(max(large["median_ms"], 1e-6) / small["median_ms"]) / math.log(int(largest) / int(smallest))
+        full_scan = large["full_scan"]
+        results["queries"][name] = {
+            "scope": scope,
+            "slope": slope,
+            "full_scan": full_scan,
+            # Zapytania globalne (np. wysyłka przypomnień) z natury zależą od rozmiaru tabeli
+            "flagged": scope == "user" and (full_scan or (slope is not None and slope > SLOPE_THRESHOLD)),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark zapytań SQL na gorących ścieżkach")
+    parser.add_argument("--sizes", default="1000,100000,10000000", help="Łączne liczby rozmów, po przecinku")
+    parser.add_argument("--database-url", help="Baza do testów (zostanie wyczyszczona); domyślnie tymczasowe SQLite")
+    parser.add_argument("--conversations-per-user", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=30, help="Liczba pomiarów na zapytanie")
+    parser.add_argument("--sample-users", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Plik JSON z wynikami")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    results = run_benchmark(sizes, args.database_url, args.conversations_per_user,
+                            args.runs, args.sample_users, args.seed)
+    results["config"] = vars(args)
+    results["timestamp"] = datetime.now().isoformat()
+
+    print(f"{'zapytanie':<55}" + "".join(f"{s:>12}" for s in sizes) + f"{'nachyl.':>9}  ")
+    for name, verdict in results["queries"].items():
+        times = "".join(f"{results['sizes'][str(s)]['queries'][name]['median_ms']:>10.2f}ms" for s in sizes)
+        slope = f"{verdict['slope']:>9.2f}" if verdict["slope"] is not None else f"{'-':>9}"
+        flag = "  ROŚNIE Z TABELĄ" if verdict["flagged"] else ""
+        print(f"{name:<55}{times}{slope}{flag}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+
+
+if __name__ == "__main__":
+    main()
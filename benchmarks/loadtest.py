@@ -0,0 +1,352 @@
+"""
+Test obciążeniowy tras aplikacji Flask.
+
+Zakłada konta testowe, a następnie wielu równoległych "użytkowników" przechodzi
+realistyczną ścieżkę: logowanie -> strona główna -> odpowiedź -> analiza -> historia.
+Dla każdej trasy raportowane są opóźnienia p50/p95/p99, przepustowość i odsetek
+błędów w formacie JSON, dzięki czemu wyniki można porównywać między commitami.
+
+Przykłady:
+    # uruchom lokalnego gunicorna (konfiguracja produkcyjna) na tymczasowej bazie SQLite i obciąż go
+    python -m benchmarks.loadtest --spawn --users 20 --concurrency 10 --iterations 5 --output wyniki.json
+
+    # obciąż działający serwer i porównaj z poprzednim wynikiem
+    python -m benchmarks.loadtest --base-url http://127.0.0.1:5000 --compare wyniki.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import tempfile
+import subprocess
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from therapy import KEYWORDS
+
+CONVERSATION_ID_PATTERN = re.compile(r'name="conversation_id" value="(\d+)"')
+
+# Zdania-szablony do budowania odpowiedzi użytkowników
+RESPONSE_TEMPLATES = [
+    "Ostatnio czuję {0} i często myślę o tym, co to dla mnie znaczy.",
+    "Najwięcej energii zabiera mi {0}, ale próbuję znaleźć {1}.",
+    "W tym tygodniu towarzyszyło mi {0}, a wieczorami wracała {1}.",
+    "Rozmowa o tym, czym jest {0}, pomaga mi zrozumieć {1}.",
+]
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Nie podąża za przekierowaniami - każde żądanie jest mierzone osobno."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class RouteStats:
+    """Zbiera pomiary dla poszczególnych tras (bezpieczne wątkowo)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # trasa -> lista (czas_s, sukces)
+
+    def record(self, route, elapsed, ok):
+        with self._lock:
+            self.samples.setdefault(route, []).append((elapsed, ok))
+
+    def summary(self, wall_time):
+        """Zwraca statystyki dla każdej trasy."""
+        result = {}
+        for route, samples in sorted(self.samples.items()):
+            latencies = sorted(s[0] for s in samples)
+            errors = sum(1 for s in samples if not s[1])
+            result[route] = {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": errors / len(samples),
+                "throughput_rps": len(samples) / wall_time if wall_time > 0 else 0.0,
+                "mean_ms": 1000 * sum(latencies) / len(latencies),
+                "p50_ms": 1000 * percentile(latencies, 50),
+                "p95_ms": 1000 * percentile(latencies, 95),
+                "p99_ms": 1000 * percentile(latencies, 99),
+                "max_ms": 1000 * latencies[-1],
+            }
+        return result
+
+
+def percentile(sorted_values, pct):
+    """Percentyl metodą najbliższej rangi (wartości muszą być posortowane)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def random_response(rng):
+    """Generuje odpowiedź po polsku ze słownictwa therapy.KEYWORDS."""
+    vocabulary = [word for words in KEYWORDS.values() for word in words]
+    sentences = [
+        rng.choice(RESPONSE_TEMPLATES).format(rng.choice(vocabulary), rng.choice(vocabulary))
+        for _ in range(rng.randint(2, 6))
+    ]
+    return " ".join(sentences)
+
+
+class VirtualUser:
+    """Jedna sesja przeglądarki z własnymi ciasteczkami."""
+
+    def __init__(self, base_url, stats, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.stats = stats
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect,
+        )
+
+    def request(self, route, path, data=None):
+        """Wysyła żądanie i zapisuje pomiar. Zwraca (status, treść)."""
+        body = urllib.parse.urlencode(data).encode("utf-8") if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                status, content = response.status, response.read().decode("utf-8", "replace")
+        except urllib.error.HTTPError as e:
+            # Przekierowania (302) po formularzach są oczekiwane
+            status, content = e.code, ""
+        except Exception:
+            self.stats.record(route, time.perf_counter() - start, False)
+            return None, ""
+        self.stats.record(route, time.perf_counter() - start, status < 400)
+        return status, content
+
+    def register(self, username, password):
+        return self.request("POST /register", "/register", {
+            "username": username,
+            "email": f"{username}@loadtest.local",
+            "password": password,
+        })
+
+    def run_flow(self, username, password, rng, think_time):
+        """Ścieżka użytkownika: logowanie -> / -> odpowiedź -> /analysis -> /history."""
+        self.request("POST /login", "/login", {"username": username, "password": password})
+        _pause(think_time, rng)
+
+        _, page = self.request("GET /", "/")
+        match = CONVERSATION_ID_PATTERN.search(page)
+        _pause(think_time, rng)
+
+        if match:
+            self.request("POST /submit_response", "/submit_response", {
+                "conversation_id": match.group(1),
+                "response": random_response(rng),
+            })
+            _pause(think_time, rng)
+
+        self.request("GET /analysis", "/analysis")
+        _pause(think_time, rng)
+        self.request("GET /history", "/history")
+
+
+def _pause(think_time, rng):
+    if think_time > 0:
+        time.sleep(rng.uniform(0.5, 1.5) * think_time)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_gunicorn(workers=None, threads=None, database_url=None, ready_timeout=120):
+    """
+    Uruchamia lokalnego gunicorna z konfiguracją produkcyjną (gunicorn.conf.py, wsgi:app:
+    gthread, preload i rozgrzewanie) i czeka, aż /readyz zwróci 200.
+
+    Args:
+        workers (int, optional): Liczba workerów (WEB_CONCURRENCY; domyślnie z gunicorn.conf.py)
+        threads (int, optional): Liczba wątków workera (GUNICORN_THREADS; domyślnie z gunicorn.conf.py)
+        database_url (str, optional): Baza danych (domyślnie tymczasowy SQLite)
+        ready_timeout (float): Maksymalny czas oczekiwania na gotowość (s)
+
+    Returns:
+        tuple: (proces, base_url)
+    """
+    port = _free_port()
+    env = dict(os.environ)
+    if workers is not None:
+        env["WEB_CONCURRENCY"] = str(workers)
+    if threads is not None:
+        env["GUNICORN_THREADS"] = str(threads)
+    # Log dostępu każdego żądania zagłuszyłby raport
+    env.setdefault("GUNICORN_ACCESS_LOG", os.devnull)
+    if database_url is None:
+        database_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "loadtest.db")
+    env["DATABASE_URL"] = database_url
+
+    # Schemat tworzymy raz, zanim wystartują workery
+    subprocess.run([sys.executable, "init_db.py"], env=env, check=True, stdout=subprocess.DEVNULL)
+
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "-b", f"127.0.0.1:{port}", "--log-level", "warning", "wsgi:app"],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+
+    # /readyz zwraca 503 do końca rozgrzewania (urlopen zgłasza wtedy HTTPError)
+    deadline = time.monotonic() + ready_timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/readyz", timeout=2).read()
+            return process, base_url
+        except Exception:
+            if process.poll() is not None:
+                raise RuntimeError("Gunicorn zakończył działanie przy starcie")
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"Gunicorn nie był gotowy (/readyz) w ciągu {ready_timeout} s")
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def run_load_test(base_url, users=10, concurrency=10, iterations=3, think_time=0.0, timeout=60.0, seed=42):
+    """
+    Zakłada konta i uruchamia ścieżki użytkowników z zadaną współbieżnością.
+
+    Returns:
+        dict: Wynik w formacie JSON (konfiguracja, statystyki per trasa)
+    """
+    stats = RouteStats()
+    run_id = uuid.uuid4().hex[:8]
+    password = "loadtest-password"
+    accounts = [f"lt_{run_id}_{i}" for i in range(users)]
+
+    # Zakładanie kont nie wlicza się do wyników ścieżek
+    seed_stats = RouteStats()
+    seed_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda name: VirtualUser(base_url, seed_stats, timeout).register(name, password), accounts))
+    seed_time = time.perf_counter() - seed_start
+
+    def session_worker(index):
+        rng = random.Random(seed + index)
+        username = accounts[index % users]
+        for _ in range(iterations):
+            VirtualUser(base_url, stats, timeout).run_flow(username, password, rng, think_time)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(session_worker, range(concurrency)))
+    wall_time = time.perf_counter() - start
+
+    routes = stats.summary(wall_time)
+    total_requests = sum(r["requests"] for r in routes.values())
+    total_errors = sum(r["errors"] for r in routes.values())
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "git_revision": _git_revision(),
+        "config": {
+            "base_url": base_url,
+            "users": users,
+            "concurrency": concurrency,
+            "iterations": iterations,
+            "think_time": think_time,
+        },
+        "seed": seed_stats.summary(seed_time).get("POST /register"),
+        "wall_time_s": wall_time,
+        "total": {
+            "requests": total_requests,
+            "errors": total_errors,
+            "error_rate": total_errors / total_requests if total_requests else 0.0,
+            "throughput_rps": total_requests / wall_time if wall_time > 0 else 0.0,
+        },
+        "routes": routes,
+    }
+
+
+def print_report(result, baseline=None):
+    """Wypisuje tabelę wyników (opcjonalnie ze zmianą p95 względem poprzedniego wyniku)."""
+    header = f"{'trasa':<22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>8}{'błędy':>8}"
+    if baseline:
+        header += f"{'Δp95':>9}"
+    print(header)
+    for route, r in result["routes"].items():
+        line = (f"{route:<22}{r['requests']:>6}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+                f"{r['p99_ms']:>10.1f}{r['throughput_rps']:>8.1f}{r['error_rate']:>8.1%}")
+        if baseline:
+            previous = baseline.get("routes", {}).get(route)
+            if previous and previous["p95_ms"] > 0:
+                line += f"{(r['p95_ms'] / previous['p95_ms'] - 1):>+9.1%}"
+        print(line)
+    total = result["total"]
+    print(f"Razem: {total['requests']} żądań, {total['throughput_rps']:.1f} rps, "
+          f"błędy {total['error_rate']:.1%}, czas {result['wall_time_s']:.1f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test obciążeniowy tras aplikacji")
+    parser.add_argument("--base-url", help="Adres działającego serwera (np. http://127.0.0.1:5000)")
+    parser.add_argument("--spawn", action="store_true", help="Uruchom lokalnego gunicorna na tymczasowej bazie")
+    parser.add_argument("--database-url", help="Baza dla --spawn (domyślnie tymczasowy SQLite)")
+    parser.add_argument("--workers", type=int, help="Liczba workerów gunicorna dla --spawn (domyślnie WEB_CONCURRENCY "
+                                                     "lub gunicorn.conf.py)")
+    parser.add_argument("--threads", type=int, help="Liczba wątków na workera dla --spawn (domyślnie GUNICORN_THREADS "
+                                                     "lub gunicorn.conf.py)")
+    parser.add_argument("--users", type=int, default=10, help="Liczba zakładanych kont")
+    parser.add_argument("--concurrency", type=int, default=10, help="Liczba równoległych sesji")
+    parser.add_argument("--iterations", type=int, default=3, help="Liczba ścieżek na sesję")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Średnia przerwa między krokami (s)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Limit czasu pojedynczego żądania (s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Plik JSON z wynikami")
+    parser.add_argument("--compare", help="Poprzedni plik JSON do porównania p95")
+    args = parser.parse_args(argv)
+
+    if not args.base_url and not args.spawn:
+        parser.error("podaj --base-url albo --spawn")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    process = None
+    base_url = args.base_url
+    if args.spawn:
+        process, base_url = spawn_gunicorn(args.workers, args.threads, args.database_url)
+
+    try:
+        result = run_load_test(base_url, args.users, args.concurrency, args.iterations,
+                               args.think_time, args.timeout, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Mikrobenchmarki czystych funkcji tekstowych i punktujących na ścieżce żądania.
+
+Mierzy operacje na sekundę i szczytową alokację pamięci dla:
+    - therapy.analyze_context
+    - question_index.select_question (dobór pytania z lokalnego indeksu)
+    - emotion_classifier.classify (lokalna analiza stanu emocjonalnego)
+    - wordcloud_analyzer.preprocess_text / extract_keywords
+    - psychology.get_emotional_intelligence_score / score_counts (cała partia analiz naraz)
+    - visualization.extract_emotion_intensities (z json.loads, jak przy renderowaniu wykresu)
+
+Korpusy po polsku są generowane deterministycznie w kilku rozmiarach, więc wyniki
+kolejnych uruchomień są porównywalne. Wyniki można zapisać jako punkt odniesienia
+i porównywać z nim kolejne pomiary.
+
+Przykłady:
+    python -m benchmarks.micro --save-baseline benchmarks/baselines/micro.json
+    python -m benchmarks.micro --compare benchmarks/baselines/micro.json
+"""
+
+import os
+import gc
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+from seed_data import TextFactory
+
+# Rozmiar korpusu -> (liczba odpowiedzi, średnia liczba słów w odpowiedzi, liczba analiz)
+CORPUS_SIZES = {
+    "small": (5, 40, 5),
+    "medium": (50, 120, 30),
+    "large": (500, 300, 200),
+}
+
+REGRESSION_THRESHOLD = 0.10  # spadek ops/s o ponad 10% względem punktu odniesienia
+
+
+def build_corpus(size, seed=1234):
+    """Buduje deterministyczny korpus odpowiedzi i analiz danego rozmiaru."""
+    responses_count, words, analyses_count = CORPUS_SIZES[size]
+    rng = random.Random(seed)
+    texts = TextFactory(rng)
+    start = datetime(2025, 1, 1)
+
+    responses = [{
+        "question": texts.question(),
+        "response": texts.response(words),
+        "timestamp": start + timedelta(days=i),
+        "date": start + timedelta(days=i),
+    } for i in range(responses_count)]
+
+    analyses = [texts.analysis() for _ in range(analyses_count)]
+    return {
+        "responses": responses,
+        "text": " ".join(r["response"] for r in responses),
+        "analyses": analyses,
+        "analysis_json": [json.dumps(a, ensure_ascii=False) for a in analyses],
+    }
+
+
+def _benchmarks():
+    """Nazwa -> funkcja przyjmująca korpus (importy leniwe, by nie mierzyć inicjalizacji modułów)."""
+    from therapy import analyze_context
+    from question_index import get_index, select_question
+    from emotion_classifier import classify
+    from wordcloud_analyzer import preprocess_text, extract_keywords
+    from psychology import get_emotional_intelligence_score, score_counts, category_counts
+    from visualization import extract_emotion_intensities
+
+    # Indeks budowany raz, poza pomiarem (jak przy rozgrzewaniu aplikacji)
+    get_index()
+
+    def emotion_extraction(corpus):
+        for raw in corpus["analysis_json"]:
+            extract_emotion_intensities(json.loads(raw))
+
+    def ei_scoring(corpus):
+        for analysis in corpus["analyses"]:
+            get_emotional_intelligence_score(analysis)
+
+    def ei_batch_scoring(corpus):
+        score_counts([category_counts(analysis) for analysis in corpus["analyses"]])
+
+    return {
+        "therapy.analyze_context": lambda corpus: analyze_context(corpus["responses"]),
+        "question_index.select_question": lambda corpus: select_question(corpus["responses"]),
+        "emotion_classifier.classify": lambda corpus: classify(corpus["responses"]),
+        "wordcloud_analyzer.preprocess_text": lambda corpus: preprocess_text(corpus["text"]),
+        "wordcloud_analyzer.extract_keywords": lambda corpus: extract_keywords(corpus["responses"]),
+        "psychology.get_emotional_intelligence_score": ei_scoring,
+        "psychology.score_counts": ei_batch_scoring,
+        "visualization.extract_emotion_intensities": emotion_extraction,
+    }
+
+
+def measure(func, corpus, min_time=0.2, repeat=5):
+    """
+    Mierzy funkcję w stylu timeit: dobiera liczbę wywołań tak, by pomiar trwał
+    co najmniej `min_time`, powtarza go `repeat` razy i bierze najlepszy wynik.
+    Osobno mierzy szczytową alokację pamięci jednego wywołania.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func(corpus)
+        if time.perf_counter() - start >= min_time:
+            break
+        number *= 2
+
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func(corpus)
+            timings.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        func(corpus)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = min(timings)
+    return {
+        "ops_per_sec": 1.0 / best if best > 0 else float("inf"),
+        "mean_us": 1e6 * sum(timings) / len(timings),
+        "best_us": 1e6 * best,
+        "peak_alloc_kib": (peak - baseline) / 1024,
+        "calls_per_round": number,
+    }
+
+
+def run(sizes, names=None, min_time=0.2, repeat=5):
+    """Uruchamia wszystkie (lub wybrane) benchmarki dla podanych rozmiarów korpusu."""
+    benchmarks = _benchmarks()
+    results = {}
+    for size in sizes:
+        corpus = build_corpus(size)
+        for name, func in benchmarks.items():
+            if names and name not in names:
+                continue
+            results[f"{name}[{size}]"] = measure(func, corpus, min_time, repeat)
+    return results
+
+
+def compare(results, baseline):
+    """Zmiana ops/s względem punktu odniesienia; ujemna oznacza spowolnienie."""
+    changes = {}
+    for key, result in results.items():
+        previous = baseline.get("results", {}).get(key)
+        if previous and previous["ops_per_sec"] > 0:
+            changes[key] = result["ops_per_sec"] / previous["ops_per_sec"] - 1
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mikrobenchmarki funkcji tekstowych i punktujących")
+    parser.add_argument("--sizes", default=",".join(CORPUS_SIZES), help="Rozmiary korpusu, po przecinku")
+    parser.add_argument("--only", action="append", help="Uruchom tylko wskazany benchmark (można powtarzać)")
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save-baseline", help="Zapisz wyniki jako punkt odniesienia (JSON)")
+    parser.add_argument("--compare", help="Porównaj z zapisanym punktem odniesienia (JSON)")
+    parser.add_argument("--output", help="Plik JSON z wynikami")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes.split(","), args.only, args.min_time, args.repeat)
+    document = {"timestamp": datetime.now().isoformat(), "results": results}
+
+    changes = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            changes = compare(results, json.load(f))
+
+    print(f"{'benchmark':<58}{'ops/s':>12}{'µs/op':>12}{'szczyt KiB':>12}" + (f"{'zmiana':>10}" if changes else ""))
+    regressions = 0
+    for key, r in results.items():
+        line = f"{key:<58}{r['ops_per_sec']:>12.1f}{r['best_us']:>12.1f}{r['peak_alloc_kib']:>12.1f}"
+        if key in changes:
+            line += f"{changes[key]:>+10.1%}"
+            if changes[key] < -REGRESSION_THRESHOLD:
+                line += "  REGRESJA"
+                regressions += 1
+        print(line)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(document, f, indent=2, ensure_ascii=False)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
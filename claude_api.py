@@ -1,38 +1,42 @@
 import os
 import json
 import logging
-import time
 import random
-import anthropic
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
 
+from llm_client import (
+    HAS_ANTHROPIC, DeadlineExceeded, is_anthropic_available, create_message_async, run_within_deadline_async,
+)
+from prompt_builder import build_transcript, CONTEXT_TOKEN_BUDGET
+from metrics import record_cache
+
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Inicjalizacja klienta Claude
-HAS_ANTHROPIC = False
-client = None
+# Limit czasu odczytu odpowiedzi przy generowaniu pytania (s)
+QUESTION_READ_TIMEOUT = float(os.environ.get("QUESTION_READ_TIMEOUT", 15.0))
 
-try:
-    from anthropic import Anthropic
-    HAS_ANTHROPIC = True
-    
-    # Inicjalizacja klienta Anthropic Claude
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if api_key:
-        client = Anthropic(api_key=api_key)
-        logger.info("Zainicjalizowano klienta Anthropic Claude API")
-    else:
-        logger.warning("Brak klucza API Anthropic (ANTHROPIC_API_KEY)")
-except ImportError as e:
-    logger.warning(f"Nie można zaimportować pakietu Anthropic: {str(e)}")
-except Exception as e:
-    logger.warning(f"Anthropic API jest niedostępne: {str(e)}")
+# Mechanizm zastępczy, gdy Claude nie odpowie (niedostępny, błąd, limit czasu żądania):
+# "index" (question_index - pytanie z banku najbliższe odpowiedziom) albo
+# "keywords" (therapy.generate_question - losowe pytanie z najczęstszego tematu)
+QUESTION_FALLBACK = os.environ.get("QUESTION_FALLBACK", "index").lower()
+
+# Liczba użytkowników, dla których pamiętane jest pytanie od Claude ukończone po limicie czasu żądania
+PENDING_QUESTIONS_MAX = int(os.environ.get("PENDING_QUESTIONS_MAX", 10000))
+
+SYSTEM_PROMPT = "Jesteś empatycznym polskim psychoterapeutą specjalizującym się w terapii poznawczo-behawioralnej i refleksyjnym podejściu do problemów życiowych. Twoje pytania są głębokie, wnikliwe i zachęcają do autorefleksji."
 
 # Cache na wyniki analizy, aby ograniczyć liczbę zapytań do API
 question_cache = {}
 
+# Pytania od Claude ukończone w tle po limicie czasu żądania, zadawane jako następne pytanie
+# użytkownika: user_id -> (ID najnowszej odpowiedzi w kontekście pytania, pytanie), od najstarszego
+pending_questions = OrderedDict()
+_pending_lock = threading.Lock()
+
 # Standardowe wartości zastępcze dla analizy niedzialajacegp API
 DEFAULT_QUESTION = "Jakie emocje towarzyszą Ci najczęściej w ciągu dnia? Potrafisz je nazwać?"
 
@@ -43,81 +47,47 @@ API_LIMIT_MESSAGES = [
     "Spróbuj ponownie później lub zapoznaj się z alternatywnie generowanymi pytaniami."
 ]
 
-def generate_claude_question(context: Optional[List[Dict[str, Any]]] = None) -> str:
+INITIAL_QUESTION_PROMPT = """
+        Wygeneruj jedno głębokie, refleksyjne pytanie terapeutyczne w języku polskim, które mogłoby rozpocząć rozmowę z nowym użytkownikiem aplikacji wsparcia psychologicznego. 
+        Pytanie powinno być empatyczne, otwarte i zachęcające do głębszej refleksji nad sobą i swoim samopoczuciem.
+        Unikaj pytań zamkniętych i powierzchownych. Pytanie powinno być napisane w drugiej osobie liczby pojedynczej (Ty).
+        
+        Odpowiedz tylko samym pytaniem, bez dodatkowego tekstu.
+        """
+
+def _question_request(prompt: str, max_tokens: int) -> Dict[str, Any]:
+    """Parametry wywołania Claude generującego pytanie."""
+    return dict(
+        model="claude-3-5-sonnet-20241022", # the newest Anthropic model is "claude-3-5-sonnet-20241022" which was released October 22, 2024.
+        read_timeout=QUESTION_READ_TIMEOUT,
+        max_tokens=max_tokens,
+        temperature=0.7,
+        system=SYSTEM_PROMPT,
+        messages=[
+            {"role": "user", "content": prompt}
+        ]
+    )
+
+def _prepare_question(context: Optional[List[Dict[str, Any]]]):
     """
-    Generuje terapeutyczne pytanie wykorzystując model Claude, które jest dopasowane 
-    do kontekstu wcześniejszych odpowiedzi użytkownika.
-    
-    Args:
-        context (list, optional): Lista poprzednich elementów konwersacji.
-                                Każdy element to słownik z kluczami 'question', 'response' i 'date'.
-    
+    Przygotowuje prompt pytania dla kontekstu rozmowy.
+
     Returns:
-        str: Terapeutyczne pytanie w języku polskim.
+        tuple: (klucz cache'a, prompt, maksymalna liczba tokenów odpowiedzi)
     """
-    # Jeśli Claude nie jest dostępny, użyj algorytmu zastępczego
-    if not HAS_ANTHROPIC or client is None:
-        logger.warning("Anthropic Claude API jest niedostępne. Używam domyślnego mechanizmu generowania pytań.")
-        from therapy import generate_question
-        return generate_question(context)
-    
     # Jeśli nie mamy kontekstu, generujemy pytanie inicjalne
-    if not context or len(context) == 0:
-        try:
-            # Generujemy pierwsze pytanie inicjujące rozmowę
-            prompt = """
-            Wygeneruj jedno głębokie, refleksyjne pytanie terapeutyczne w języku polskim, które mogłoby rozpocząć rozmowę z nowym użytkownikiem aplikacji wsparcia psychologicznego. 
-            Pytanie powinno być empatyczne, otwarte i zachęcające do głębszej refleksji nad sobą i swoim samopoczuciem.
-            Unikaj pytań zamkniętych i powierzchownych. Pytanie powinno być napisane w drugiej osobie liczby pojedynczej (Ty).
-            
-            Odpowiedz tylko samym pytaniem, bez dodatkowego tekstu.
-            """
-            
-            # Cache key for the initial question
-            cache_key = "initial_question"
-            
-            # Check if we have a cached response
-            if cache_key in question_cache:
-                return question_cache[cache_key]
-            
-            # Call the Claude API
-            message = client.messages.create(
-                model="claude-3-5-sonnet-20241022", # the newest Anthropic model is "claude-3-5-sonnet-20241022" which was released October 22, 2024.
-                max_tokens=150,
-                temperature=0.7,
-                system="Jesteś empatycznym polskim psychoterapeutą specjalizującym się w terapii poznawczo-behawioralnej i refleksyjnym podejściu do problemów życiowych. Twoje pytania są głębokie, wnikliwe i zachęcają do autorefleksji.",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            question = message.content[0].text.strip()
-            
-            # Cache the response
-            question_cache[cache_key] = question
-            
-            return question
-            
-        except Exception as e:
-            logger.error(f"Błąd podczas generowania pierwszego pytania z Claude: {str(e)}")
-            # Fallback to a default first question
-            from therapy import DEFAULT_FIRST_QUESTIONS
-            return random.choice(DEFAULT_FIRST_QUESTIONS)
-    
+    if not context:
+        return "initial_question", INITIAL_QUESTION_PROMPT, 150
+
     # Prepare conversation context for Claude
-    conversation_history = ""
-    for i, entry in enumerate(context[-5:]):  # Use only last 5 entries for context
-        if entry.get("question") and entry.get("response"):
-            conversation_history += f"Pytanie: {entry['question']}\n"
-            conversation_history += f"Odpowiedź użytkownika: {entry['response']}\n\n"
-    
-    # Generate a hash of the conversation history for caching
-    cache_key = hash(conversation_history)
-    
-    # Check if we have a cached response for this conversation
-    if cache_key in question_cache:
-        return question_cache[cache_key]
-    
+    # Use only last 5 entries for context, trimmed to the token budget
+    entries = [entry for entry in context[-5:] if entry.get("question") and entry.get("response")]
+    conversation_history, _ = build_transcript(
+        entries,
+        lambda entry: f"Pytanie: {entry['question']}\nOdpowiedź użytkownika: {entry['response']}\n\n",
+        CONTEXT_TOKEN_BUDGET,
+    )
+
     # Define the prompt for Claude
     prompt = f"""
     Oto fragment rozmowy terapeutycznej w języku polskim. Przeanalizuj kontekst i wygeneruj jedno kolejne, pogłębiające pytanie dla użytkownika:
@@ -133,60 +103,136 @@ def generate_claude_question(context: Optional[List[Dict[str, Any]]] = None) ->
     
     Wygeneruj wyłącznie jedno pytanie, bez żadnego dodatkowego tekstu czy wyjaśnień.
     """
+    # Generate a hash of the conversation history for caching
+    return hash(conversation_history), prompt, 200
+
+def _cached_question(cache_key):
+    """Pytanie z cache'a albo None (z zapisem trafienia w metrykach)."""
+    cached = cache_key in question_cache
+    record_cache("claude_question", cached)
+    return question_cache[cache_key] if cached else None
+
+def _latest_answer_id(context):
+    """ID najnowszej odpowiedzi w kontekście (wpisy z kluczem 'id') albo None."""
+    ids = [entry["id"] for entry in context or [] if entry.get("response") and entry.get("id") is not None]
+    return max(ids) if ids else None
+
+def _remember_pending(user_id, answer_id, question):
+    """Zapamiętuje spóźnione pytanie jako następne pytanie użytkownika."""
+    with _pending_lock:
+        pending_questions.pop(user_id, None)
+        pending_questions[user_id] = (answer_id, question)
+        while len(pending_questions) > PENDING_QUESTIONS_MAX:
+            pending_questions.popitem(last=False)
+
+def _take_pending(user_id, context):
+    """
+    Spóźnione pytanie z poprzedniego żądania użytkownika albo None.
+
+    Pytanie jest używane, jeśli odpowiedź, na podstawie której powstało, jest wciąż
+    w kontekście (ostatnie odpowiedzi) - zwykle użytkownik odpowiedział w międzyczasie
+    tylko na pytanie zastępcze.
+    """
+    if user_id is None:
+        return None
+    with _pending_lock:
+        pending = pending_questions.pop(user_id, None)
+    if pending is None:
+        return None
+    answer_id, question = pending
+    usable = any(entry.get("id") == answer_id for entry in context or [] if entry.get("response"))
+    record_cache("claude_question_pending", usable)
+    return question if usable else None
+
+def _local_question(context, user_id=None) -> str:
+    """Pytanie bez wywołania LLM: z lokalnego indeksu, a gdy nic nie pasuje - z tematu rozmowy."""
+    if context and QUESTION_FALLBACK == "index":
+        from question_index import select_question
+        question = select_question(context, user_id)
+        if question:
+            return question
+
+    from therapy import generate_question
+    return generate_question(context)
+
+def _fallback_question(context, error=None, user_id=None) -> str:
+    """Pytanie z mechanizmu lokalnego, gdy Claude nie odpowiedział."""
+    if isinstance(error, DeadlineExceeded):
+        logger.info("Claude nie zdążył w limicie czasu żądania. Używam standardowego mechanizmu.")
+    elif error is not None:
+        error_msg = str(error)
+        logger.error(f"Błąd podczas generowania pytania z Claude: {error_msg}")
+
+        # Check if it's a rate limit error
+        if "rate_limit" in error_msg.lower() or "rate limit" in error_msg.lower():
+            logger.warning("Osiągnięto limit zapytań API Claude.")
+
+    if not context:
+        # Fallback to a default first question
+        from therapy import DEFAULT_FIRST_QUESTIONS
+        return random.choice(DEFAULT_FIRST_QUESTIONS)
+
+    # Fallback to standard question generation
+    return _local_question(context, user_id)
+
+async def _request_question_async(prompt: str, cache_key, max_tokens: int, deadline=None, on_late=None) -> str:
+    """
+    Wywołuje Claude i zapisuje pytanie w cache'u (po historii rozmowy).
+
+    Z limitem czasu (deadline) wywołanie jest wykonywane w tle: jeśli nie zdąży,
+    zgłaszany jest DeadlineExceeded, a spóźnione pytanie trafia do `on_late`.
+    """
+    async def fetch():
+        message = await create_message_async(**_question_request(prompt, max_tokens))
+        question = message.content[0].text.strip()
+        question_cache[cache_key] = question
+        return question
+
+    if deadline is None:
+        return await fetch()
+    return await run_within_deadline_async(("claude_question", cache_key), fetch, deadline, on_late)
+
+async def generate_claude_question_async(context: Optional[List[Dict[str, Any]]] = None, deadline=None,
+                                         user_id: Optional[int] = None) -> str:
+    """
+    Generuje terapeutyczne pytanie wykorzystując model Claude, które jest dopasowane 
+    do kontekstu wcześniejszych odpowiedzi użytkownika.
+    
+    Args:
+        context (list, optional): Lista poprzednich elementów konwersacji.
+                                Każdy element to słownik z kluczami 'question', 'response' i 'date'
+                                (oraz 'id' rozmowy - potrzebne dla spóźnionych pytań).
+        deadline (Deadline, optional): Budżet czasu żądania. Jeśli Claude nie odpowie w tym
+                                czasie, zwracane jest pytanie z mechanizmu lokalnego. Pytanie
+                                z Claude dokończone w tle jest zapamiętywane (w pamięci procesu)
+                                jako następne pytanie użytkownika - po odpowiedzi na pytanie
+                                zastępcze dostaje on pytanie z Claude do wcześniejszych odpowiedzi.
+        user_id (int, optional): Użytkownik - mechanizm lokalny pomija pytania już mu zadane.
     
+    Returns:
+        str: Terapeutyczne pytanie w języku polskim.
+    """
+    pending = _take_pending(user_id, context)
+    if pending is not None:
+        return pending
+
+    if not is_anthropic_available():
+        logger.warning("Anthropic Claude API jest niedostępne. Używam domyślnego mechanizmu generowania pytań.")
+        return _local_question(context, user_id)
+
+    cache_key, prompt, max_tokens = _prepare_question(context)
+    cached = _cached_question(cache_key)
+    if cached is not None:
+        return cached
+
+    # Spóźnione pytanie czeka na następne żądanie użytkownika (pytanie początkowe - w cache'u)
+    answer_id = _latest_answer_id(context)
+    on_late = None
+    if user_id is not None and answer_id is not None:
+        on_late = lambda question: _remember_pending(user_id, answer_id, question)
+
     try:
-        # Mechanizm ponownych prób z wykładniczym opóźnieniem
-        max_retries = 3
-        retry_delay = 1  # początkowe opóźnienie w sekundach
-        
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"Próba generowania pytania z Claude {attempt+1}/{max_retries}")
-                
-                # Call the Claude API
-                message = client.messages.create(
-                    model="claude-3-5-sonnet-20241022", # the newest Anthropic model is "claude-3-5-sonnet-20241022" which was released October 22, 2024.
-                    max_tokens=200,
-                    temperature=0.7,
-                    system="Jesteś empatycznym polskim psychoterapeutą specjalizującym się w terapii poznawczo-behawioralnej i refleksyjnym podejściu do problemów życiowych. Twoje pytania są głębokie, wnikliwe i zachęcają do autorefleksji.",
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                
-                question = message.content[0].text.strip()
-                
-                # Cache the response
-                question_cache[cache_key] = question
-                
-                return question
-                
-            except Exception as e:
-                error_msg = str(e)
-                logger.error(f"Błąd podczas generowania pytania z Claude: {error_msg}")
-                
-                # Check if it's a rate limit error
-                if "rate_limit" in error_msg.lower() or "rate limit" in error_msg.lower():
-                    logger.warning("Osiągnięto limit zapytań API Claude.")
-                    
-                    # Fallback to our standard question generation mechanism
-                    from therapy import generate_question
-                    return generate_question(context)
-                    
-                # If this is the last retry, use the standard question generation
-                if attempt == max_retries - 1:
-                    logger.error("Wyczerpano limit prób Claude. Używam standardowego mechanizmu.")
-                    from therapy import generate_question
-                    return generate_question(context)
-                    
-                # Add random jitter to delay
-                jitter = random.uniform(0, 0.5)
-                wait_time = retry_delay * (2 ** attempt) + jitter
-                logger.info(f"Ponawiam próbę za {wait_time:.2f} sekund...")
-                time.sleep(wait_time)
-                
+        # Ponawianie przejściowych błędów (z uwzględnieniem Retry-After) realizuje llm_client
+        return await _request_question_async(prompt, cache_key, max_tokens, deadline, on_late)
     except Exception as e:
-        logger.error(f"Nieoczekiwany błąd w module Claude: {str(e)}")
-        # Fallback to standard question generation
-        from therapy import generate_question
-        return generate_question(context)
\ No newline at end of file
+        return _fallback_question(context, e, user_id)
@@ -0,0 +1,208 @@
+"""
+Lokalny, słownikowy klasyfikator stanu emocjonalnego.
+
+Zwraca ten sam słownik co analiza emocjonalna LLM w advanced_nlp
+(dominant_emotions, emotional_state, suggested_focus_areas), ale liczony
+lokalnie w ułamku milisekundy:
+    - emocje i obszary tematyczne na podstawie słów kluczowych therapy.KEYWORDS,
+    - wydźwięk na podstawie polskiego słownika rdzeni pozytywnych i negatywnych,
+      z odwróceniem po przeczeniu ("nie jestem szczęśliwa" jest negatywne).
+
+Słowa są dopasowywane po rdzeniu (początku słowa), co obejmuje większość
+odmian ("stres", "stresu", "stresem").
+"""
+
+import re
+import functools
+from collections import Counter
+
+# Tematy z therapy.KEYWORDS będące emocjami (pozostałe to obszary rozmowy) i ich wydźwięk
+EMOTION_THEMES = {
+    "samotność": "negative",
+    "stres": "negative",
+    "lęk": "negative",
+    "smutek": "negative",
+    "złość": "negative",
+    "radość": "positive",
+}
+
+# Rdzenie słów o wydźwięku pozytywnym i negatywnym
+POSITIVE_STEMS = [
+    "dobr", "świetn", "wspania", "super", "rado", "ciesz", "szczęś", "zadowol",
+    "spokoj", "spokó", "odpręż", "relaks", "odpocz", "wdzięcz", "dumn", "nadziej", "ulga", "ulgi", "ulgę",
+    "kocha", "miłoś", "lubi", "przyjem", "satysfak", "spełni", "sukces", "udał", "udan", "uśmiech",
+    "śmiech", "entuzjaz", "motywac", "energi", "lekkoś", "bezpiecz", "wsparci", "bliskoś", "harmoni",
+    "wolnoś", "optymi", "pozytyw", "inspir", "pewnoś", "cudown", "fajn", "ciepł",
+]
+NEGATIVE_STEMS = [
+    "smut", "przygnęb", "płacz", "płak", "żal", "tęskn", "samotn", "osamotn", "opuszcz", "odrzuc",
+    "stres", "napięc", "napięt", "presj", "przytłocz", "przeciąż", "zmęcz", "wyczerp", "wypal", "bezsen",
+    "lęk", "strach", "boję", "boje", "boi", "niepok", "obaw", "martw", "panik", "niepewn",
+    "złoś", "wściek", "gniew", "irytuj", "irytac", "zdenerw", "frustr", "wkurz", "rozczar", "porażk",
+    "bezsens", "beznadz", "bezradn", "trudn", "ciężk", "problem", "ból", "boli", "chor", "depres",
+    "wstyd", "winn", "krzywd", "kłót", "konflikt", "nienawi", "gorz", "gorsz", "źle", "kiepsk", "okropn",
+    "strasz", "fataln", "pustk", "nudn", "nudz", "zazdro",
+]
+
+# Słowa odwracające wydźwięk kolejnych NEGATION_SCOPE słów
+NEGATIONS = {"nie", "bez", "ani", "brak", "nigdy"}
+NEGATION_SCOPE = 3
+
+# Liczba ostatnich wpisów rozmowy branych pod uwagę (jak w analizie LLM)
+CONTEXT_ENTRIES = 5
+
+# Przewaga wydźwięku, poniżej której stan jest mieszany (mniejszy / większy wynik)
+MIXED_RATIO = 0.5
+
+MAX_EMOTIONS = 3
+MAX_FOCUS_AREAS = 3
+
+DEFAULT_FOCUS_AREAS = {
+    "positive": ["źródła dobrego samopoczucia", "samoświadomość"],
+    "negative": ["radzenie sobie z emocjami", "wsparcie"],
+    "mixed": ["równowaga emocjonalna", "samoświadomość"],
+    "neutral": ["samoświadomość", "refleksja"],
+}
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def theme_is_emotion(theme):
+    return theme in EMOTION_THEMES
+
+
+def _stem(keyword):
+    """Rdzeń słowa kluczowego: krótkie słowa w całości, dłuższe bez końcówki fleksyjnej."""
+    if len(keyword) <= 4:
+        return keyword
+    return keyword[:-1] if len(keyword) == 5 else keyword[:-2]
+
+
+def _build_lexicon():
+    """
+    Słownik rdzeń -> lista (rodzaj, wartość) oraz frazy wielowyrazowe.
+
+    Rodzaj to "theme" (wartość = temat z therapy.KEYWORDS) albo "sentiment"
+    (wartość = +1 / -1). Rdzenie do 3 znaków wymagają dopasowania całego słowa.
+    """
+    from therapy import KEYWORDS
+
+    stems, phrases = {}, []
+    for theme, keywords in KEYWORDS.items():
+        for keyword in keywords:
+            keyword = keyword.lower()
+            if " " in keyword:
+                phrases.append((keyword, theme))
+            else:
+                stems.setdefault(_stem(keyword), []).append(("theme", theme))
+    for stem in POSITIVE_STEMS:
+        stems.setdefault(stem, []).append(("sentiment", 1))
+    for stem in NEGATIVE_STEMS:
+        stems.setdefault(stem, []).append(("sentiment", -1))
+    # Duplikaty (np. ten sam rdzeń w kilku listach) liczone raz
+    stems = {stem: list(dict.fromkeys(entries)) for stem, entries in stems.items()}
+    return stems, phrases
+
+
+_LEXICON = None
+
+
+def _get_lexicon():
+    global _LEXICON
+    if _LEXICON is None:
+        stems, phrases = _build_lexicon()
+        lengths = sorted({len(stem) for stem in stems}, reverse=True)
+        _LEXICON = (stems, phrases, lengths)
+    return _LEXICON
+
+
+@functools.lru_cache(maxsize=50000)
+def _match(word):
+    """Wpisy słownika dla wszystkich rdzeni pasujących do słowa (bez powtórzeń)."""
+    stems, _, lengths = _get_lexicon()
+    entries = {}
+    for length in lengths:
+        if length > len(word) or (length <= 3 and length != len(word)):
+            continue
+        for entry in stems.get(word[:length], ()):
+            entries[entry] = None
+    return tuple(entries)
+
+
+def score_text(text):
+    """
+    Zlicza trafienia słownika w tekście.
+
+    Returns:
+        tuple: (Counter tematów, wynik pozytywny, wynik negatywny)
+    """
+    _, phrases, _ = _get_lexicon()
+    text = text.lower()
+    themes = Counter(theme for phrase, theme in phrases if phrase in text)
+    positive = negative = 0
+    negated_until = -1
+
+    for position, word in enumerate(_WORD_PATTERN.findall(text)):
+        if word in NEGATIONS:
+            negated_until = position + NEGATION_SCOPE
+            continue
+        negated = position <= negated_until
+        entries = _match(word)
+        if not entries:
+            continue
+
+        polarity = 0
+        for kind, value in entries:
+            if kind == "sentiment":
+                polarity = value
+            elif negated and theme_is_emotion(value):
+                # Zaprzeczona emocja ("nie czuję lęku") nie jest emocją dominującą
+                continue
+            else:
+                themes[value] += 1
+                if not polarity and theme_is_emotion(value):
+                    polarity = 1 if EMOTION_THEMES[value] == "positive" else -1
+
+        if negated:
+            polarity = -polarity
+        if polarity > 0:
+            positive += 1
+        elif polarity < 0:
+            negative += 1
+
+    return themes, positive, negative
+
+
+def emotional_state(positive, negative):
+    """Stan ogólny: positive, negative, mixed lub neutral."""
+    if positive <= 0 and negative <= 0:
+        return "neutral"
+    if min(positive, negative) / max(positive, negative) >= MIXED_RATIO:
+        return "mixed"
+    return "positive" if positive > negative else "negative"
+
+
+def classify(context):
+    """
+    Analiza stanu emocjonalnego na podstawie ostatnich odpowiedzi w kontekście rozmowy.
+
+    Args:
+        context (list): Wpisy rozmowy z kluczem 'response'
+
+    Returns:
+        dict: dominant_emotions, emotional_state, suggested_focus_areas
+              (jak analiza emocjonalna LLM w advanced_nlp)
+    """
+    text = " ".join(entry.get("response") or "" for entry in (context or [])[-CONTEXT_ENTRIES:])
+    themes, positive, negative = score_text(text)
+    state = emotional_state(positive, negative)
+
+    ranked = [theme for theme, _ in themes.most_common()]
+    emotions = [theme for theme in ranked if theme_is_emotion(theme)][:MAX_EMOTIONS]
+    focus_areas = [theme for theme in ranked if not theme_is_emotion(theme)][:MAX_FOCUS_AREAS]
+
+    return {
+        "dominant_emotions": emotions,
+        "emotional_state": state,
+        "suggested_focus_areas": focus_areas or list(DEFAULT_FOCUS_AREAS[state]),
+    }
@@ -0,0 +1,549 @@
+"""
+Lokalny, zastępczy serwer API Anthropic i OpenAI do testów obciążeniowych i benchmarków.
+
+Obsługuje endpointy używane przez aplikację:
+    POST /v1/messages           (Anthropic Messages API, także stream=true)
+    POST /v1/chat/completions   (OpenAI Chat Completions, także stream=true)
+    POST /v1/messages/batches   (Anthropic Message Batches: utworzenie partii)
+    GET  /v1/messages/batches/<id>          (stan partii)
+    GET  /v1/messages/batches/<id>/results  (wyniki partii w JSONL)
+    GET  /_stats                (liczniki żądań i wstrzykniętych błędów)
+
+Odpowiedzi są deterministyczne (zależą od treści żądania i ziarna) i zgodne ze
+schematem API, łącznie z formatem JSON analizy psychologicznej i analizy emocjonalnej.
+Opóźnienia i błędy 429/5xx są konfigurowalne, dzięki czemu można sprawdzać
+zachowanie aplikacji przy wolnym lub niestabilnym dostawcy. Partia wiadomości
+kończy się po --batch-delay sekundach; wstrzyknięte błędy trafiają wtedy do
+wyników pojedynczych żądań (typ "errored").
+
+Cache promptu Anthropic jest symulowany: prefiksy zakończone blokiem ze znacznikiem
+cache_control są zapamiętywane, a kolejne żądania zaczynające się od nich zgłaszają
+w usage cache_read_input_tokens i cache_creation_input_tokens. Jak u dostawcy,
+prefiks krótszy niż --cache-min-tokens nie jest cache'owany.
+
+Użycie:
+    python fake_llm_server.py --port 8089 --latency lognormal:-0.7,0.5 --error-429 0.05
+    LLM_BASE_URL=http://127.0.0.1:8089 python main.py
+"""
+
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Pule deterministycznych odpowiedzi
+QUESTIONS = [
+    "Co w ostatnich dniach najbardziej wpłynęło na Twoje samopoczucie i dlaczego właśnie to?",
+    "Jak wygląda Twój wewnętrzny dialog, gdy coś nie idzie po Twojej myśli?",
+    "Które z Twoich codziennych przyzwyczajeń daje Ci najwięcej spokoju?",
+    "Kiedy ostatnio poczułeś/aś, że naprawdę ktoś Cię rozumie? Co się wtedy wydarzyło?",
+    "Co chciałbyś/chciałabyś powiedzieć sobie sprzed roku, wiedząc to, co wiesz dziś?",
+]
+
+QUOTES = [
+    "Spokój nie jest brakiem burzy, lecz umiejętnością tańca w deszczu.",
+    "Każdy dzień jest nową szansą, by lepiej zrozumieć siebie.",
+    "To, co akceptujemy, przestaje nas kontrolować.",
+    "Małe kroki prowadzą do wielkich zmian.",
+]
+
+TRAITS = ["Refleksyjność", "Empatia", "Sumienność", "Otwartość", "Wrażliwość", "Wytrwałość"]
+EMOTIONAL_PATTERNS = [
+    "Radość w kontaktach z bliskimi (4/5)",
+    "Smutek związany z przeszłością (2/5)",
+    "Lęk przed oceną innych (3/5)",
+    "Gniew tłumiony w sytuacjach konfliktowych (2/5)",
+    "Zaskoczenie własnymi reakcjami (3/5)",
+]
+COGNITIVE_PATTERNS = ["Analityczne myślenie", "Skłonność do perfekcjonizmu", "Orientacja na rozwiązania", "Myślenie katastroficzne"]
+INSIGHTS = [
+    "Regularna refleksja pomaga Ci zauważać źródła napięcia.",
+    "Relacje z bliskimi są dla Ciebie ważnym zasobem.",
+    "Wysokie wymagania wobec siebie bywają źródłem stresu.",
+    "Zauważasz coraz więcej swoich emocji w codziennych sytuacjach.",
+]
+GROWTH_AREAS = ["Samowspółczucie", "Stawianie granic", "Wyrażanie złości", "Odpoczynek bez poczucia winy"]
+EMOTIONS = ["radość", "smutek", "lęk", "złość", "spokój", "frustracja", "nadzieja"]
+EMOTIONAL_STATES = ["positive", "negative", "mixed", "neutral"]
+FOCUS_AREAS = ["relacje", "samoświadomość", "radzenie sobie ze stresem", "wartości", "emocje"]
+
+
+class FakeLLMConfig:
+    """Konfiguracja opóźnień i błędów wraz ze wspólnym (bezpiecznym wątkowo) generatorem losowym."""
+
+    def __init__(self, latency="fixed:0", chunk_delay=0.02, error_429=0.0, error_500=0.0,
+                 error_529=0.0, retry_after=1, seed=42, batch_delay=1.0, cache_min_tokens=1024):
+        self.latency = parse_latency(latency)
+        self.chunk_delay = chunk_delay
+        self.batch_delay = batch_delay
+        self.batches = {}
+        self.error_rates = [(429, error_429), (500, error_500), (529, error_529)]
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.seed = seed
+        self.cache_min_tokens = cache_min_tokens
+        self.prompt_cache = set()
+        self.stats = {"requests": 0, "streamed": 0, "batches": 0, "batch_requests": 0, "errors": {}}
+
+    def sample_latency(self):
+        with self._lock:
+            return max(0.0, self.latency(self._rng))
+
+    def sample_error(self):
+        """Zwraca kod błędu do wstrzyknięcia albo None."""
+        with self._lock:
+            roll = self._rng.random()
+        threshold = 0.0
+        for status, rate in self.error_rates:
+            threshold += rate
+            if roll < threshold:
+                return status
+        return None
+
+    def count(self, key, status=None, amount=1):
+        with self._lock:
+            if status is None:
+                self.stats[key] += amount
+            else:
+                self.stats["errors"][str(status)] = self.stats["errors"].get(str(status), 0) + 1
+
+
+def parse_latency(spec):
+    """
+    Parsuje specyfikację rozkładu opóźnienia (w sekundach).
+
+    Obsługiwane formaty: 'fixed:0.5', 'uniform:0.2,1.5', 'normal:0.8,0.2', 'lognormal:-0.7,0.5'.
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v] or [0.0]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: rng.gauss(values[0], values[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Nieznany rozkład opóźnienia: {spec}")
+
+
+def estimate_tokens(text):
+    """Przybliżona liczba tokenów (ok. 4 znaki na token)."""
+    return max(1, len(text) // 4)
+
+
+def _pick(pool, digest, offset, count=1):
+    """Deterministycznie wybiera `count` elementów z puli na podstawie skrótu żądania."""
+    start = digest[offset % len(digest)]
+    return [pool[(start + i) % len(pool)] for i in range(count)]
+
+
+def generate_text(prompt_text, seed):
+    """Tworzy deterministyczną odpowiedź dopasowaną do rodzaju zapytania."""
+    digest = hashlib.sha256(f"{seed}:{prompt_text}".encode("utf-8")).digest()
+
+    if "personality_traits" in prompt_text:
+        return json.dumps({
+            "personality_traits": _pick(TRAITS, digest, 0, 3),
+            "emotional_patterns": _pick(EMOTIONAL_PATTERNS, digest, 1, 3),
+            "cognitive_patterns": _pick(COGNITIVE_PATTERNS, digest, 2, 2),
+            "insights": _pick(INSIGHTS, digest, 3, 3),
+            "growth_areas": _pick(GROWTH_AREAS, digest, 4, 2),
+        }, ensure_ascii=False)
+
+    if "dominant_emotions" in prompt_text:
+        return json.dumps({
+            "dominant_emotions": _pick(EMOTIONS, digest, 0, 2),
+            "emotional_state": _pick(EMOTIONAL_STATES, digest, 1)[0],
+            "suggested_focus_areas": _pick(FOCUS_AREAS, digest, 2, 2),
+        }, ensure_ascii=False)
+
+    if "cytat" in prompt_text.lower():
+        return _pick(QUOTES, digest, 0)[0]
+
+    return _pick(QUESTIONS, digest, 0)[0]
+
+
+def _anthropic_prompt_text(body):
+    system = body.get("system") or ""
+    if isinstance(system, list):
+        system = " ".join(block.get("text", "") for block in system)
+    parts = [system]
+    for message in body.get("messages", []):
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(block.get("text", "") for block in content if isinstance(block, dict))
+        parts.append(content)
+    return "\n".join(parts)
+
+
+def _openai_prompt_text(body):
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        parts.append(content)
+    return "\n".join(parts)
+
+
+# Liczba bloków przed znacznikiem cache_control sprawdzanych przy szukaniu trafienia (jak u dostawcy)
+CACHE_LOOKBACK_BLOCKS = 20
+
+
+def _anthropic_blocks(body):
+    """Bloki treści żądania w kolejności prefiksu: (tekst, czy ma znacznik cache_control)."""
+    def blocks(content):
+        if isinstance(content, list):
+            return [(block.get("text", ""), "cache_control" in block) for block in content if isinstance(block, dict)]
+        return [(content or "", False)]
+
+    result = blocks(body.get("system") or "")
+    for message in body.get("messages", []):
+        result += blocks(message.get("content", ""))
+    return result
+
+
+def _anthropic_usage(config, body, prompt_text, text):
+    """
+    Zużycie tokenów z symulacją cache'a promptu.
+
+    Trafieniem jest najdłuższy zapamiętany prefiks kończący się na granicy bloku
+    w zasięgu CACHE_LOOKBACK_BLOCKS przed ostatnim znacznikiem; prefiksy do
+    znaczników są zapamiętywane dla kolejnych żądań.
+    """
+    total = estimate_tokens(prompt_text)
+    digest, tokens, boundaries, breakpoints = hashlib.sha256(), 0, [], []
+    for position, (block_text, marked) in enumerate(_anthropic_blocks(body)):
+        digest.update(block_text.encode("utf-8") + b"\0")
+        tokens += len(block_text) // 4
+        boundaries.append((digest.hexdigest(), tokens))
+        if marked:
+            breakpoints.append(position)
+
+    read = written = 0
+    with config._lock:
+        if breakpoints:
+            last = breakpoints[-1]
+            for key, prefix_tokens in reversed(boundaries[max(0, last - CACHE_LOOKBACK_BLOCKS):last + 1]):
+                if key in config.prompt_cache:
+                    read = prefix_tokens
+                    break
+        for position in breakpoints:
+            key, prefix_tokens = boundaries[position]
+            if prefix_tokens >= config.cache_min_tokens and key not in config.prompt_cache:
+                config.prompt_cache.add(key)
+                written = max(written, prefix_tokens - read)
+    return {
+        "input_tokens": max(1, total - read - written),
+        "cache_read_input_tokens": read,
+        "cache_creation_input_tokens": written,
+        "output_tokens": estimate_tokens(text),
+    }
+
+
+def _anthropic_message(body, prompt_text, text, usage=None):
+    """Obiekt Message Anthropic (odpowiedź bez streamu i wynik żądania w partii)."""
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "claude-fake"),
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": usage or {"input_tokens": estimate_tokens(prompt_text), "output_tokens": estimate_tokens(text)},
+    }
+
+
+def _anthropic_error(status):
+    error_type = {429: "rate_limit_error", 500: "api_error", 529: "overloaded_error"}[status]
+    return {"type": "error", "error": {"type": error_type, "message": f"Injected {status}"}}
+
+
+def _chunks(text, size=12):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Obsługa żądań; konfiguracja jest dostępna jako self.server.config."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Wyciszenie domyślnego logowania każdego żądania
+        pass
+
+    # --- Pomocnicze ---
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b"{}"
+        return json.loads(raw or b"{}")
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _send_event(self, data, event=None):
+        payload = ""
+        if event:
+            payload += f"event: {event}\n"
+        payload += f"data: {data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)}\n\n"
+        self.wfile.write(payload.encode("utf-8"))
+        self.wfile.flush()
+
+    def _inject_error(self, provider):
+        """Wysyła wstrzyknięty błąd; zwraca True, jeśli błąd został wysłany."""
+        config = self.server.config
+        status = config.sample_error()
+        if status is None:
+            return False
+
+        config.count("errors", status)
+        headers = {"Retry-After": str(config.retry_after)} if status == 429 else {}
+        if provider == "anthropic":
+            payload = _anthropic_error(status)
+        else:
+            error_type = {429: "rate_limit_exceeded", 500: "server_error", 529: "server_error"}[status]
+            payload = {"error": {"message": f"Injected {status}", "type": error_type, "code": error_type}}
+        self._send_json(status, payload, headers)
+        return True
+
+    # --- Routing ---
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            self._send_json(200, self.server.config.stats)
+        elif self.path.startswith("/v1/messages/batches/"):
+            batch_id, _, suffix = self.path[len("/v1/messages/batches/"):].partition("/")
+            batch = self.server.config.batches.get(batch_id)
+            if batch is None:
+                self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": "Not found"}})
+            elif suffix == "results":
+                self._batch_results(batch)
+            else:
+                self._send_json(200, self._batch_object(batch))
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        config = self.server.config
+        body = self._read_json()
+        config.count("requests")
+
+        if self.path == "/v1/messages/batches":
+            self._create_batch(body)
+            return
+        if self.path == "/v1/messages":
+            provider = "anthropic"
+        elif self.path == "/v1/chat/completions":
+            provider = "openai"
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        time.sleep(config.sample_latency())
+        if self._inject_error(provider):
+            return
+
+        if provider == "anthropic":
+            prompt_text = _anthropic_prompt_text(body)
+            text = generate_text(prompt_text, config.seed)
+            self._anthropic_response(body, prompt_text, text)
+        else:
+            prompt_text = _openai_prompt_text(body)
+            text = generate_text(prompt_text, config.seed)
+            self._openai_response(body, prompt_text, text)
+
+    # --- Message Batches ---
+
+    def _create_batch(self, body):
+        config = self.server.config
+        time.sleep(config.sample_latency())
+
+        results = []
+        for item in body.get("requests", []):
+            params = item.get("params", {})
+            status = config.sample_error()
+            if status is not None:
+                config.count("errors", status)
+                result = {"type": "errored", "error": _anthropic_error(status)}
+            else:
+                prompt_text = _anthropic_prompt_text(params)
+                message = _anthropic_message(params, prompt_text, generate_text(prompt_text, config.seed))
+                result = {"type": "succeeded", "message": message}
+            results.append({"custom_id": item.get("custom_id"), "result": result})
+
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        batch = {"id": batch_id, "created_at": datetime.now(timezone.utc), "results": results}
+        with config._lock:
+            config.batches[batch_id] = batch
+        config.count("batches")
+        config.count("batch_requests", amount=len(results))
+        self._send_json(200, self._batch_object(batch))
+
+    def _batch_object(self, batch):
+        created = batch["created_at"]
+        ended_at = created + timedelta(seconds=self.server.config.batch_delay)
+        ended = datetime.now(timezone.utc) >= ended_at
+        counts = {"processing": 0, "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0}
+        if ended:
+            for item in batch["results"]:
+                counts[item["result"]["type"]] += 1
+        else:
+            counts["processing"] = len(batch["results"])
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": counts,
+            "created_at": created.isoformat(),
+            "ended_at": ended_at.isoformat() if ended else None,
+            "expires_at": (created + timedelta(hours=24)).isoformat(),
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": (f"http://{self.headers.get('Host')}/v1/messages/batches/{batch['id']}/results"
+                            if ended else None),
+        }
+
+    def _batch_results(self, batch):
+        data = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in batch["results"]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/binary")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _anthropic_response(self, body, prompt_text, text):
+        config = self.server.config
+        usage = _anthropic_usage(config, body, prompt_text, text)
+
+        if not body.get("stream"):
+            self._send_json(200, _anthropic_message(body, prompt_text, text, usage))
+            return
+
+        message_id = f"msg_{uuid.uuid4().hex[:24]}"
+        model = body.get("model", "claude-fake")
+
+        config.count("streamed")
+        self._start_stream()
+        self._send_event({"type": "message_start", "message": {
+            "id": message_id, "type": "message", "role": "assistant", "model": model, "content": [],
+            "stop_reason": None, "stop_sequence": None,
+            "usage": dict(usage, output_tokens=1),
+        }}, "message_start")
+        self._send_event({"type": "content_block_start", "index": 0,
+                          "content_block": {"type": "text", "text": ""}}, "content_block_start")
+        for chunk in _chunks(text):
+            time.sleep(config.chunk_delay)
+            self._send_event({"type": "content_block_delta", "index": 0,
+                              "delta": {"type": "text_delta", "text": chunk}}, "content_block_delta")
+        self._send_event({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        self._send_event({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                          "usage": {"output_tokens": usage["output_tokens"]}}, "message_delta")
+        self._send_event({"type": "message_stop"}, "message_stop")
+
+    def _openai_response(self, body, prompt_text, text):
+        config = self.server.config
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = body.get("model", "gpt-fake")
+        created = int(time.time())
+        prompt_tokens, completion_tokens = estimate_tokens(prompt_text), estimate_tokens(text)
+
+        if not body.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+            return
+
+        config.count("streamed")
+        self._start_stream()
+        base = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model}
+        self._send_event(dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""},
+                                              "finish_reason": None}]))
+        for chunk in _chunks(text):
+            time.sleep(config.chunk_delay)
+            self._send_event(dict(base, choices=[{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]))
+        self._send_event(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        self._send_event("[DONE]")
+
+
+def create_server(host="127.0.0.1", port=8089, **config_kwargs):
+    """Tworzy serwer (bez uruchamiania); przydatne do startu w wątku z benchmarków."""
+    server = ThreadingHTTPServer((host, port), FakeLLMHandler)
+    server.daemon_threads = True
+    server.config = FakeLLMConfig(**config_kwargs)
+    return server
+
+
+def start_in_thread(host="127.0.0.1", port=0, **config_kwargs):
+    """Uruchamia serwer w wątku w tle; zwraca (serwer, base_url)."""
+    server = create_server(host, port, **config_kwargs)
+    thread = threading.Thread(target=server.serve_forever, name="fake-llm-server", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Zastępczy serwer API Anthropic/OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="fixed:0",
+                        help="Rozkład opóźnienia w sekundach: fixed:X, uniform:A,B, normal:M,S, lognormal:MU,SIGMA")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="Opóźnienie między fragmentami streamu (s)")
+    parser.add_argument("--error-429", type=float, default=0.0, help="Odsetek odpowiedzi 429")
+    parser.add_argument("--error-500", type=float, default=0.0, help="Odsetek odpowiedzi 500")
+    parser.add_argument("--error-529", type=float, default=0.0, help="Odsetek odpowiedzi 529 (przeciążenie)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Wartość nagłówka Retry-After dla 429 (s)")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="Czas przetwarzania partii wiadomości (s)")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024,
+                        help="Minimalna długość prefiksu cache'owanego w symulacji cache'a promptu (tokeny)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    server = create_server(
+        args.host, args.port,
+        latency=args.latency, chunk_delay=args.chunk_delay,
+        error_429=args.error_429, error_500=args.error_500, error_529=args.error_529,
+        retry_after=args.retry_after, seed=args.seed, batch_delay=args.batch_delay,
+        cache_min_tokens=args.cache_min_tokens,
+    )
+    print(f"Zastępczy serwer LLM nasłuchuje na http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
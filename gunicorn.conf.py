@@ -0,0 +1,53 @@
+"""
+Konfiguracja gunicorna dla wdrożenia produkcyjnego (gunicorn -c gunicorn.conf.py wsgi:app).
+
+Aplikacja jest ładowana i rozgrzewana raz w procesie nadrzędnym (preload_app),
+a workery dziedziczą ją po fork. Po fork każdy worker porzuca odziedziczone
+połączenia z bazą danych i uruchamia własne wątki tła.
+"""
+
+import os
+import glob
+import logging
+
+logger = logging.getLogger("gunicorn.error")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+# Widoki async czekają na pętlę LLM we wspólnym wątku, więc wątki workera nie są zajęte obliczeniami
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+
+# Pliki metryk z poprzedniego uruchomienia czyszczone przed załadowaniem aplikacji
+# (konfiguracja jest wczytywana przed preload)
+_multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if _multiproc_dir:
+    os.makedirs(_multiproc_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(_multiproc_dir, "*.db")):
+        os.remove(path)
+
+
+def when_ready(server):
+    logger.info(f"Aplikacja rozgrzana, uruchamianie {workers} workerów po {threads} wątków")
+
+
+def post_fork(server, worker):
+    # Pula połączeń skopiowana z procesu nadrzędnego nie może być używana przez workera
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    from app import start_background_services
+    start_background_services()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_worker_dead(worker.pid)
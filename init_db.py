@@ -1,13 +1,61 @@
-
 from app import app, db
+from sqlalchemy import inspect, text
+
+# Kolumny dodane do istniejących tabel (create_all nie zmienia istniejących tabel)
+ADDED_COLUMNS = {
+    "psychological_analysis": [
+        ("last_conversation_id", "INTEGER"),
+        ("last_conversation_at", "TIMESTAMP"),
+    ],
+}
+
+
+def upgrade_schema():
+    """Dodaje brakujące kolumny i indeksy w istniejącej bazie danych."""
+    from models import Conversation, PsychologicalAnalysis
+
+    inspector = inspect(db.engine)
+    added = set()
+    with db.engine.begin() as conn:
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for name, column_type in columns:
+                if name not in existing:
+                    print(f"Adding column {table}.{name}...")
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
+                    added.add((table, name))
+
+        for index in Conversation.__table__.indexes | PsychologicalAnalysis.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+        # Znacznik świeżości starszych analiz: najnowsza odpowiedź sprzed utworzenia analizy.
+        # Tylko przy dodaniu kolumny - później NULL oznacza analizę zastępczą, która ma
+        # pozostać nieaktualna i zostać wygenerowana ponownie.
+        if ("psychological_analysis", "last_conversation_id") not in added:
+            return
+        updated = conn.execute(text(
+            "UPDATE psychological_analysis SET "
+            "last_conversation_id = (SELECT max(c.id) FROM conversation c "
+            "    WHERE c.user_id = psychological_analysis.user_id AND c.response IS NOT NULL "
+            "    AND c.timestamp <= psychological_analysis.timestamp), "
+            "last_conversation_at = (SELECT max(c.timestamp) FROM conversation c "
+            "    WHERE c.user_id = psychological_analysis.user_id AND c.response IS NOT NULL "
+            "    AND c.timestamp <= psychological_analysis.timestamp) "
+            "WHERE last_conversation_id IS NULL"
+        )).rowcount
+        if updated:
+            print(f"Backfilled freshness watermark for {updated} analyses")
+
 
 def init_db():
     with app.app_context():
         # Import all models here
-        from models import User, Conversation, PsychologicalAnalysis, ReminderLog
-        
+        from models import (User, Conversation, PsychologicalAnalysis, EmotionIntensity, ReminderLog,
+                            SchedulerLease, NotificationOutbox)
+
         print("Creating database tables...")
         db.create_all()
+        upgrade_schema()
         print("Database tables created successfully!")
 
 if __name__ == "__main__":
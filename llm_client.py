@@ -0,0 +1,588 @@
+"""
+Wspólna warstwa klientów LLM (Anthropic i OpenAI).
+
+Moduły claude_api, advanced_nlp, psychology i quotes nie tworzą własnych klientów,
+tylko korzystają z funkcji tego modułu. Dzięki temu:
+    - jest jedna pula połączeń HTTP (keep-alive) na dostawcę i proces,
+    - każde wywołanie ma jawne limity czasu połączenia i odczytu,
+    - obowiązuje jedna polityka ponawiania, respektująca nagłówek Retry-After.
+
+Wywołania są asynchroniczne (create_message_async, create_chat_completion_async,
+run_within_deadline_async) i wykonuje je jedna pętla zdarzeń procesu, działająca
+w wątku tła, z klientami AsyncAnthropic/AsyncOpenAI i wspólną pulą połączeń.
+Korutyny można oczekiwać z dowolnej pętli: widoki async Flask (nowa pętla na
+żądanie) nie tracą połączeń keep-alive, a kod synchroniczny (CLI, wątki analizy
+wsadowej) uruchamia je przez asyncio.run. Widok async nadal zajmuje wątek workera
+gunicorna (gthread) na czas żądania - liczbę żądań w toku w workerze ogranicza
+liczba jego wątków - ale same wywołania API nie zajmują dodatkowych wątków.
+
+Analiza wsadowa (batch_analysis) korzysta dodatkowo z Message Batches API
+(create_message_batch, retrieve_message_batch, message_batch_results) - są to
+synchroniczne funkcje czekające na wynik wywołania wykonanego na pętli llm_client.
+
+Prompty są układane jako stały prefiks (prompt systemowy, wcześniejsza część
+transkryptu) i zmienny sufiks. cacheable() oznacza koniec prefiksu znacznikiem
+cache'a promptu Anthropic; OpenAI cache'uje wspólne prefiksy automatycznie.
+Tokeny świeże, odczytane z cache'a i zapisane do niego trafiają do metryk
+i atrybutów spanów każdego wywołania.
+"""
+
+import os
+import time
+import asyncio
+import contextvars
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Opcjonalny adres zastępczego serwera LLM (np. fake_llm_server.py) do testów offline
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL")
+
+# Limity czasu (sekundy)
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 3.0))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 30.0))
+
+# Polityka ponawiania
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BASE_DELAY = float(os.environ.get("LLM_RETRY_BASE_DELAY", 0.5))
+LLM_RETRY_MAX_DELAY = float(os.environ.get("LLM_RETRY_MAX_DELAY", 8.0))
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# Rozmiar puli połączeń na dostawcę - wspólnej dla wszystkich żądań w workerze
+LLM_ASYNC_POOL_SIZE = int(os.environ.get("LLM_ASYNC_POOL_SIZE", 100))
+
+# Znaczniki cache'a promptu Anthropic (cache_control) na stałych prefiksach promptów
+LLM_PROMPT_CACHING = os.environ.get("LLM_PROMPT_CACHING", "1").lower() in ("1", "true", "yes")
+
+# Sprawdź dostępność pakietów
+HAS_ANTHROPIC = False
+HAS_OPENAI = False
+_connection_errors = ()
+
+try:
+    import httpx
+except ImportError as e:
+    httpx = None
+    logger.warning(f"Nie można zaimportować pakietu httpx: {str(e)}")
+
+try:
+    import anthropic
+    HAS_ANTHROPIC = True
+    _connection_errors += (anthropic.APIConnectionError,)
+except ImportError as e:
+    logger.warning(f"Nie można zaimportować pakietu Anthropic: {str(e)}")
+
+try:
+    import openai
+    HAS_OPENAI = True
+    _connection_errors += (openai.APIConnectionError,)
+except ImportError as e:
+    logger.warning(f"Nie można zaimportować pakietu OpenAI: {str(e)}")
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+_async_loop = None
+_async_loop_pid = None
+_async_clients = {}
+_async_lock = threading.Lock()
+
+
+class LLMUnavailableError(RuntimeError):
+    """Dostawca nie jest skonfigurowany (brak pakietu lub klucza API)."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Pozostały budżet czasu żądania nie wystarcza na wywołanie API."""
+
+
+class Deadline:
+    """
+    Budżet czasu żądania, przekazywany w dół do generatorów pytań i cytatów.
+
+    Przykład:
+        deadline = Deadline(2.5)
+        question, quote = await asyncio.gather(
+            generate_claude_question_async(context, deadline=deadline),
+            generate_therapeutic_quote_async(deadline=deadline),
+        )
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """Pozostały czas w sekundach (nie mniej niż 0)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def can_cover(self, seconds):
+        """Czy w budżecie zostało co najmniej `seconds` sekund."""
+        return self.remaining() >= seconds
+
+    def __repr__(self):
+        return f"Deadline(remaining={self.remaining():.3f}s)"
+
+
+def _api_key(provider):
+    env_name = "ANTHROPIC_API_KEY" if provider == "anthropic" else "OPENAI_API_KEY"
+    # Zastępczy serwer nie sprawdza klucza
+    return os.environ.get(env_name) or ("fake-key" if LLM_BASE_URL else None)
+
+
+def is_anthropic_available():
+    """Czy można wywołać Anthropic API (pakiet i klucz są dostępne)."""
+    return HAS_ANTHROPIC and httpx is not None and bool(_api_key("anthropic"))
+
+
+def is_openai_available():
+    """Czy można wywołać OpenAI API (pakiet i klucz są dostępne)."""
+    return HAS_OPENAI and httpx is not None and bool(_api_key("openai"))
+
+
+def make_timeout(read=None, connect=None):
+    """Tworzy obiekt limitu czasu httpx z osobnym limitem połączenia i odczytu."""
+    read = read if read is not None else LLM_READ_TIMEOUT
+    connect = connect if connect is not None else LLM_CONNECT_TIMEOUT
+    return httpx.Timeout(read, connect=min(connect, read))
+
+
+def _deadline_timeout(read=None, connect=None, deadline=None):
+    """Limit czasu wywołania przycięty do pozostałego budżetu żądania."""
+    if deadline is None:
+        return make_timeout(read, connect)
+
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("Budżet czasu żądania został wyczerpany")
+    read = min(read if read is not None else LLM_READ_TIMEOUT, remaining)
+    connect = min(connect if connect is not None else LLM_CONNECT_TIMEOUT, remaining)
+    return make_timeout(read, connect)
+
+
+def _pool_limits(size):
+    return httpx.Limits(max_connections=size, max_keepalive_connections=size, keepalive_expiry=60.0)
+
+
+def reset_clients():
+    """Zamyka i usuwa klientów pętli llm_client."""
+    with _async_lock:
+        if _async_loop_pid == os.getpid():
+            asyncio.run_coroutine_threadsafe(_close_async_clients(), _async_loop)
+
+
+async def _close_async_clients():
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        try:
+            await client.close()
+        except Exception:
+            pass
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status
+
+
+def _retry_after(error):
+    """Czas oczekiwania (s) z nagłówków Retry-After / retry-after-ms albo None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    return None
+
+
+def is_retryable(error):
+    """Czy błąd jest przejściowy (limit, przeciążenie, błąd serwera lub połączenia)."""
+    if _connection_errors and isinstance(error, _connection_errors):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES
+
+
+async def call_with_retry_async(provider, func, max_retries=None, deadline=None):
+    """
+    Wywołuje `func` zgodnie ze wspólną polityką ponawiania.
+
+    Przejściowe błędy są ponawiane z wykładniczym opóźnieniem i losowym odchyleniem;
+    jeśli serwer podał Retry-After, czekamy tyle, ile wskazał (do LLM_RETRY_MAX_DELAY).
+
+    Args:
+        provider (str): 'anthropic' lub 'openai' (do logów)
+        func (callable): Funkcja zwracająca korutynę jednego wywołania API
+        max_retries (int, optional): Liczba ponowień (domyślnie LLM_MAX_RETRIES)
+        deadline (Deadline, optional): Nie ponawiaj, jeśli oczekiwanie przekroczyłoby budżet żądania
+    """
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+
+    for attempt in range(max_retries + 1):
+        try:
+            return await func()
+        except Exception as e:
+            delay = _retry_delay(provider, e, attempt, max_retries, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+
+
+def _retry_delay(provider, error, attempt, max_retries, deadline):
+    """Opóźnienie (s) przed kolejną próbą albo None, jeśli błędu nie należy ponawiać."""
+    if attempt >= max_retries or not is_retryable(error):
+        return None
+
+    delay = _retry_after(error)
+    if delay is None:
+        delay = LLM_RETRY_BASE_DELAY * (2 ** attempt) + random.uniform(0, LLM_RETRY_BASE_DELAY)
+    delay = min(delay, LLM_RETRY_MAX_DELAY)
+
+    if deadline is not None and not deadline.can_cover(delay):
+        logger.warning(f"Przejściowy błąd {provider}, ale ponowienie nie zmieści się w limicie czasu żądania")
+        return None
+
+    from metrics import LLM_RETRIES
+    from tracing import current_span
+    LLM_RETRIES.labels(provider=provider).inc()
+    current_span().increment_attribute("llm.retries")
+    logger.warning(f"Przejściowy błąd {provider} ({_status_code(error) or type(error).__name__}), "
+                   f"ponawiam za {delay:.2f}s (próba {attempt + 2}/{max_retries + 1})")
+    return delay
+
+
+def _log_token_estimate(provider, model, system, messages, max_tokens):
+    """Loguje przybliżoną liczbę tokenów wejściowych wywołania."""
+    from prompt_builder import estimate_request_tokens
+
+    input_tokens = estimate_request_tokens(system, messages)
+    logger.info(f"Wywołanie {provider} {model}: ~{input_tokens} tokenów wejścia, "
+                f"maks. {max_tokens or '-'} tokenów wyjścia")
+    return input_tokens
+
+
+def cacheable(text):
+    """
+    Blok treści kończący stały prefiks promptu (znacznik cache'a promptu Anthropic).
+
+    Używany jako element listy `system` lub `content` wiadomości. Prefiks krótszy
+    niż minimum dostawcy jest przetwarzany normalnie, bez cache'owania.
+    """
+    block = {"type": "text", "text": text}
+    if LLM_PROMPT_CACHING:
+        block["cache_control"] = {"type": "ephemeral"}
+    return block
+
+
+def _usage_tokens(result):
+    """
+    Tokeny wywołania: (świeże wejściowe, odczytane z cache'a, zapisane do cache'a, wyjściowe).
+
+    Anthropic podaje input_tokens bez tokenów z cache'a; w OpenAI prompt_tokens
+    obejmuje też tokeny odczytane z cache'a. None, gdy odpowiedź nie ma danych o zużyciu.
+    """
+    usage = getattr(result, "usage", None)
+    if usage is None:
+        return None
+    if hasattr(usage, "input_tokens"):
+        return (usage.input_tokens or 0, getattr(usage, "cache_read_input_tokens", None) or 0,
+                getattr(usage, "cache_creation_input_tokens", None) or 0, usage.output_tokens or 0)
+    cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    return (usage.prompt_tokens or 0) - cached, cached, 0, usage.completion_tokens or 0
+
+
+def _usage_attributes(result):
+    """Atrybuty spana z liczbą tokenów zużytych przez wywołanie (Anthropic lub OpenAI)."""
+    usage = getattr(result, "usage", None)
+    if usage is None:
+        return {}
+    if hasattr(usage, "input_tokens"):
+        return {
+            "gen_ai.usage.input_tokens": usage.input_tokens,
+            "gen_ai.usage.output_tokens": usage.output_tokens,
+            "gen_ai.usage.cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None),
+            "gen_ai.usage.cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None),
+        }
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "gen_ai.usage.input_tokens": usage.prompt_tokens,
+        "gen_ai.usage.output_tokens": usage.completion_tokens,
+        "gen_ai.usage.cache_read_input_tokens": getattr(details, "cached_tokens", None),
+    }
+
+
+@contextmanager
+def _observed(provider, model, estimated_tokens=None):
+    """
+    Pomiar czasu i wyniku wywołania (metryki, span i faza 'llm' żądania).
+
+    Blok zapisuje wynik wywołania w call["result"]; z niego brane jest zużycie tokenów.
+    """
+    from metrics import observe_llm_call, observe_llm_usage
+    from tracing import span
+
+    start = time.perf_counter()
+    call = {"result": None}
+    try:
+        with span(f"{provider} {model}", "client", {
+            "gen_ai.system": provider,
+            "gen_ai.request.model": model,
+            "llm.estimated_input_tokens": estimated_tokens,
+            "llm.retries": 0,
+        }, phase="llm") as current:
+            yield call
+            for key, value in _usage_attributes(call["result"]).items():
+                current.set_attribute(key, value)
+    except Exception as e:
+        observe_llm_call(provider, model, time.perf_counter() - start, error=e)
+        raise
+    seconds = time.perf_counter() - start
+    observe_llm_call(provider, model, seconds)
+    tokens = _usage_tokens(call["result"])
+    if tokens is not None:
+        observe_llm_usage(provider, model, seconds, *tokens)
+
+
+async def _observed_call_async(provider, model, func, max_retries, deadline, estimated_tokens=None):
+    """call_with_retry_async z pomiarem czasu i wyniku wywołania."""
+    with _observed(provider, model, estimated_tokens) as call:
+        call["result"] = await call_with_retry_async(provider, func, max_retries, deadline)
+    return call["result"]
+
+
+def _get_async_loop():
+    """Pętla zdarzeń wywołań asynchronicznych bieżącego procesu (wątek tła nie przetrwa fork)."""
+    global _async_loop, _async_loop_pid
+
+    with _async_lock:
+        if _async_loop_pid != os.getpid():
+            _async_loop = asyncio.new_event_loop()
+            _async_clients.clear()
+            threading.Thread(target=_async_loop.run_forever, name="llm-async-loop", daemon=True).start()
+            _async_loop_pid = os.getpid()
+            with _inflight_lock:
+                _inflight.clear()
+        return _async_loop
+
+
+def _get_async_client(provider):
+    """Zwraca (leniwie tworzonego) klienta asynchronicznego; wywoływane tylko na pętli llm_client."""
+    client = _async_clients.get(provider)
+    if client is not None:
+        return client
+
+    if provider == "anthropic":
+        client = anthropic.AsyncAnthropic(
+            api_key=_api_key("anthropic"),
+            base_url=LLM_BASE_URL,
+            http_client=httpx.AsyncClient(limits=_pool_limits(LLM_ASYNC_POOL_SIZE), timeout=make_timeout()),
+            max_retries=0,
+            timeout=make_timeout(),
+        )
+        logger.info("Zainicjalizowano asynchronicznego klienta Anthropic API")
+    else:
+        client = openai.AsyncOpenAI(
+            api_key=_api_key("openai"),
+            base_url=f"{LLM_BASE_URL}/v1" if LLM_BASE_URL else None,
+            http_client=httpx.AsyncClient(limits=_pool_limits(LLM_ASYNC_POOL_SIZE), timeout=make_timeout()),
+            max_retries=0,
+            timeout=make_timeout(),
+        )
+        logger.info("Zainicjalizowano asynchronicznego klienta OpenAI API")
+
+    _async_clients[provider] = client
+    return client
+
+
+def _submit(coro):
+    """
+    Uruchamia korutynę na pętli llm_client; zwraca concurrent.futures.Future.
+
+    Korutyna działa w nowym kontekście z przeniesionym tylko bieżącym spanem
+    (jak bind_current_span), bo może trwać dłużej niż żądanie, które ją zleciło.
+    """
+    from tracing import bind_current_span
+
+    loop = _get_async_loop()
+    return contextvars.Context().run(bind_current_span(lambda: asyncio.run_coroutine_threadsafe(coro, loop)))
+
+
+async def _run_on_loop(coro):
+    """Czeka na wynik korutyny wykonywanej na pętli llm_client (z dowolnej pętli zdarzeń)."""
+    if asyncio.get_running_loop() is _async_loop:
+        return await coro
+
+    from profiling import phase
+    with phase("llm"):
+        return await asyncio.wrap_future(_submit(coro))
+
+
+async def create_message_async(read_timeout=None, connect_timeout=None, max_retries=None, deadline=None, **kwargs):
+    """
+    Wywołuje Anthropic Messages API ze wspólnymi limitami czasu i ponawianiem.
+
+    Wywołanie wykonuje pętla zdarzeń llm_client, więc korutynę można oczekiwać z dowolnej
+    pętli, np. z widoku async Flask.
+
+    Args:
+        read_timeout (float, optional): Limit czasu odczytu odpowiedzi (s)
+        connect_timeout (float, optional): Limit czasu nawiązania połączenia (s)
+        max_retries (int, optional): Liczba ponowień przejściowych błędów
+        deadline (Deadline, optional): Budżet czasu żądania - przycina limity czasu i ponawianie
+        **kwargs: Parametry messages.create (model, max_tokens, system, messages, ...)
+
+    Raises:
+        LLMUnavailableError: Gdy Anthropic API jest niedostępne
+        DeadlineExceeded: Gdy budżet czasu żądania jest już wyczerpany
+    """
+    if not is_anthropic_available():
+        raise LLMUnavailableError("Anthropic API jest niedostępne")
+
+    estimated = _log_token_estimate("anthropic", kwargs.get("model"), kwargs.get("system"), kwargs.get("messages"),
+                                    kwargs.get("max_tokens"))
+    timeout = _deadline_timeout(read_timeout, connect_timeout, deadline)
+    call = lambda: _get_async_client("anthropic").messages.create(timeout=timeout, **kwargs)
+    return await _run_on_loop(_observed_call_async("anthropic", kwargs.get("model"), call, max_retries, deadline,
+                                                   estimated))
+
+
+async def create_chat_completion_async(read_timeout=None, connect_timeout=None, max_retries=None, deadline=None,
+                                       **kwargs):
+    """Wywołuje OpenAI Chat Completions (argumenty i wyjątki jak w create_message_async)."""
+    if not is_openai_available():
+        raise LLMUnavailableError("OpenAI API jest niedostępne")
+
+    estimated = _log_token_estimate("openai", kwargs.get("model"), None, kwargs.get("messages"),
+                                    kwargs.get("max_tokens"))
+    timeout = _deadline_timeout(read_timeout, connect_timeout, deadline)
+    call = lambda: _get_async_client("openai").chat.completions.create(timeout=timeout, **kwargs)
+    return await _run_on_loop(_observed_call_async("openai", kwargs.get("model"), call, max_retries, deadline,
+                                                   estimated))
+
+
+def _batch_call(operation, func, attributes=None):
+    """
+    Wykonuje wywołanie Message Batches API na pętli llm_client i czeka na wynik.
+
+    Funkcje partii są synchroniczne - wywołuje je skrypt analizy wsadowej, nie widoki.
+    """
+    from tracing import span
+
+    if not is_anthropic_available():
+        raise LLMUnavailableError("Anthropic API jest niedostępne")
+
+    async def call():
+        with span(f"anthropic {operation}", "client", dict(attributes or {}, **{"gen_ai.system": "anthropic"})):
+            return await call_with_retry_async("anthropic", lambda: func(_get_async_client("anthropic").messages.batches))
+
+    return _submit(call()).result()
+
+
+def create_message_batch(requests):
+    """
+    Wysyła partię żądań do Anthropic Message Batches API.
+
+    Args:
+        requests (list): Elementy {"custom_id": str, "params": parametry messages.create}
+
+    Returns:
+        Obiekt MessageBatch z SDK Anthropic
+    """
+    return _batch_call("message_batches.create",
+                       lambda batches: batches.create(requests=requests, timeout=make_timeout()),
+                       {"llm.batch.requests": len(requests)})
+
+
+def retrieve_message_batch(batch_id):
+    """Zwraca aktualny stan partii (processing_status, request_counts)."""
+    return _batch_call("message_batches.retrieve",
+                       lambda batches: batches.retrieve(batch_id, timeout=make_timeout()),
+                       {"llm.batch.id": batch_id})
+
+
+def message_batch_results(batch_id):
+    """Zwraca listę wyników zakończonej partii (kolejność dowolna, dopasowanie po custom_id)."""
+    async def results(batches):
+        return [item async for item in await batches.results(batch_id, timeout=make_timeout())]
+
+    return _batch_call("message_batches.results", results, {"llm.batch.id": batch_id})
+
+
+def _forget_inflight(key, future):
+    with _inflight_lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Wywołanie API w tle ({key}) nie powiodło się: {future.exception()}")
+
+
+async def run_within_deadline_async(key, coro_factory, deadline, on_late=None):
+    """
+    Uruchamia korutynę z `coro_factory()` na pętli llm_client i czeka na wynik najwyżej do końca budżetu.
+
+    Jeśli wynik nie nadejdzie na czas, zgłasza DeadlineExceeded, ale wywołanie działa dalej
+    w tle, a jego wynik trafia do `on_late` - wywołujący decyduje, pod jakim kluczem
+    zapamiętać go dla następnego żądania. Równoległe wywołania z tym samym kluczem
+    współdzielą jedno wywołanie API.
+
+    Args:
+        key: Klucz deduplikacji (np. klucz cache'a wyniku)
+        coro_factory (callable): Funkcja bez argumentów zwracająca korutynę wywołania API
+        deadline (Deadline): Budżet czasu żądania
+        on_late (callable, optional): Wywoływana z wynikiem (w wątku pętli llm_client),
+            gdy wywołanie zakończy się powodzeniem po upływie budżetu
+
+    Raises:
+        DeadlineExceeded: Gdy wynik nie jest gotowy przed końcem budżetu
+    """
+    from tracing import span
+
+    _get_async_loop()
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = _submit(coro_factory())
+            _inflight[key] = future
+            future.add_done_callback(lambda f: _forget_inflight(key, f))
+
+    operation = key[0] if isinstance(key, tuple) else key
+    try:
+        with span("llm.wait", attributes={"llm.operation": str(operation),
+                                           "llm.deadline_remaining": deadline.remaining()}, phase="llm"):
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        from metrics import LLM_DEADLINE_FALLBACKS
+        LLM_DEADLINE_FALLBACKS.labels(operation=operation).inc()
+        if on_late is not None:
+            future.add_done_callback(lambda f: f.cancelled() or f.exception() is not None or on_late(f.result()))
+        logger.info(f"Wywołanie API ({key}) nie zmieściło się w limicie czasu żądania - kończę je w tle")
+        raise DeadlineExceeded(f"Przekroczono limit czasu żądania dla {key}")
@@ -1,4 +1,14 @@
-from app import app  # noqa: F401
+"""
+Serwer deweloperski. Produkcyjnie: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import app, start_background_services  # noqa: F401
 
 if __name__ == "__main__":
+    import warmup
+    from init_db import init_db
+
+    init_db()
+    warmup.warm_up(app)
+    start_background_services()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,243 @@
+"""
+Metryki aplikacji w formacie Prometheus, udostępniane pod /metrics.
+
+Zbierane są:
+    - czasy obsługi żądań (histogram per endpoint Flask, metoda i status),
+    - czasy, liczba i błędy wywołań LLM per dostawca i model (llm_client),
+    - tokeny wywołań LLM: świeże, odczytane i zapisane w cache'u promptu,
+    - trafienia i chybienia cache'ów pytań i analiz,
+    - czasy renderowania wykresów matplotlib i chmury słów,
+    - liczba zapytań SQL na żądanie i przekroczenia budżetu zapytań (query_budget),
+    - liczba wysłanych, ponawianych i nieudanych przypomnień,
+    - operacje hashowania haseł i wyniki prób logowania (passwords).
+
+Pod gunicornem z wieloma workerami ustaw PROMETHEUS_MULTIPROC_DIR na pusty katalog
+(czyszczony przy starcie) - wartości są wtedy zapisywane w plikach współdzielonych
+przez procesy, a /metrics agreguje je ze wszystkich workerów.
+
+Pakiet prometheus_client jest opcjonalny; bez niego metryki są ignorowane.
+"""
+
+import os
+import time
+import logging
+import functools
+from contextlib import contextmanager
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Opcjonalny token wymagany do odczytu /metrics (nagłówek "Authorization: Bearer <token>")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+HAS_PROMETHEUS = False
+try:
+    from prometheus_client import (
+        Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST, multiprocess,
+    )
+    HAS_PROMETHEUS = True
+except ImportError as e:
+    logger.warning(f"Nie można zaimportować pakietu prometheus_client - metryki są wyłączone: {str(e)}")
+
+
+class _NoopMetric:
+    """Zastępnik metryki, gdy prometheus_client nie jest zainstalowany."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+    @contextmanager
+    def time(self):
+        yield
+
+
+def _histogram(name, documentation, labelnames, buckets):
+    if not HAS_PROMETHEUS:
+        return _NoopMetric()
+    return Histogram(name, documentation, labelnames, buckets=buckets)
+
+
+def _counter(name, documentation, labelnames):
+    if not HAS_PROMETHEUS:
+        return _NoopMetric()
+    return Counter(name, documentation, labelnames)
+
+
+REQUEST_LATENCY = _histogram(
+    "http_request_duration_seconds", "Czas obsługi żądania HTTP",
+    ["endpoint", "method", "status"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+LLM_LATENCY = _histogram(
+    "llm_request_duration_seconds", "Czas wywołania API LLM (łącznie z ponowieniami)",
+    ["provider", "model", "outcome"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0),
+)
+LLM_REQUESTS = _counter("llm_requests_total", "Liczba wywołań API LLM", ["provider", "model", "outcome"])
+LLM_ERRORS = _counter("llm_errors_total", "Błędy wywołań API LLM wg rodzaju", ["provider", "model", "error"])
+LLM_RETRIES = _counter("llm_retries_total", "Ponowienia wywołań API LLM po błędach przejściowych", ["provider"])
+LLM_DEADLINE_FALLBACKS = _counter(
+    "llm_deadline_fallbacks_total", "Odpowiedzi zastępcze z powodu przekroczenia limitu czasu żądania", ["operation"],
+)
+
+LLM_TOKENS = _counter(
+    "llm_tokens_total", "Tokeny wywołań API LLM (input = świeże, cache_read / cache_write = cache promptu, output)",
+    ["provider", "model", "kind"],
+)
+LLM_PROMPT_CACHE_LATENCY = _histogram(
+    "llm_prompt_cache_request_duration_seconds",
+    "Czas udanego wywołania API LLM wg wyniku cache'a promptu (hit, write, none)",
+    ["provider", "model", "cache"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0),
+)
+
+CACHE_REQUESTS = _counter("cache_requests_total", "Odczyty cache'ów wyników LLM", ["cache", "result"])
+
+RENDER_LATENCY = _histogram(
+    "render_duration_seconds", "Czas renderowania wykresów i chmury słów",
+    ["chart"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+DB_QUERIES_PER_REQUEST = _histogram(
+    "db_queries_per_request", "Liczba zapytań SQL w jednym żądaniu",
+    ["endpoint"],
+    buckets=(1, 2, 3, 5, 8, 13, 20, 30, 50, 100),
+)
+QUERY_BUDGET_VIOLATIONS = _counter(
+    "query_budget_violations_total", "Przekroczenia budżetu zapytań SQL (count/time/n_plus_one)", ["endpoint", "kind"],
+)
+
+BATCH_ANALYSES = _counter(
+    "batch_analyses_total", "Analizy wykonane przez analizę wsadową (batch_analysis)", ["mode", "outcome"],
+)
+
+REMINDERS_DISPATCHED = _counter(
+    "reminders_dispatched_total", "Próby wysyłki przypomnień z kolejki", ["method", "outcome"],
+)
+REMINDERS_ENQUEUED = _counter("reminders_enqueued_total", "Przypomnienia dodane do kolejki", ["kind"])
+
+PASSWORD_HASHES = _counter(
+    "password_hashes_total", "Operacje na skrótach haseł w puli hashującej (passwords)", ["operation", "outcome"],
+)
+LOGIN_ATTEMPTS = _counter("login_attempts_total", "Próby logowania wg wyniku", ["outcome"])
+
+
+def record_cache(cache, hit):
+    """Zapisuje trafienie (hit=True) lub chybienie cache'u o podanej nazwie (metryka i zdarzenie spana)."""
+    from tracing import current_span
+
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+    current_span().add_event("cache_lookup", {"cache.name": cache, "cache.hit": hit})
+
+
+def observe_llm_call(provider, model, seconds, error=None):
+    """Zapisuje wynik wywołania LLM; `error` to wyjątek, jeśli wywołanie się nie powiodło."""
+    model = model or "unknown"
+    outcome = "success" if error is None else "error"
+    LLM_LATENCY.labels(provider=provider, model=model, outcome=outcome).observe(seconds)
+    LLM_REQUESTS.labels(provider=provider, model=model, outcome=outcome).inc()
+    if error is not None:
+        status = getattr(error, "status_code", None)
+        LLM_ERRORS.labels(provider=provider, model=model, error=str(status) if status else type(error).__name__).inc()
+
+
+def observe_llm_usage(provider, model, seconds, input_tokens, cache_read_tokens, cache_write_tokens, output_tokens):
+    """Zapisuje zużycie tokenów udanego wywołania LLM i jego czas wg wyniku cache'a promptu."""
+    model = model or "unknown"
+    for kind, amount in (("input", input_tokens), ("cache_read", cache_read_tokens),
+                         ("cache_write", cache_write_tokens), ("output", output_tokens)):
+        if amount:
+            LLM_TOKENS.labels(provider=provider, model=model, kind=kind).inc(amount)
+    cache = "hit" if cache_read_tokens else "write" if cache_write_tokens else "none"
+    LLM_PROMPT_CACHE_LATENCY.labels(provider=provider, model=model, cache=cache).observe(seconds)
+
+
+@contextmanager
+def time_render(chart):
+    """Mierzy czas renderowania wykresu o podanej nazwie (także jako span i faza 'render' żądania)."""
+    from tracing import span
+
+    start = time.perf_counter()
+    try:
+        with span(f"render {chart}", attributes={"render.chart": chart}, phase="render"):
+            yield
+    finally:
+        RENDER_LATENCY.labels(chart=chart).observe(time.perf_counter() - start)
+
+
+def timed_render(chart):
+    """Dekorator mierzący czas funkcji renderującej wykres."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with time_render(chart):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_latest():
+    """Zwraca (treść, content-type) z aktualnymi metrykami (ze wszystkich workerów w trybie multiprocess)."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid):
+    """Usuwa pliki metryk typu gauge zakończonego workera (hook child_exit gunicorna)."""
+    if HAS_PROMETHEUS and MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
+
+
+def init_app(app):
+    """Rejestruje pomiar czasu żądań i endpoint /metrics w aplikacji Flask."""
+    from flask import g, request, Response, abort
+
+    @app.before_request
+    def _start_request_timer():
+        g._metrics_start = time.perf_counter()
+
+    def _observe(status):
+        start = g.pop("_metrics_start", None)
+        if start is None or request.endpoint == "metrics":
+            return
+        # Endpoint zamiast ścieżki, by liczba serii nie rosła z identyfikatorami w URL
+        REQUEST_LATENCY.labels(
+            endpoint=request.endpoint or "unmatched", method=request.method, status=str(status),
+        ).observe(time.perf_counter() - start)
+
+    @app.after_request
+    def _record_request(response):
+        _observe(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _record_failed_request(exception):
+        # after_request nie jest wywoływane przy nieobsłużonym wyjątku
+        if exception is not None:
+            _observe(500)
+
+    @app.route('/metrics')
+    def metrics():
+        if not HAS_PROMETHEUS:
+            abort(404)
+        if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+            abort(401)
+        body, content_type = render_latest()
+        return Response(body, content_type=content_type)
+
+    return app
@@ -58,6 +58,13 @@ class Conversation(db.Model):
     response = db.Column(db.Text, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.now)
 
+    __table_args__ = (
+        # Częściowy indeks tylko dla odpowiedzi - najnowsza odpowiedź użytkownika jednym odczytem indeksu
+        db.Index('ix_conversation_user_answered', 'user_id', 'id',
+                 sqlite_where=db.text('response IS NOT NULL'),
+                 postgresql_where=db.text('response IS NOT NULL')),
+    )
+
     def __repr__(self):
         return f'<Conversation {self.id}>'
 
@@ -67,19 +74,69 @@ class PsychologicalAnalysis(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.now)
     analysis_data = db.Column(db.Text, nullable=False)  # JSON z analizą psychologiczną
     emotional_intelligence_score = db.Column(db.Integer, default=0)
+
+    # Znacznik świeżości: ostatnia odpowiedź (Conversation) uwzględniona w analizie
+    last_conversation_id = db.Column(db.Integer, nullable=True)
+    last_conversation_at = db.Column(db.DateTime, nullable=True)
     
+    # Intensywności emocji wyodrębnione przy zapisie (szereg czasowy dla wykresów)
+    emotion_intensities = db.relationship('EmotionIntensity', backref='analysis', lazy=True,
+                                          cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # Najnowsza analiza użytkownika (decyzja o świeżości na /analysis) i historia do wykresów
+        db.Index('ix_psychological_analysis_user_timestamp', 'user_id', 'timestamp'),
+    )
+
     def get_analysis(self):
         """Konwertuje dane JSON na słownik Pythona"""
         return json.loads(self.analysis_data)
     
     def set_analysis(self, analysis_dict):
-        """Konwertuje słownik Pythona na JSON do przechowywania"""
+        """Konwertuje słownik Pythona na JSON do przechowywania i zapisuje intensywności emocji"""
+        from visualization import extract_emotion_intensities
+
         self.analysis_data = json.dumps(analysis_dict)
+        if self.timestamp is None:
+            self.timestamp = datetime.now()
+        self.emotion_intensities = [
+            EmotionIntensity(user_id=self.user_id, timestamp=self.timestamp, emotion=emotion, intensity=intensity)
+            for emotion, intensity in extract_emotion_intensities(analysis_dict)
+        ]
     
+    def is_stale(self, watermark_id):
+        """
+        Sprawdza, czy analiza nie obejmuje najnowszej odpowiedzi użytkownika.
+
+        Args:
+            watermark_id (int): ID najnowszej odpowiedzi użytkownika (None, jeśli brak odpowiedzi)
+        """
+        if watermark_id is None:
+            return False
+        return self.last_conversation_id is None or self.last_conversation_id < watermark_id
+
     def __repr__(self):
         return f'<PsychologicalAnalysis {self.id} User {self.user_id}>'
 
 
+class EmotionIntensity(db.Model):
+    """Intensywność emocji z jednej analizy (wąska tabela szeregów czasowych dla wykresów)."""
+    id = db.Column(db.Integer, primary_key=True)
+    analysis_id = db.Column(db.Integer, db.ForeignKey('psychological_analysis.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)  # czas analizy
+    emotion = db.Column(db.String(32), nullable=False)
+    intensity = db.Column(db.SmallInteger, nullable=False)  # 1-5
+
+    __table_args__ = (
+        db.Index('ix_emotion_intensity_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_emotion_intensity_analysis', 'analysis_id'),
+    )
+
+    def __repr__(self):
+        return f'<EmotionIntensity {self.emotion}={self.intensity} Analysis {self.analysis_id}>'
+
+
 class ReminderLog(db.Model):
     """Log wszystkich wysłanych przypomnień."""
     id = db.Column(db.Integer, primary_key=True)
@@ -91,3 +148,44 @@ class ReminderLog(db.Model):
     
     def __repr__(self):
         return f'<ReminderLog {self.id} User {self.user_id} Method {self.method} Status {self.status}>'
+
+
+class NotificationOutbox(db.Model):
+    """Kolejka powiadomień do wysłania (outbox), opróżniana przez proces dostarczający."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    reminder_log_id = db.Column(db.Integer, db.ForeignKey('reminder_log.id'), nullable=True)  # status widoczny w UI
+    method = db.Column(db.String(10), nullable=False)  # 'email' lub 'sms'
+    idempotency_key = db.Column(db.String(128), unique=True, nullable=False)  # chroni przed podwójną wysyłką
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'sending', 'sent', 'failed'
+    attempts = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    available_at = db.Column(db.DateTime, default=datetime.now)  # najwcześniejszy czas (kolejnej) próby
+    sent_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_notification_outbox_status_available', 'status', 'available_at'),
+    )
+
+    def __repr__(self):
+        return f'<NotificationOutbox {self.id} User {self.user_id} Status {self.status}>'
+
+
+class SchedulerLease(db.Model):
+    """Dzierżawa lidera dla zadań cyklicznych (jedna instancja wysyła naraz)."""
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=True)  # identyfikator procesu trzymającego dzierżawę
+    expires_at = db.Column(db.DateTime, nullable=True)  # UTC, po tym czasie dzierżawę może przejąć inny proces
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+    # Metryki ostatniego cyklu, czytelne z dowolnego procesu
+    last_tick_at = db.Column(db.DateTime, nullable=True)
+    last_tick_lag = db.Column(db.Float, default=0.0)  # opóźnienie startu cyklu względem planu (s)
+    last_tick_duration = db.Column(db.Float, default=0.0)  # czas trwania cyklu (s)
+    last_sent_count = db.Column(db.Integer, default=0)
+    total_ticks = db.Column(db.Integer, default=0)
+    total_sent = db.Column(db.Integer, default=0)
+
+    def __repr__(self):
+        return f'<SchedulerLease {self.name} Holder {self.holder}>'
@@ -0,0 +1,186 @@
+"""
+Hashowanie haseł poza wątkiem żądania i ograniczanie prób logowania.
+
+Skróty haseł (scrypt/pbkdf2 z Werkzeug) są celowo kosztowne obliczeniowo. Liczone
+są w osobnej puli wątków o stałym rozmiarze (PASSWORD_HASH_WORKERS), więc fala
+logowań (np. tuż po wysyłce przypomnień) zajmuje najwyżej tyle rdzeni, ile wątków
+puli, a pozostałe żądania workera są obsługiwane dalej. Gdy w kolejce czeka już
+PASSWORD_HASH_QUEUE operacji, kolejne są odrzucane (PasswordHashingBusy).
+
+Nieudane próby logowania są liczone w oknie LOGIN_ATTEMPT_WINDOW osobno dla konta
+i dla adresu IP; po przekroczeniu limitu próby są odrzucane przed liczeniem skrótu.
+Liczniki są przechowywane w pamięci procesu, więc przy wielu workerach gunicorna
+limit dotyczy każdego workera z osobna.
+
+Po udanym logowaniu skrót zapisany z innymi parametrami niż PASSWORD_HASH_METHOD
+jest przeliczany i zapisywany ponownie (needs_rehash).
+"""
+
+import os
+import time
+import logging
+import threading
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import metrics
+import tracing
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Metoda i parametry skrótu Werkzeug, np. "scrypt:32768:8:1" albo "pbkdf2:sha256:1000000"
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+
+# Liczba wątków liczących skróty i maksymalna liczba operacji w kolejce (na proces)
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", 32))
+
+# Limit nieudanych prób logowania w oknie (s) dla jednego konta i jednego adresu IP.
+# Adres IP klienta za reverse proxy wymaga poprawnego TRUSTED_PROXY_HOPS (app.py) - inaczej
+# wszyscy klienci dzielą adres proxy i limit na IP blokuje logowanie wszystkim.
+LOGIN_ATTEMPT_WINDOW = float(os.environ.get("LOGIN_ATTEMPT_WINDOW", 300))
+LOGIN_MAX_ATTEMPTS_PER_ACCOUNT = int(os.environ.get("LOGIN_MAX_ATTEMPTS_PER_ACCOUNT", 5))
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.environ.get("LOGIN_MAX_ATTEMPTS_PER_IP", 20))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+class PasswordHashingBusy(Exception):
+    """Kolejka hashowania jest pełna."""
+
+
+def _get_executor():
+    """Pula wątków hashujących bieżącego procesu (tworzona ponownie po fork)."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _run(operation, func, *args):
+    """Wykonuje func w puli hashującej i czeka na wynik."""
+    if not _slots.acquire(blocking=False):
+        metrics.PASSWORD_HASHES.labels(operation, "busy").inc()
+        logger.warning(f"Kolejka hashowania haseł jest pełna, odrzucono operację '{operation}'")
+        raise PasswordHashingBusy()
+    try:
+        with tracing.span(f"password.{operation}", phase="password"):
+            result = _get_executor().submit(func, *args).result()
+        metrics.PASSWORD_HASHES.labels(operation, "ok").inc()
+        return result
+    finally:
+        _slots.release()
+
+
+@functools.lru_cache(maxsize=None)
+def _current_method():
+    """Pełny zapis metody z parametrami, jaki Werkzeug umieszcza w skrócie."""
+    return generate_password_hash("", method=PASSWORD_HASH_METHOD).split("$", 1)[0]
+
+
+@functools.lru_cache(maxsize=None)
+def _dummy_hash():
+    """Skrót porównywany przy nieistniejącym koncie, żeby czas odpowiedzi nie zdradzał loginów."""
+    return generate_password_hash(os.urandom(16).hex(), method=PASSWORD_HASH_METHOD)
+
+
+def _check_missing_account(password):
+    check_password_hash(_dummy_hash(), password)
+    return False
+
+
+def hash_password(password):
+    """Zwraca skrót hasła liczony w puli hashującej."""
+    return _run("hash", generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    """
+    Sprawdza hasło w puli hashującej.
+
+    Args:
+        password_hash (str | None): Zapisany skrót; None dla nieistniejącego konta
+        password (str): Podane hasło
+    """
+    if password_hash is None:
+        return _run("verify", _check_missing_account, password or "")
+    return _run("verify", check_password_hash, password_hash, password or "")
+
+
+def needs_rehash(password_hash):
+    """Czy skrót zapisano z innymi parametrami niż PASSWORD_HASH_METHOD."""
+    return password_hash.split("$", 1)[0] != _current_method()
+
+
+class AttemptLimiter:
+    """Licznik nieudanych prób w przesuwnym oknie czasowym, per klucz."""
+
+    # Liczba kluczy, powyżej której przy zapisie usuwane są wszystkie wygasłe
+    MAX_KEYS = 10000
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, key, now):
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if not attempts:
+            del self._attempts[key]
+            return None
+        return attempts
+
+    def retry_after(self, key):
+        """Sekundy do odblokowania klucza (0 - próba dozwolona)."""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._prune(key, now)
+            if attempts is None or len(attempts) < self.limit:
+                return 0
+            return max(attempts[0] + self.window - now, 0)
+
+    def record_failure(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._attempts) > self.MAX_KEYS:
+                for stale in list(self._attempts):
+                    self._prune(stale, now)
+            self._prune(key, now)
+            self._attempts.setdefault(key, deque()).append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+account_attempts = AttemptLimiter(LOGIN_MAX_ATTEMPTS_PER_ACCOUNT, LOGIN_ATTEMPT_WINDOW)
+ip_attempts = AttemptLimiter(LOGIN_MAX_ATTEMPTS_PER_IP, LOGIN_ATTEMPT_WINDOW)
+
+
+def login_retry_after(username, ip):
+    """Sekundy do kolejnej dozwolonej próby logowania (0 - próba dozwolona)."""
+    return max(account_attempts.retry_after((username or "").lower()), ip_attempts.retry_after(ip))
+
+
+def record_login_failure(username, ip):
+    account_attempts.record_failure((username or "").lower())
+    ip_attempts.record_failure(ip)
+
+
+def record_login_success(username):
+    account_attempts.reset((username or "").lower())
@@ -0,0 +1,268 @@
+"""
+Profilowanie żądań na żądanie i wykrywanie wolnych żądań.
+
+Profilowanie (cProfile) całego żądania uruchamia się, gdy:
+    - zalogowany administrator (PROFILING_ADMINS) wyśle nagłówek "X-Profile: 1"
+      lub doda do adresu parametr ?profile=1,
+    - albo żądanie zostanie wylosowane z prawdopodobieństwem PROFILING_SAMPLE_RATE.
+
+Widoki async (flask[async]) wykonują się w osobnym wątku asgiref, którego cProfile
+wątku żądania nie obejmuje - dla nich profiler jest włączany także w wątku widoku,
+a oba profile są łączone w jeden plik.
+
+Wynik zapisywany jest w PROFILE_DIR (plik .prof do otwarcia w pstats/snakeviz),
+a jego nazwa zwracana w nagłówku X-Profile-Id. Administratorzy mogą pobierać
+profile przez /admin/profiles.
+
+Niezależnie od profilowania każde żądanie mierzy czas w fazach (phase):
+    sql - zapytania do bazy (zdarzenia silnika SQLAlchemy, tracing.init_app),
+    llm - wywołania API LLM (llm_client),
+    render - wykresy matplotlib i chmura słów,
+    template - renderowanie szablonów Jinja (tracing.init_app),
+    password - oczekiwanie na hashowanie haseł (passwords).
+Żądanie dłuższe niż SLOW_REQUEST_THRESHOLD jest logowane z rozbiciem na fazy.
+Czasy faz są rozłączne: czas fazy zagnieżdżonej nie jest liczony w fazie nadrzędnej.
+"""
+
+import os
+import re
+import time
+import random
+import inspect
+import functools
+import pstats
+import cProfile
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Nazwy użytkowników z dostępem do profilowania, oddzielone przecinkami
+PROFILING_ADMINS = {name.strip() for name in os.environ.get("PROFILING_ADMINS", "").split(",") if name.strip()}
+
+# Odsetek żądań profilowanych automatycznie (0.0 - 1.0)
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", 0.0))
+
+# Próg (s), powyżej którego żądanie jest logowane z rozbiciem na fazy
+SLOW_REQUEST_THRESHOLD = float(os.environ.get("SLOW_REQUEST_THRESHOLD", 2.0))
+
+# Katalog na pliki profili (domyślnie <instance>/profiles) i maksymalna liczba przechowywanych profili
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+
+_PROFILE_NAME_PATTERN = re.compile(r"^[\w.-]+\.prof$")
+
+
+def _request_state():
+    """Stan pomiaru bieżącego żądania albo None poza kontekstem żądania."""
+    from flask import g, has_request_context
+
+    if not has_request_context():
+        return None
+    return g.get("_profiling")
+
+
+def push_phase(name):
+    """Rozpoczyna fazę (używane przez phase() i tracing.span(phase=...))."""
+    state = _request_state()
+    if state is not None:
+        state["stack"].append([name, time.perf_counter(), 0.0])
+
+
+def pop_phase():
+    """Kończy ostatnio rozpoczętą fazę i dolicza jej czas własny."""
+    _pop_phase(_request_state())
+
+
+def _pop_phase(state):
+    if state is None or not state["stack"]:
+        return
+    name, start, child_time = state["stack"].pop()
+    elapsed = time.perf_counter() - start
+    phases = state["phases"]
+    total, count = phases.get(name, (0.0, 0))
+    phases[name] = (total + elapsed - child_time, count + 1)
+    if state["stack"]:
+        state["stack"][-1][2] += elapsed
+
+
+@contextmanager
+def phase(name):
+    """
+    Mierzy czas fragmentu żądania jako fazę o podanej nazwie.
+
+    Poza kontekstem żądania (np. w wątkach tła) nic nie robi.
+    """
+    push_phase(name)
+    try:
+        yield
+    finally:
+        pop_phase()
+
+
+def _is_admin():
+    from flask import session
+
+    user_id = session.get('user_id')
+    if not user_id or not PROFILING_ADMINS:
+        return False
+    from app import db
+    from models import User
+    user = db.session.get(User, user_id)
+    return user is not None and user.username in PROFILING_ADMINS
+
+
+def _profiling_requested():
+    from flask import request
+
+    return request.headers.get("X-Profile") == "1" or request.args.get("profile") == "1"
+
+
+def _profile_dir(app):
+    path = PROFILE_DIR or os.path.join(app.instance_path, "profiles")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _save_profile(app, profilers, endpoint, elapsed):
+    """Zapisuje połączone profile żądania do pliku i usuwa najstarsze ponad PROFILE_KEEP."""
+    directory = _profile_dir(app)
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}_{endpoint or 'unmatched'}_{int(elapsed * 1000)}ms.prof"
+    path = os.path.join(directory, name)
+    stats = pstats.Stats(profilers[0])
+    for profiler in profilers[1:]:
+        stats.add(profiler)
+    stats.dump_stats(path)
+
+    profiles = sorted(f for f in os.listdir(directory) if f.endswith(".prof"))
+    for old in profiles[:-PROFILE_KEEP]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except OSError:
+            pass
+    return name
+
+
+def _profile_view_thread(func):
+    """
+    Opakowuje korutynę widoku tak, by profilowane żądanie było profilowane także w wątku,
+    w którym asgiref ją wykonuje (cProfile obejmuje tylko wątek, w którym go włączono).
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        state = _request_state()
+        if state is None or state["profiler"] is None:
+            return await func(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Profiler żądania obejmuje już ten wątek (Python 3.12+: sys.monitoring dla całego procesu)
+            return await func(*args, **kwargs)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            state["view_profilers"].append(profiler)
+
+    return wrapper
+
+
+def format_breakdown(phases, total):
+    """Tekstowe podsumowanie faz, np. "llm 2.50s (1), sql 0.10s (14), inne 0.20s"."""
+    parts = []
+    accounted = 0.0
+    for name, (seconds, count) in sorted(phases.items(), key=lambda item: -item[1][0]):
+        parts.append(f"{name} {seconds:.3f}s ({count})")
+        accounted += seconds
+    parts.append(f"inne {max(0.0, total - accounted):.3f}s")
+    return ", ".join(parts)
+
+
+def init_app(app):
+    """Rejestruje pomiar faz, profilowanie i endpointy pobierania profili."""
+    from flask import g, request, abort, jsonify, send_from_directory
+
+    ensure_sync = app.ensure_sync
+
+    def _ensure_sync(func):
+        if inspect.iscoroutinefunction(func):
+            func = _profile_view_thread(func)
+        return ensure_sync(func)
+
+    app.ensure_sync = _ensure_sync
+
+    @app.before_request
+    def _start_profiling():
+        if request.endpoint == "static":
+            return
+        g._profiling = {"start": time.perf_counter(), "stack": [], "phases": {}, "profiler": None,
+                        "view_profilers": []}
+
+        sampled = PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+        if sampled or (_profiling_requested() and _is_admin()):
+            profiler = cProfile.Profile()
+            g._profiling["profiler"] = profiler
+            try:
+                profiler.enable()
+            except ValueError:
+                # Inny profiler jest już aktywny w tym wątku
+                g._profiling["profiler"] = None
+
+    def _finish(response=None):
+        state = g.pop("_profiling", None)
+        if state is None:
+            return response
+
+        profiler = state["profiler"]
+        if profiler is not None:
+            profiler.disable()
+        # Fazy niezamknięte (np. po wyjątku) kończą się razem z żądaniem
+        while state["stack"]:
+            _pop_phase(state)
+
+        elapsed = time.perf_counter() - state["start"]
+        if profiler is not None:
+            try:
+                name = _save_profile(app, [profiler] + state["view_profilers"], request.endpoint, elapsed)
+                if response is not None:
+                    response.headers["X-Profile-Id"] = name
+                logger.info(f"Zapisano profil żądania {request.method} {request.path}: {name}")
+            except OSError as e:
+                logger.error(f"Nie można zapisać profilu żądania: {str(e)}")
+
+        if elapsed >= SLOW_REQUEST_THRESHOLD:
+            logger.warning(f"Wolne żądanie {request.method} {request.path} ({request.endpoint}): "
+                           f"{elapsed:.3f}s - {format_breakdown(state['phases'], elapsed)}")
+        return response
+
+    @app.after_request
+    def _finish_profiling(response):
+        return _finish(response)
+
+    @app.teardown_request
+    def _finish_failed_profiling(exception):
+        # after_request nie jest wywoływane przy nieobsłużonym wyjątku
+        _finish()
+
+    @app.route('/admin/profiles')
+    def list_profiles():
+        if not _is_admin():
+            abort(403)
+        directory = _profile_dir(app)
+        profiles = sorted((f for f in os.listdir(directory) if f.endswith(".prof")), reverse=True)
+        return jsonify([{"name": name, "size": os.path.getsize(os.path.join(directory, name))} for name in profiles])
+
+    @app.route('/admin/profiles/<name>')
+    def download_profile(name):
+        if not _is_admin():
+            abort(403)
+        if not _PROFILE_NAME_PATTERN.match(name):
+            abort(404)
+        return send_from_directory(_profile_dir(app), name, as_attachment=True)
+
+    return app
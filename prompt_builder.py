@@ -0,0 +1,180 @@
+"""
+Budowanie promptów z limitem tokenów.
+
+Odpowiedzi użytkowników bywają bardzo długie (wpisy dziennika), a historia rozmów
+rośnie bez końca. Zamiast doklejać surowy tekst do promptu, moduły LLM budują
+transkrypt przez build_transcript, który:
+    - przycina pojedyncze pola (pytanie, odpowiedź) do budżetu sekcji,
+      zostawiając początek i koniec wypowiedzi,
+    - zachowuje najnowsze wpisy, gdy cały transkrypt przekracza budżet,
+    - zwraca przybliżoną liczbę tokenów.
+
+Liczba tokenów jest szacowana lokalnie (bez tokenizera dostawcy) - wystarcza to
+do kontroli rozmiaru i kosztu, nie do rozliczeń.
+"""
+
+import os
+import re
+import logging
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Budżety sekcji (w przybliżonych tokenach)
+QUESTION_TOKEN_BUDGET = int(os.environ.get("PROMPT_QUESTION_TOKENS", 120))
+RESPONSE_TOKEN_BUDGET = int(os.environ.get("PROMPT_RESPONSE_TOKENS", 600))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("PROMPT_CONTEXT_TOKENS", 2000))
+ANALYSIS_TOKEN_BUDGET = int(os.environ.get("PROMPT_ANALYSIS_TOKENS", 8000))
+
+# Średnia liczba znaków na token dla słów (polskie słowa są dzielone na więcej części niż angielskie)
+CHARS_PER_TOKEN = 3.5
+
+TRUNCATION_MARKER = " […] "
+
+_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def _piece_tokens(piece):
+    if piece[0].isalnum() or piece[0] == "_":
+        return max(1, int(len(piece) / CHARS_PER_TOKEN + 0.5))
+    return 1
+
+
+def estimate_tokens(text):
+    """
+    Przybliżona liczba tokenów tekstu.
+
+    Każdy znak interpunkcyjny to jeden token, a słowo - co najmniej jeden token
+    na każde CHARS_PER_TOKEN znaków.
+    """
+    if not text:
+        return 0
+    return sum(_piece_tokens(piece) for piece in _PIECE_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text, max_tokens, head_ratio=0.7):
+    """
+    Przycina tekst do około `max_tokens` tokenów, zachowując początek i koniec.
+
+    Początek wypowiedzi zwykle zawiera temat, a koniec - wniosek lub aktualny stan,
+    dlatego środek jest zastępowany znacznikiem TRUNCATION_MARKER.
+
+    Returns:
+        str: Tekst bez zmian (jeśli mieści się w budżecie) albo przycięty
+    """
+    if not text or max_tokens <= 0:
+        return "" if max_tokens <= 0 else text
+
+    pieces = list(_PIECE_PATTERN.finditer(text))
+    costs = [_piece_tokens(m.group()) for m in pieces]
+    if sum(costs) <= max_tokens:
+        return text
+
+    head_budget = int(max_tokens * head_ratio)
+    tail_budget = max_tokens - head_budget
+
+    head_end, used = 0, 0
+    for match, cost in zip(pieces, costs):
+        if used + cost > head_budget:
+            break
+        used += cost
+        head_end = match.end()
+
+    tail_start, used = len(text), 0
+    for match, cost in zip(reversed(pieces), reversed(costs)):
+        if used + cost > tail_budget or match.start() < head_end:
+            break
+        used += cost
+        tail_start = match.start()
+
+    return text[:head_end].rstrip() + TRUNCATION_MARKER + text[tail_start:].lstrip()
+
+
+def build_transcript(entries, render_entry, total_budget, field_budgets=None):
+    """
+    Buduje transkrypt rozmowy mieszczący się w budżecie tokenów.
+
+    Argumenty jak w build_transcript_blocks.
+
+    Returns:
+        tuple: (tekst transkryptu, statystyki: tokens, entries, omitted, truncated)
+    """
+    blocks, stats = build_transcript_blocks(entries, render_entry, total_budget, field_budgets)
+    return "".join(blocks), stats
+
+
+def build_transcript_blocks(entries, render_entry, total_budget, field_budgets=None):
+    """
+    Buduje transkrypt rozmowy jako listę fragmentów (po jednym na wpis).
+
+    Fragmenty pozwalają wysłać transkrypt jako osobne bloki treści, np. ze
+    znacznikiem cache'a promptu na ostatnim wpisie (llm_client.cacheable).
+
+    Args:
+        entries (list): Wpisy w kolejności chronologicznej (najstarszy pierwszy)
+        render_entry (callable): Funkcja zamieniająca wpis (dict) na fragment tekstu
+        total_budget (int): Budżet całego transkryptu
+        field_budgets (dict, optional): Budżety pól wpisu; domyślnie pytanie i odpowiedź
+
+    Returns:
+        tuple: (fragmenty od najstarszego, statystyki: tokens, entries, omitted, truncated)
+    """
+    if field_budgets is None:
+        field_budgets = {"question": QUESTION_TOKEN_BUDGET, "response": RESPONSE_TOKEN_BUDGET}
+
+    blocks = []
+    used = 0
+    truncated = 0
+
+    # Od najnowszego - przy przekroczeniu budżetu odpadają najstarsze wpisy
+    for entry in reversed(entries):
+        trimmed = dict(entry)
+        shortened_fields = 0
+        for field, budget in field_budgets.items():
+            value = trimmed.get(field)
+            if isinstance(value, str):
+                shortened = truncate_to_tokens(value, budget)
+                if shortened != value:
+                    trimmed[field] = shortened
+                    shortened_fields += 1
+
+        block = render_entry(trimmed)
+        cost = estimate_tokens(block)
+        if blocks and used + cost > total_budget:
+            break
+        blocks.append(block)
+        used += cost
+        truncated += shortened_fields
+
+    omitted = len(entries) - len(blocks)
+    blocks.reverse()
+    if omitted:
+        note = f"[Pominięto {omitted} starszych wpisów ze względu na długość]\n\n"
+        blocks.insert(0, note)
+        used += estimate_tokens(note)
+
+    stats = {"tokens": used, "entries": len(entries) - omitted, "omitted": omitted, "truncated": truncated}
+    if omitted or truncated:
+        logger.info(f"Transkrypt przycięty do budżetu {total_budget} tokenów: "
+                    f"pominięto {omitted} wpisów, skrócono {truncated} pól (~{used} tokenów)")
+    return blocks, stats
+
+
+def estimate_request_tokens(system=None, messages=None):
+    """
+    Przybliżona liczba tokenów wejściowych wywołania API (prompt systemowy i wiadomości).
+
+    Obsługuje treść w postaci tekstu lub listy bloków ({"type": "text", "text": ...}).
+    """
+    def content_tokens(content):
+        if isinstance(content, str):
+            return estimate_tokens(content)
+        if isinstance(content, list):
+            return sum(estimate_tokens(block.get("text", "")) for block in content if isinstance(block, dict))
+        return 0
+
+    total = content_tokens(system) if system else 0
+    for message in messages or []:
+        total += content_tokens(message.get("content"))
+    return total
@@ -1,52 +1,24 @@
 import os
 import json
-import time
-import random
+import re
 import logging
 from datetime import datetime
 
+import numpy as np
+
+from llm_client import (
+    HAS_ANTHROPIC, HAS_OPENAI, is_anthropic_available, is_openai_available,
+    create_message_async, create_chat_completion_async, cacheable,
+)
+from prompt_builder import build_transcript_blocks, ANALYSIS_TOKEN_BUDGET
+from metrics import record_cache
+
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Sprawdź dostępność OpenAI API i utwórz klienta jeśli jest dostępne
-HAS_OPENAI = False
-openai_client = None
-
-try:
-    from openai import OpenAI
-    import httpx
-    HAS_OPENAI = True
-    
-    # Inicjalizacja klienta OpenAI
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if api_key:
-        openai_client = OpenAI(api_key=api_key)
-        logger.info("Zainicjalizowano klienta OpenAI API")
-    else:
-        logger.warning("Brak klucza API OpenAI (OPENAI_API_KEY)")
-except Exception as e:
-    logger.warning(f"OpenAI API jest niedostępne: {str(e)}")
-
-# Sprawdź dostępność Anthropic API i utwórz klienta jeśli jest dostępne
-HAS_ANTHROPIC = False
-anthropic_client = None
-
-try:
-    from anthropic import Anthropic
-    HAS_ANTHROPIC = True
-    
-    # Inicjalizacja klienta Anthropic
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if api_key:
-        anthropic_client = Anthropic(api_key=api_key)
-        logger.info("Zainicjalizowano klienta Anthropic API dla analizy psychologicznej")
-    else:
-        logger.warning("Brak klucza API Anthropic (ANTHROPIC_API_KEY)")
-except ImportError as e:
-    logger.warning(f"Nie można zaimportować pakietu Anthropic: {str(e)}")
-except Exception as e:
-    logger.warning(f"Anthropic API jest niedostępne: {str(e)}")
+# Limit czasu odczytu odpowiedzi przy analizie psychologicznej (s) - długa odpowiedź JSON
+ANALYSIS_READ_TIMEOUT = float(os.environ.get("ANALYSIS_READ_TIMEOUT", 60.0))
 
 # Cache na wyniki analizy, aby ograniczyć liczbę zapytań do API
 analysis_cache = {}
@@ -67,28 +39,176 @@ DEFAULT_ANALYSIS = {
 # Komunikat wyświetlany przy błędzie limitu API (pusty, zgodnie z prośbą użytkownika)
 API_LIMIT_MESSAGES = []
 
-def analyze_user_responses(responses):
+# Model i limit odpowiedzi analizy Claude (także w trybie wsadowym, batch_analysis)
+ANALYSIS_MODEL = "claude-3-5-sonnet-20241022"  # the newest Anthropic model is "claude-3-5-sonnet-20241022" which was released October 22, 2024.
+ANALYSIS_MAX_TOKENS = 1000
+
+REQUIRED_ANALYSIS_KEYS = ["personality_traits", "emotional_patterns", "cognitive_patterns", "insights", "growth_areas"]
+
+# Prompt dla Claude
+ANALYSIS_SYSTEM_PROMPT = """Jesteś psychoterapeutą specjalizującym się w analizie wypowiedzi pacjentów. 
+            Twoim zadaniem jest przeprowadzenie dogłębnej analizy psychologicznej na podstawie 
+            odpowiedzi pacjenta na pytania terapeutyczne.
+            
+            Analiza powinna zawierać:
+            1. Dominujące cechy osobowości widoczne w wypowiedziach
+            2. Wzorce emocjonalne (jakie emocje przeważają, jak są wyrażane)
+            3. Wzorce poznawcze (schematy myślenia, przekonania)
+            4. Główne spostrzeżenia terapeutyczne
+            5. Potencjalne obszary rozwoju osobistego
+            
+            Unikaj nadmiernych uogólnień. Bazuj wyłącznie na dostarczonych danych.
+            Pamiętaj, że analiza ma być wspierająca i konstruktywna, skupiona na wzroście.
+            
+            Odpowiedź sformatuj jako JSON z następującymi kluczami:
+            {
+                "personality_traits": ["cecha1", "cecha2", ...],
+                "emotional_patterns": ["wzorzec1", "wzorzec2", ...],
+                "cognitive_patterns": ["wzorzec1", "wzorzec2", ...],
+                "insights": ["spostrzeżenie1", "spostrzeżenie2", ...],
+                "growth_areas": ["obszar1", "obszar2", ...]
+            }
+            
+            Upewnij się, że Twoja odpowiedź jest poprawnym i dobrze sformatowanym obiektem JSON.
+            """
+
+def build_analysis_transcript(responses):
     """
-    Analizuje odpowiedzi użytkownika, aby wygenerować psychologiczne spostrzeżenia.
-    
+    Buduje transkrypt odpowiedzi do analizy w budżecie ANALYSIS_TOKEN_BUDGET.
+
+    Przy długiej historii zachowujemy najnowsze odpowiedzi, a bardzo długie wpisy skracamy.
+
+    Returns:
+        list: Fragmenty transkryptu od najstarszego (po jednym na odpowiedź)
+    """
+    transcript, transcript_stats = build_transcript_blocks(
+        responses,
+        lambda item: (f"Pytanie: {item['question']}\n"
+                      f"Odpowiedź: {item['response']}\n"
+                      f"Data: {item['timestamp'].strftime('%Y-%m-%d %H:%M')}\n\n"),
+        ANALYSIS_TOKEN_BUDGET,
+    )
+    logger.info(f"Transkrypt do analizy: {transcript_stats['entries']} odpowiedzi, ~{transcript_stats['tokens']} tokenów")
+    return transcript
+
+ANALYSIS_PROMPT_INTRO = "Dokonaj analizy psychologicznej następujących odpowiedzi na pytania terapeutyczne:\n\n"
+ANALYSIS_PROMPT_OUTRO = "Proszę o analizę w formacie JSON zgodnie ze wskazówkami z systemu."
+
+def build_analysis_request(responses, transcript=None):
+    """
+    Buduje parametry wywołania Claude Messages API dla analizy odpowiedzi.
+
+    Te same parametry trafiają do messages.create i do Message Batches API.
+    Prompt systemowy i transkrypt do ostatniej odpowiedzi włącznie są stałym
+    prefiksem oznaczonym do cache'a promptu: ponowna analiza po dopisaniu
+    odpowiedzi czyta z cache'a wszystko poza nowymi wpisami.
+
     Args:
-        responses (list): Lista odpowiedzi użytkownika, każda zawiera:
-            - question (str): Zadane pytanie
-            - response (str): Odpowiedź użytkownika
-            - timestamp (datetime): Data i czas odpowiedzi
-    
+        responses (list): Odpowiedzi użytkownika (jak w analyze_user_responses)
+        transcript (list, optional): Gotowe fragmenty transkryptu (domyślnie budowane z responses)
+
     Returns:
-        dict: Analiza psychologiczna zawierająca:
-            - personality_traits (list): Zidentyfikowane cechy osobowości
-            - emotional_patterns (list): Wzorce emocjonalne
-            - cognitive_patterns (list): Wzorce poznawcze
-            - insights (list): Główne spostrzeżenia
-            - growth_areas (list): Sugerowane obszary rozwoju
+        dict: Parametry model, max_tokens, temperature, system, messages
+    """
+    if transcript is None:
+        transcript = build_analysis_transcript(responses)
+
+    content = [{"type": "text", "text": ANALYSIS_PROMPT_INTRO}]
+    content += [{"type": "text", "text": fragment} for fragment in transcript[:-1]]
+    content += [cacheable(fragment) for fragment in transcript[-1:]]
+    content.append({"type": "text", "text": ANALYSIS_PROMPT_OUTRO})
+    return {
+        "model": ANALYSIS_MODEL,
+        "max_tokens": ANALYSIS_MAX_TOKENS,
+        "temperature": 0.2,
+        "system": [cacheable(ANALYSIS_SYSTEM_PROMPT)],
+        "messages": [{"role": "user", "content": content}],
+    }
+
+def parse_analysis_content(content):
+    """
+    Parsuje odpowiedź Claude z analizą.
+
+    Returns:
+        dict: Analiza albo None, jeśli odpowiedź nie jest poprawnym JSON z wymaganymi kluczami
+    """
+    content = content.strip()
+    # Check if the response is wrapped in ```json ``` and extract it
+    if content.startswith("```json") and content.endswith("```"):
+        content = content[7:-3].strip()
+
+    try:
+        analysis = json.loads(content)
+    except json.JSONDecodeError:
+        logger.warning("Claude zwrócił niepoprawny JSON.")
+        return None
+
+    if not isinstance(analysis, dict) or not all(key in analysis for key in REQUIRED_ANALYSIS_KEYS):
+        logger.warning("Claude zwrócił nieprawidłowy format JSON. Brakujące klucze.")
+        return None
+    return analysis
+
+def responses_cache_key(responses):
+    """Klucz cache'a analizy dla listy odpowiedzi."""
+    return hash(json.dumps([{
+        'q': item['question'], 
+        'r': item['response'], 
+        't': item['timestamp'].isoformat()
+    } for item in responses], sort_keys=True))
+
+# Prompt dla modelu GPT
+OPENAI_ANALYSIS_SYSTEM_PROMPT = """
+            Jesteś psychoterapeutą specjalizującym się w analizie wypowiedzi pacjentów. 
+            Twoim zadaniem jest przeprowadzenie dogłębnej analizy psychologicznej na podstawie 
+            odpowiedzi pacjenta na pytania terapeutyczne.
+            
+            Analiza powinna zawierać:
+            1. Dominujące cechy osobowości widoczne w wypowiedziach
+            2. Wzorce emocjonalne (jakie emocje przeważają, jak są wyrażane)
+            3. Wzorce poznawcze (schematy myślenia, przekonania)
+            4. Główne spostrzeżenia terapeutyczne
+            5. Potencjalne obszary rozwoju osobistego
+            
+            Unikaj nadmiernych uogólnień. Bazuj wyłącznie na dostarczonych danych.
+            Pamiętaj, że analiza ma być wspierająca i konstruktywna, skupiona na wzroście.
+            Odpowiedź sformatuj jako JSON z następującymi kluczami:
+            {
+                "personality_traits": ["cecha1", "cecha2", ...],
+                "emotional_patterns": ["wzorzec1", "wzorzec2", ...],
+                "cognitive_patterns": ["wzorzec1", "wzorzec2", ...],
+                "insights": ["spostrzeżenie1", "spostrzeżenie2", ...],
+                "growth_areas": ["obszar1", "obszar2", ...]
+            }
+            """
+
+def build_openai_analysis_request(transcript):
+    """
+    Parametry wywołania OpenAI Chat Completions dla analizy (zapasowy dostawca).
+
+    OpenAI cache'uje wspólne prefiksy promptów automatycznie; stały prompt
+    systemowy i transkrypt od najstarszego wpisu tworzą taki prefiks.
+    """
+    return {
+        "model": "gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+        "messages": [
+            {"role": "system", "content": OPENAI_ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": "".join(transcript)}
+        ],
+        "response_format": {"type": "json_object"},
+        "read_timeout": ANALYSIS_READ_TIMEOUT,
+    }
+
+def _prepare_analysis(responses, use_cache):
+    """
+    Sprawdza warunki analizy i cache.
+
+    Returns:
+        tuple: (gotowy wynik albo None, klucz cache'a)
     """
     # Sprawdź czy mamy dostęp do któregokolwiek API
-    if (not HAS_OPENAI or not openai_client) and (not HAS_ANTHROPIC or not anthropic_client):
+    if not is_anthropic_available() and not is_openai_available():
         logger.warning("Ani OpenAI ani Anthropic API nie są dostępne. Używam domyślnych wartości.")
-        return DEFAULT_ANALYSIS.copy()
+        return DEFAULT_ANALYSIS.copy(), None
         
     # Sprawdź czy mamy wystarczająco danych
     if not responses or len(responses) < 2:
@@ -98,216 +218,156 @@ def analyze_user_responses(responses):
             "cognitive_patterns": [],
             "insights": ["Za mało danych do przeprowadzenia analizy."],
             "growth_areas": []
-        }
+        }, None
     
     # Generuj klucz cache'a na podstawie odpowiedzi
-    cache_key = hash(json.dumps([{
-        'q': item['question'], 
-        'r': item['response'], 
-        't': item['timestamp'].isoformat()
-    } for item in responses], sort_keys=True))
+    cache_key = responses_cache_key(responses)
     
     # Sprawdź czy mamy analizę w cache'u
-    if cache_key in analysis_cache:
-        logger.info("Używam zbuforowanej analizy psychologicznej.")
-        return analysis_cache[cache_key]
+    if use_cache:
+        cached = cache_key in analysis_cache
+        record_cache("psychological_analysis", cached)
+        if cached:
+            logger.info("Używam zbuforowanej analizy psychologicznej.")
+            return analysis_cache[cache_key], cache_key
+    return None, cache_key
+
+def _log_openai_analysis_error(e):
+    error_msg = str(e)
+    error_code = None
     
-    # Przygotuj dane do analizy
-    analysis_text = ""
-    for item in responses:
-        analysis_text += f"Pytanie: {item['question']}\n"
-        analysis_text += f"Odpowiedź: {item['response']}\n"
-        analysis_text += f"Data: {item['timestamp'].strftime('%Y-%m-%d %H:%M')}\n\n"
+    # Spróbuj wyciągnąć kod błędu, ale bez oczekiwania konkretnego typu wyjątku
+    try:
+        if hasattr(e, 'status_code'):
+            error_code = e.status_code
+        # Próbujemy różne ścieżki dla różnych typów wyjątków
+        elif hasattr(e, 'response') and hasattr(e.response, 'status_code'):
+            error_code = e.response.status_code
+    except Exception:
+        # Ignoruj błędy podczas próby wyciągnięcia kodu
+        pass
     
-    # Sprawdźmy dokładnie, które API jest dostępne
-    is_anthropic_available = HAS_ANTHROPIC and anthropic_client is not None
-    is_openai_available = HAS_OPENAI and openai_client is not None
+    logger.error(f"Błąd podczas analizy psychologicznej z OpenAI: {error_code} - {error_msg}")
     
-    logger.info(f"Dostępność API - Anthropic: {is_anthropic_available}, OpenAI: {is_openai_available}")
+    # Sprawdź, czy to błąd limitu (429 lub insufficient_quota)
+    if error_code == 429 or "insufficient_quota" in error_msg.lower():
+        logger.warning("Przekroczono limit zapytań API OpenAI.")
+
+def _fallback_analysis():
+    # Oba API zawiodły - zwróć domyślne wartości
+    logger.error("Nie udało się wykonać analizy za pomocą żadnego API. Zwracam dane zastępcze.")
+    fallback = DEFAULT_ANALYSIS.copy()
+    # Zamiast zastępować, dodajemy komunikat o błędzie do insights
+    insights = list(fallback.get("insights", []))
+    insights.extend(API_LIMIT_MESSAGES)
+    fallback["insights"] = insights
+    return fallback
+
+async def analyze_user_responses_async(responses, use_cache=True):
+    """
+    Analizuje odpowiedzi użytkownika, aby wygenerować psychologiczne spostrzeżenia.
     
-    # Jeśli ani Anthropic, ani OpenAI nie są dostępne, zwróć domyślne wartości
-    if not is_anthropic_available and not is_openai_available:
-        logger.warning("Żaden z potrzebnych silników AI nie jest dostępny. Używam wartości domyślnych.")
-        return DEFAULT_ANALYSIS.copy()
+    Args:
+        responses (list): Lista odpowiedzi użytkownika, każda zawiera:
+            - question (str): Zadane pytanie
+            - response (str): Odpowiedź użytkownika
+            - timestamp (datetime): Data i czas odpowiedzi
+        use_cache (bool): Czy korzystać z cache'a analiz w pamięci procesu
+            (analiza wsadowa wielu użytkowników go pomija)
     
-    # Mechanizm ponownych prób z wykładniczym opóźnieniem
-    max_retries = 3
-    retry_delay = 1  # początkowe opóźnienie w sekundach
+    Returns:
+        dict: Analiza psychologiczna zawierająca:
+            - personality_traits (list): Zidentyfikowane cechy osobowości
+            - emotional_patterns (list): Wzorce emocjonalne
+            - cognitive_patterns (list): Wzorce poznawcze
+            - insights (list): Główne spostrzeżenia
+            - growth_areas (list): Sugerowane obszary rozwoju
+    """
+    result, cache_key = _prepare_analysis(responses, use_cache)
+    if result is not None:
+        return result
     
-    for attempt in range(max_retries):
-        # Najpierw spróbuj użyć Claude
-        if HAS_ANTHROPIC and anthropic_client:
-            try:
-                logger.info(f"Próba analizy psychologicznej z Claude {attempt+1}/{max_retries}")
-                
-                # Prompt dla Claude
-                system_prompt = """Jesteś psychoterapeutą specjalizującym się w analizie wypowiedzi pacjentów. 
-                Twoim zadaniem jest przeprowadzenie dogłębnej analizy psychologicznej na podstawie 
-                odpowiedzi pacjenta na pytania terapeutyczne.
-                
-                Analiza powinna zawierać:
-                1. Dominujące cechy osobowości widoczne w wypowiedziach
-                2. Wzorce emocjonalne (jakie emocje przeważają, jak są wyrażane)
-                3. Wzorce poznawcze (schematy myślenia, przekonania)
-                4. Główne spostrzeżenia terapeutyczne
-                5. Potencjalne obszary rozwoju osobistego
-                
-                Unikaj nadmiernych uogólnień. Bazuj wyłącznie na dostarczonych danych.
-                Pamiętaj, że analiza ma być wspierająca i konstruktywna, skupiona na wzroście.
-                
-                Odpowiedź sformatuj jako JSON z następującymi kluczami:
-                {
-                    "personality_traits": ["cecha1", "cecha2", ...],
-                    "emotional_patterns": ["wzorzec1", "wzorzec2", ...],
-                    "cognitive_patterns": ["wzorzec1", "wzorzec2", ...],
-                    "insights": ["spostrzeżenie1", "spostrzeżenie2", ...],
-                    "growth_areas": ["obszar1", "obszar2", ...]
-                }
-                
-                Upewnij się, że Twoja odpowiedź jest poprawnym i dobrze sformatowanym obiektem JSON.
-                """
-                
-                user_prompt = f"""Dokonaj analizy psychologicznej następujących odpowiedzi na pytania terapeutyczne:
-
-                {analysis_text}
-
-                Proszę o analizę w formacie JSON zgodnie ze wskazówkami z systemu.
-                """
-                
-                # Call the Claude API
-                message = anthropic_client.messages.create(
-                    model="claude-3-5-sonnet-20241022", # the newest Anthropic model is "claude-3-5-sonnet-20241022" which was released October 22, 2024.
-                    max_tokens=1000,
-                    temperature=0.2,
-                    system=system_prompt,
-                    messages=[
-                        {"role": "user", "content": user_prompt}
-                    ]
-                )
-                
-                # Extract the response content
-                content = message.content[0].text.strip()
-                
-                # Try to parse the JSON
-                try:
-                    # Check if the response is wrapped in ```json ``` and extract it
-                    if content.startswith("```json") and content.endswith("```"):
-                        content = content[7:-3].strip()
-                    
-                    analysis = json.loads(content)
-                    
-                    # Validate that expected keys exist
-                    required_keys = ["personality_traits", "emotional_patterns", "cognitive_patterns", 
-                                    "insights", "growth_areas"]
-                    
-                    if all(key in analysis for key in required_keys):
-                        # Dodaj wynik do cache'a
-                        analysis_cache[cache_key] = analysis
-                        logger.info("Pomyślnie wykonano analizę z Claude.")
-                        return analysis
-                    else:
-                        logger.warning("Claude zwrócił nieprawidłowy format JSON. Brakujące klucze.")
-                        # Kontynuuj do OpenAI lub fallbacku
-                except json.JSONDecodeError:
-                    logger.warning("Claude zwrócił niepoprawny JSON. Przechodzę do OpenAI.")
-                    # Kontynuuj do OpenAI lub fallbacku
-                    
-            except Exception as e:
-                error_msg = str(e)
-                logger.error(f"Błąd podczas analizy psychologicznej z Claude: {error_msg}")
-                # Kontynuuj do OpenAI
-        
-        # Spróbuj użyć OpenAI jako backup
-        if HAS_OPENAI and openai_client:
-            try:
-                logger.info(f"Próba analizy psychologicznej z OpenAI {attempt+1}/{max_retries}")
-                
-                # Prompt dla modelu GPT
-                system_prompt = """
-                Jesteś psychoterapeutą specjalizującym się w analizie wypowiedzi pacjentów. 
-                Twoim zadaniem jest przeprowadzenie dogłębnej analizy psychologicznej na podstawie 
-                odpowiedzi pacjenta na pytania terapeutyczne.
-                
-                Analiza powinna zawierać:
-                1. Dominujące cechy osobowości widoczne w wypowiedziach
-                2. Wzorce emocjonalne (jakie emocje przeważają, jak są wyrażane)
-                3. Wzorce poznawcze (schematy myślenia, przekonania)
-                4. Główne spostrzeżenia terapeutyczne
-                5. Potencjalne obszary rozwoju osobistego
-                
-                Unikaj nadmiernych uogólnień. Bazuj wyłącznie na dostarczonych danych.
-                Pamiętaj, że analiza ma być wspierająca i konstruktywna, skupiona na wzroście.
-                Odpowiedź sformatuj jako JSON z następującymi kluczami:
-                {
-                    "personality_traits": ["cecha1", "cecha2", ...],
-                    "emotional_patterns": ["wzorzec1", "wzorzec2", ...],
-                    "cognitive_patterns": ["wzorzec1", "wzorzec2", ...],
-                    "insights": ["spostrzeżenie1", "spostrzeżenie2", ...],
-                    "growth_areas": ["obszar1", "obszar2", ...]
-                }
-                """
-                
-                response = openai_client.chat.completions.create(
-                    model="gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": analysis_text}
-                    ],
-                    response_format={"type": "json_object"}
-                )
-                
-                analysis = json.loads(response.choices[0].message.content)
-                
+    # Przygotuj dane do analizy
+    transcript = build_analysis_transcript(responses)
+    
+    # Każdy dostawca jest próbowany raz; przejściowe błędy (429/5xx, z Retry-After)
+    # ponawia wspólna polityka w llm_client, więc nie ma tu własnych pętli i opóźnień.
+    # Najpierw spróbuj użyć Claude
+    if is_anthropic_available():
+        try:
+            logger.info("Próba analizy psychologicznej z Claude")
+            message = await create_message_async(read_timeout=ANALYSIS_READ_TIMEOUT,
+                                                 **build_analysis_request(responses, transcript))
+            
+            analysis = parse_analysis_content(message.content[0].text)
+            if analysis is not None:
                 # Dodaj wynik do cache'a
-                analysis_cache[cache_key] = analysis
-                logger.info("Pomyślnie wykonano analizę z OpenAI.")
+                if use_cache:
+                    analysis_cache[cache_key] = analysis
+                logger.info("Pomyślnie wykonano analizę z Claude.")
                 return analysis
+            # Kontynuuj do OpenAI lub fallbacku
                 
-            except Exception as e:
-                error_msg = str(e)
-                error_code = None
-                
-                # Spróbuj wyciągnąć kod błędu, ale bez oczekiwania konkretnego typu wyjątku
-                try:
-                    if hasattr(e, 'status_code'):
-                        error_code = e.status_code
-                    # Próbujemy różne ścieżki dla różnych typów wyjątków
-                    elif hasattr(e, 'response') and hasattr(e.response, 'status_code'):
-                        error_code = e.response.status_code
-                except Exception:
-                    # Ignoruj błędy podczas próby wyciągnięcia kodu
-                    pass
-                
-                logger.error(f"Błąd podczas analizy psychologicznej z OpenAI: {error_code} - {error_msg}")
-                
-                # Sprawdź, czy to błąd limitu (429 lub insufficient_quota)
-                if error_code == 429 or "insufficient_quota" in error_msg.lower():
-                    logger.warning("Przekroczono limit zapytań API OpenAI.")
-                    # Kontynuuj do następnej próby lub fallbacku
-                
-        # Jeśli to ostatnia próba i oba API zawiodły, zwróć domyślne wartości
-        if attempt == max_retries - 1:
-            logger.error("Wyczerpano limit prób dla obu API. Zwracam dane zastępcze.")
-            fallback = DEFAULT_ANALYSIS.copy()
-            # Zamiast zastępować, dodajemy komunikat o błędzie do insights
-            insights = fallback.get("insights", [])
-            if isinstance(insights, list):
-                insights.extend(API_LIMIT_MESSAGES)
-                fallback["insights"] = insights
-            else:
-                fallback["insights"] = API_LIMIT_MESSAGES
-            return fallback
+        except Exception as e:
+            logger.error(f"Błąd podczas analizy psychologicznej z Claude: {str(e)}")
+            # Kontynuuj do OpenAI
+    
+    # Spróbuj użyć OpenAI jako backup
+    if is_openai_available():
+        try:
+            logger.info("Próba analizy psychologicznej z OpenAI")
+            response = await create_chat_completion_async(**build_openai_analysis_request(transcript))
+            analysis = json.loads(response.choices[0].message.content)
+            
+            # Dodaj wynik do cache'a
+            if use_cache:
+                analysis_cache[cache_key] = analysis
+            logger.info("Pomyślnie wykonano analizę z OpenAI.")
+            return analysis
             
-        # Dodaj losowe odchylenie do opóźnienia (jitter)
-        jitter = random.uniform(0, 0.5)
-        wait_time = retry_delay * (2 ** attempt) + jitter
-        logger.info(f"Ponawiam próbę za {wait_time:.2f} sekund...")
-        time.sleep(wait_time)
+        except Exception as e:
+            _log_openai_analysis_error(e)
     
-    # Jeśli wszystko zawiedzie, zwróć domyślne wartości
-    return DEFAULT_ANALYSIS.copy()
+    return _fallback_analysis()
+
+
+def is_default_analysis(analysis):
+    """Czy analiza to dane zastępcze zwrócone po błędzie obu API."""
+    insights = analysis.get("insights", [])
+    return (analysis.get("personality_traits") == DEFAULT_ANALYSIS["personality_traits"]
+            and insights[:len(DEFAULT_ANALYSIS["insights"])] == DEFAULT_ANALYSIS["insights"])
 
-def generate_psychological_insight(user_id, db):
+# Analiza zapisywana, gdy użytkownik ma za mało odpowiedzi
+INSUFFICIENT_DATA_ANALYSIS = {
+    "personality_traits": [],
+    "emotional_patterns": [],
+    "cognitive_patterns": [],
+    "insights": ["Potrzebujemy więcej Twoich odpowiedzi, aby przeprowadzić analizę. Kontynuuj codzienną refleksję."],
+    "growth_areas": []
+}
+
+def load_user_responses(user_id, db):
+    """
+    Pobiera odpowiedzi użytkownika w formacie wymaganym przez analizę.
+
+    Args:
+        user_id (int): ID użytkownika
+        db: Obiekt bazy danych SQLAlchemy
+
+    Returns:
+        list: Odpowiedzi (question, response, timestamp) od najstarszej
+    """
+    from models import Conversation
+    
+    # Pobierz odpowiedzi użytkownika z wypełnionymi odpowiedziami
+    rows = db.session.execute(
+        db.select(Conversation.question, Conversation.response, Conversation.timestamp)
+        .where(Conversation.user_id == user_id, Conversation.response.isnot(None))
+        .order_by(Conversation.timestamp.asc())
+    ).all()
+    return [{"question": row.question, "response": row.response, "timestamp": row.timestamp} for row in rows]
+
+async def generate_psychological_insight_async(user_id, db, use_cache=True):
     """
     Generuje psychologiczne spostrzeżenia dla konkretnego użytkownika
     na podstawie jego historii odpowiedzi.
@@ -315,42 +375,172 @@ def generate_psychological_insight(user_id, db):
     Args:
         user_id (int): ID użytkownika
         db: Obiekt bazy danych SQLAlchemy
+        use_cache (bool): Czy korzystać z cache'a analiz w pamięci procesu
     
     Returns:
         dict: Analiza psychologiczna użytkownika
     """
-    from models import Conversation
+    responses = load_user_responses(user_id, db)
     
-    # Pobierz odpowiedzi użytkownika z wypełnionymi odpowiedziami
-    conversations = Conversation.query.filter_by(user_id=user_id)\
-        .filter(Conversation.response.isnot(None))\
-        .order_by(Conversation.timestamp.asc())\
-        .all()
-    
-    if not conversations or len(conversations) < 2:
-        return {
-            "personality_traits": [],
-            "emotional_patterns": [],
-            "cognitive_patterns": [],
-            "insights": ["Potrzebujemy więcej Twoich odpowiedzi, aby przeprowadzić analizę. Kontynuuj codzienną refleksję."],
-            "growth_areas": []
-        }
-    
-    # Przekształć odpowiedzi do formatu wymaganego przez analizę
-    responses = []
-    for conv in conversations:
-        responses.append({
-            "question": conv.question,
-            "response": conv.response,
-            "timestamp": conv.timestamp
-        })
+    if len(responses) < 2:
+        return INSUFFICIENT_DATA_ANALYSIS.copy()
     
     # Przeprowadź analizę
-    return analyze_user_responses(responses)
+    return await analyze_user_responses_async(responses, use_cache=use_cache)
+
+def build_analysis(user_id, analysis_data, watermark=(None, None), ei_score=None):
+    """
+    Tworzy (niezapisaną) analizę użytkownika wraz z wynikiem EI i wynikami cech.
+
+    Args:
+        user_id (int): ID użytkownika
+        analysis_data (dict): Analiza (zapisywana kopia jest uzupełniana o trait_scores)
+        watermark (tuple): (id, timestamp) najnowszej odpowiedzi objętej analizą
+        ei_score (int, optional): Wynik EI (domyślnie get_emotional_intelligence_score)
+
+    Returns:
+        PsychologicalAnalysis: Analiza spoza sesji bazy danych
+    """
+    from models import PsychologicalAnalysis
+
+    if ei_score is None:
+        ei_score = get_emotional_intelligence_score(analysis_data)
+    # Kopia - analysis_data może być obiektem z cache'a analiz
+    analysis_data = dict(analysis_data, trait_scores=compute_trait_scores(analysis_data))
+
+    new_analysis = PsychologicalAnalysis(
+        user_id=user_id,
+        emotional_intelligence_score=ei_score,
+        last_conversation_id=watermark[0],
+        last_conversation_at=watermark[1]
+    )
+    new_analysis.set_analysis(analysis_data)
+    return new_analysis
+
+def store_analysis(user_id, analysis_data, db, watermark=(None, None), ei_score=None):
+    """
+    Zapisuje nową analizę użytkownika (argumenty jak w build_analysis).
+
+    Returns:
+        PsychologicalAnalysis: Zapisana analiza
+    """
+    new_analysis = build_analysis(user_id, analysis_data, watermark, ei_score)
+    db.session.add(new_analysis)
+    db.session.commit()
+    return new_analysis
+
+def get_answer_watermark(user_id, db):
+    """
+    Zwraca najnowszą odpowiedź użytkownika jako znacznik świeżości analizy.
+
+    Jedno zapytanie obsługiwane przez częściowy indeks ix_conversation_user_answered.
+
+    Args:
+        user_id (int): ID użytkownika
+        db: Obiekt bazy danych SQLAlchemy
+
+    Returns:
+        tuple: (id, timestamp) najnowszej odpowiedzi albo (None, None)
+    """
+    from models import Conversation
+
+    row = db.session.execute(
+        db.select(Conversation.id, Conversation.timestamp)
+        .where(Conversation.user_id == user_id, Conversation.response.isnot(None))
+        .order_by(Conversation.id.desc())
+        .limit(1)
+    ).first()
+    return (row.id, row.timestamp) if row else (None, None)
+
+# Kategorie analizy liczone do wyniku EI (kolejność kolumn macierzy liczności)
+SCORE_CATEGORIES = ("personality_traits", "emotional_patterns", "cognitive_patterns", "insights", "growth_areas")
+
+# Punkty za element kategorii i limity punktów (wglądy i obszary rozwoju mają wspólny limit)
+_CATEGORY_POINTS = np.array([4, 4, 3, 3, 2])
+_CATEGORY_CAPS = np.array([20, 20, 15])
+_INSIGHT_GROWTH_CAP = 25
+_BASE_SCORE = 20
+
+# Zakres wyników cech osobowości (trait_scores)
+TRAIT_SCORE_MIN = 60
+TRAIT_SCORE_MAX = 100
+
+
+# Sekcje analizy przeszukiwane w poszukiwaniu potwierdzenia cechy i limit trafień
+TRAIT_EVIDENCE_KEYS = ["emotional_patterns", "cognitive_patterns", "insights", "growth_areas"]
+TRAIT_EVIDENCE_CAP = 3
+
+
+def _trait_stems(trait):
+    """Rdzenie słów nazwy cechy (bez dwóch ostatnich liter, co obejmuje odmianę)."""
+    return {word[:max(4, len(word) - 2)] for word in re.findall(r"\w+", str(trait).lower()) if len(word) >= 4}
+
+
+def trait_score(rank, count, evidence):
+    """
+    Wynik cechy osobowości (TRAIT_SCORE_MIN-TRAIT_SCORE_MAX) z treści analizy.
+
+    Nie jest to pomiar psychometryczny: wynik rośnie z pozycją cechy na liście
+    personality_traits (model wymienia cechy od najbardziej widocznych) i z liczbą
+    wpisów w pozostałych sekcjach analizy, które tę cechę wspominają.
+
+    Args:
+        rank (int): Pozycja cechy na liście (0 - pierwsza)
+        count (int): Liczba cech na liście
+        evidence (int): Liczba wpisów analizy wspominających cechę
+    """
+    strength = 0.6 * (1 - rank / count) + 0.4 * min(evidence, TRAIT_EVIDENCE_CAP) / TRAIT_EVIDENCE_CAP
+    return TRAIT_SCORE_MIN + round(strength * (TRAIT_SCORE_MAX - TRAIT_SCORE_MIN))
+
+
+def compute_trait_scores(analysis):
+    """Zwraca słownik cecha -> wynik dla cech osobowości z analizy (nie modyfikuje analizy)."""
+    analysis = analysis or {}
+    traits = analysis.get("personality_traits", [])
+    entries = [str(entry).lower() for key in TRAIT_EVIDENCE_KEYS for entry in analysis.get(key, [])]
+    scores = {}
+    for rank, trait in enumerate(traits):
+        stems = _trait_stems(trait)
+        evidence = sum(1 for entry in entries if any(stem in entry for stem in stems))
+        scores[trait] = trait_score(rank, len(traits), evidence)
+    return scores
+
+
+def category_counts(analysis):
+    """Liczności kategorii SCORE_CATEGORIES w analizie (wiersz macierzy dla score_counts)."""
+    analysis = analysis or {}
+    counts = []
+    for category in SCORE_CATEGORIES:
+        value = analysis.get(category)
+        counts.append(len(value) if isinstance(value, list) else 0)
+    return counts
+
+
+def score_counts(counts):
+    """
+    Wektorowo oblicza wyniki EI dla wielu analiz.
+
+    Args:
+        counts: Macierz (liczba analiz x len(SCORE_CATEGORIES)) liczności kategorii
+
+    Returns:
+        numpy.ndarray: Wyniki 0-100 (0, gdy analiza ma najwyżej jeden wgląd)
+    """
+    counts = np.asarray(counts, dtype=np.int64).reshape(-1, len(SCORE_CATEGORIES))
+    points = counts * _CATEGORY_POINTS
+    score = (_BASE_SCORE
+             + np.minimum(points[:, :3], _CATEGORY_CAPS).sum(axis=1)
+             + np.minimum(points[:, 3] + points[:, 4], _INSIGHT_GROWTH_CAP))
+    enough_data = counts[:, 3] > 1
+    return np.where(enough_data, np.clip(score, 0, 100), 0)
+
 
 def get_emotional_intelligence_score(analysis):
     """
     Oblicza przybliżony wynik inteligencji emocjonalnej na podstawie analizy.
+
+    Wynik jest deterministyczny i nie modyfikuje analizy; wyniki cech
+    osobowości zwraca compute_trait_scores.
     
     Args:
         analysis (dict): Analiza psychologiczna użytkownika
@@ -358,39 +548,4 @@ def get_emotional_intelligence_score(analysis):
     Returns:
         int: Wynik inteligencji emocjonalnej (0-100)
     """
-    if not analysis or "insights" not in analysis or len(analysis.get("insights", [])) <= 1:
-        return 0
-    
-    # Podstawowe punkty za samą aktywność
-    score = 20
-    
-    # Oblicz punktację dla cech osobowości
-    traits = analysis.get("personality_traits", [])
-    personality_scores = {}
-    for trait in traits:
-        # Generuj wynik 1-100 dla każdej cechy
-        score_value = random.randint(60, 100)  # Losowy wynik między 60-100
-        personality_scores[trait] = score_value
-    
-    # Dodaj scores do analizy
-    analysis["trait_scores"] = personality_scores
-    
-    # Punkty za różnorodność cech osobowości (max 20)
-    personality_score = len(traits) * 4
-    score += min(personality_score, 20)
-    
-    # Punkty za wzorce emocjonalne (max 20)
-    emotional_score = len(analysis.get("emotional_patterns", [])) * 4
-    score += min(emotional_score, 20)
-    
-    # Punkty za wzorce poznawcze (max 15)
-    cognitive_score = len(analysis.get("cognitive_patterns", [])) * 3
-    score += min(cognitive_score, 15)
-    
-    # Punkty za wglądy i obszary rozwoju (max 25)
-    insight_score = len(analysis.get("insights", [])) * 3
-    growth_score = len(analysis.get("growth_areas", [])) * 2
-    score += min(insight_score + growth_score, 25)
-    
-    # Ogranicz wynik do zakresu 0-100
-    return max(0, min(score, 100))
\ No newline at end of file
+    return int(score_counts([category_counts(analysis)])[0])
@@ -0,0 +1,243 @@
+"""
+Budżet zapytań SQL na żądanie i wykrywanie wzorca N+1.
+
+Każde zapytanie wykonane przez silnik SQLAlchemy jest liczone i mierzone
+(zdarzenia before/after_cursor_execute). Po zakończeniu żądania sprawdzane jest:
+    - liczba zapytań względem budżetu endpointu (ROUTE_BUDGETS / QUERY_BUDGETS),
+    - łączny czas zapytań względem QUERY_TIME_BUDGET,
+    - powtórzenia zapytań o tym samym kształcie (treść SQL bez wartości parametrów)
+      - co najmniej N_PLUS_ONE_THRESHOLD razy oznacza typowe N+1, np. leniwe
+      ładowanie User.conversations w pętli.
+
+Tryb działania (QUERY_BUDGET_MODE):
+    off   - brak sprawdzania,
+    warn  - przekroczenia są logowane (domyślnie),
+    raise - przekroczenie zgłasza QueryBudgetExceeded (domyślnie przy app.testing).
+
+W testach i skryptach można sprawdzić dowolny fragment kodu:
+
+    with query_budget(max_queries=3, n_plus_one=2) as stats:
+        client.get("/history")
+    print(stats.summary())
+"""
+
+import os
+import re
+import time
+import logging
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUERY_BUDGET_MODE = os.environ.get("QUERY_BUDGET_MODE", "").lower()
+
+# Budżet liczby zapytań dla endpointów bez własnego budżetu
+QUERY_BUDGET_DEFAULT = int(os.environ.get("QUERY_BUDGET_DEFAULT", 25))
+
+# Budżet łącznego czasu zapytań w jednym żądaniu (s)
+QUERY_TIME_BUDGET = float(os.environ.get("QUERY_TIME_BUDGET", 0.5))
+
+# Liczba wykonań zapytania o tym samym kształcie traktowana jako N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", 5))
+
+# Budżety liczby zapytań per endpoint Flask
+ROUTE_BUDGETS = {
+    "index": 10,
+    "submit_response": 4,
+    "history": 3,
+    "login": 2,
+    "register": 4,
+    "analysis": 20,
+    "reminder_settings": 6,
+    "test_reminder": 10,
+    "logout": 0,
+    "metrics": 0,
+}
+
+# Nadpisania w postaci "index=8,analysis=15"
+for _item in os.environ.get("QUERY_BUDGETS", "").split(","):
+    if "=" in _item:
+        _endpoint, _limit = _item.split("=", 1)
+        ROUTE_BUDGETS[_endpoint.strip()] = int(_limit)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMETER_LIST = re.compile(r"\(\s*(?:\?|%s|:\w+)(?:\s*,\s*(?:\?|%s|:\w+))*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_active_stats = contextvars.ContextVar("query_budget_stats", default=())
+
+
+class QueryBudgetExceeded(Exception):
+    """Przekroczono budżet zapytań (tryb raise)."""
+
+    def __init__(self, messages, stats):
+        super().__init__("; ".join(messages))
+        self.messages = messages
+        self.stats = stats
+
+
+def statement_shape(statement):
+    """Kształt zapytania: SQL bez literałów i z listami parametrów IN zwiniętymi do jednego."""
+    shape = _STRING_LITERAL.sub("?", statement)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _PARAMETER_LIST.sub("(?)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+class QueryStats:
+    """Liczba, czas i kształty zapytań wykonanych w danym zakresie."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes = Counter()
+        self.shape_time = Counter()
+
+    def record(self, statement, seconds):
+        shape = statement_shape(statement)
+        self.count += 1
+        self.total_time += seconds
+        self.shapes[shape] += 1
+        self.shape_time[shape] += seconds
+
+    def repeated(self, threshold=None):
+        """Kształty wykonane co najmniej `threshold` razy: lista (kształt, liczba), najczęstsze pierwsze."""
+        threshold = N_PLUS_ONE_THRESHOLD if threshold is None else threshold
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def summary(self, top=3):
+        parts = [f"{self.count} zapytań, {self.total_time * 1000:.1f} ms"]
+        for shape, count in self.shapes.most_common(top):
+            parts.append(f"{count}x {self.shape_time[shape] * 1000:.1f} ms: {shape[:200]}")
+        return "; ".join(parts)
+
+
+def check(stats, max_queries=None, max_time=None, n_plus_one=None):
+    """
+    Sprawdza statystyki względem budżetu.
+
+    Returns:
+        list: Przekroczenia jako pary (rodzaj: count/time/n_plus_one, opis); pusta, gdy budżet jest zachowany
+    """
+    violations = []
+    if max_queries is not None and stats.count > max_queries:
+        violations.append(("count", f"{stats.count} zapytań przy budżecie {max_queries}"))
+    if max_time is not None and stats.total_time > max_time:
+        violations.append(("time", f"czas zapytań {stats.total_time:.3f}s przy budżecie {max_time:.3f}s"))
+    if n_plus_one is not None:
+        for shape, count in stats.repeated(n_plus_one):
+            violations.append(("n_plus_one", f"możliwe N+1 ({count}x): {shape[:200]}"))
+    return violations
+
+
+def _report(violations, stats, mode, where=""):
+    messages = [message for _, message in violations]
+    if mode == "raise":
+        raise QueryBudgetExceeded(messages, stats)
+    logger.warning(f"Przekroczono budżet zapytań{where}: {'; '.join(messages)} ({stats.summary()})")
+
+
+@contextmanager
+def query_budget(max_queries=None, max_time=None, n_plus_one=None, mode="raise"):
+    """
+    Liczy zapytania wykonane w bloku i sprawdza je z budżetem przy wyjściu.
+
+    Args:
+        max_queries (int, optional): Maksymalna liczba zapytań
+        max_time (float, optional): Maksymalny łączny czas zapytań (s)
+        n_plus_one (int, optional): Liczba powtórzeń kształtu uznawana za N+1
+        mode (str): 'raise' (QueryBudgetExceeded) lub 'warn' (log)
+
+    Yields:
+        QueryStats: Statystyki zapytań bloku
+    """
+    stats = QueryStats()
+    token = _active_stats.set(_active_stats.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active_stats.reset(token)
+
+    violations = check(stats, max_queries, max_time, n_plus_one)
+    if violations:
+        _report(violations, stats, mode)
+
+
+def _install_listeners(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_query_budget_start", []).append(time.perf_counter())
+
+    def _finish(conn, statement):
+        starts = conn.info.get("_query_budget_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        for stats in _active_stats.get():
+            stats.record(statement, elapsed)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        _finish(conn, statement)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        if exception_context.connection is not None:
+            _finish(exception_context.connection, exception_context.statement or "")
+
+
+def init_app(app, db):
+    """Rejestruje liczenie zapytań silnika i sprawdzanie budżetu każdego żądania."""
+    from flask import g, request
+    from metrics import DB_QUERIES_PER_REQUEST, QUERY_BUDGET_VIOLATIONS
+
+    with app.app_context():
+        _install_listeners(db.engine)
+
+    if QUERY_BUDGET_MODE == "off":
+        return app
+
+    @app.before_request
+    def _start_query_budget():
+        if request.endpoint == "static":
+            return
+        stats = QueryStats()
+        g._query_budget = (stats, _active_stats.set(_active_stats.get() + (stats,)))
+
+    @app.after_request
+    def _check_query_budget(response):
+        state = g.get("_query_budget")
+        if state is None:
+            return response
+        stats = state[0]
+        endpoint = request.endpoint or "unmatched"
+        DB_QUERIES_PER_REQUEST.labels(endpoint=endpoint).observe(stats.count)
+
+        violations = check(stats, ROUTE_BUDGETS.get(endpoint, QUERY_BUDGET_DEFAULT),
+                           QUERY_TIME_BUDGET, N_PLUS_ONE_THRESHOLD)
+        if violations:
+            for kind, _ in violations:
+                QUERY_BUDGET_VIOLATIONS.labels(endpoint=endpoint, kind=kind).inc()
+            # app.testing jest zwykle ustawiane już po imporcie aplikacji, więc tryb ustalany jest przy żądaniu
+            mode = QUERY_BUDGET_MODE or ("raise" if app.testing else "warn")
+            _report(violations, stats, mode, f" {request.method} {request.path} ({endpoint})")
+        return response
+
+    @app.teardown_request
+    def _end_query_budget(exception):
+        state = g.pop("_query_budget", None)
+        if state is None:
+            return
+        try:
+            _active_stats.reset(state[1])
+        except ValueError:
+            _active_stats.set(())
+
+    return app
@@ -0,0 +1,250 @@
+"""
+Lokalny indeks pytań: dobór pytania do ostatnich odpowiedzi bez wywołania LLM.
+
+Pytania z banku (therapy.CONTEXTUAL_QUESTIONS, FOLLOW_UP_QUESTIONS) są zamieniane
+na wektory TF-IDF w przestrzeni haszowanych cech (słowa i 4-gramy znakowe, co dobrze znosi
+polską fleksję). Pytania tematyczne są wzbogacane słowami kluczowymi tematu
+(therapy.KEYWORDS). Ostatnie odpowiedzi użytkownika są wektoryzowane tak samo,
+a wybierane jest najbardziej podobne (cosinus) pytanie, którego użytkownik
+jeszcze nie dostał. Zapytanie to jedno mnożenie macierzy NumPy - milisekundy.
+
+Indeks obejmuje tylko bank pytań. Pytania wygenerowane przez LLM powstają
+z odpowiedzi konkretnego użytkownika, więc nie mogą trafiać do innych, a jemu
+samemu zostały już zadane - w indeksie per użytkownik zawsze byłyby pominięte.
+
+Zadane pytania są śledzone per użytkownik w pamięci procesu (wczytywane z bazy
+przy pierwszym doborze dla użytkownika i uzupełniane o pytania z kontekstu).
+
+Indeks jest używany tylko na ścieżce zastępczej claude_api, gdy LLM jest niedostępny,
+zwraca błąd albo nie mieści się w budżecie czasu żądania; gdy Claude odpowiada,
+pytanie pochodzi od niego. therapy.generate_question pozostaje losowaniem z tematu
+i jest zastępstwem indeksu, gdy nic nie pasuje (QUESTION_FALLBACK=keywords wyłącza indeks).
+"""
+
+import os
+import re
+import zlib
+import logging
+import threading
+import functools
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Liczba haszowanych wymiarów wektora (potęga dwójki)
+QUESTION_INDEX_DIM = int(os.environ.get("QUESTION_INDEX_DIM", 4096))
+
+# Liczba użytkowników, dla których pamiętane są zadane pytania (LRU)
+QUESTION_INDEX_MAX_USERS = int(os.environ.get("QUESTION_INDEX_MAX_USERS", 10000))
+
+# Minimalne podobieństwo, poniżej którego indeks nie wybiera pytania
+QUESTION_INDEX_MIN_SCORE = float(os.environ.get("QUESTION_INDEX_MIN_SCORE", 0.05))
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+_CHAR_NGRAM = 4
+
+
+@functools.lru_cache(maxsize=50000)
+def _word_buckets(word, dim):
+    """Wymiary cech słowa: samo słowo oraz jego 4-gramy znakowe (z granicami słowa)."""
+    padded = f"<{word}>"
+    features = ["w:" + word] + [padded[i:i + _CHAR_NGRAM] for i in range(len(padded) - _CHAR_NGRAM + 1)]
+    return np.fromiter((zlib.crc32(f.encode("utf-8")) % dim for f in features), dtype=np.int64, count=len(features))
+
+
+def vectorize(text, dim=QUESTION_INDEX_DIM):
+    """Wektor częstości (log) haszowanych cech tekstu."""
+    words = Counter(word for word in _WORD_PATTERN.findall(text.lower()) if len(word) >= 3 and not word.isdigit())
+    vector = np.zeros(dim, dtype=np.float32)
+    if not words:
+        return vector
+    buckets = [_word_buckets(word, dim) for word in words]
+    weights = np.repeat(np.fromiter(words.values(), dtype=np.float32, count=len(words)), [len(b) for b in buckets])
+    counts = np.bincount(np.concatenate(buckets), weights=weights, minlength=dim)
+    present = counts > 0
+    vector[present] = 1.0 + np.log(counts[present])
+    return vector
+
+
+class QuestionIndex:
+    """Indeks TF-IDF pytań z pamięcią pytań zadanych poszczególnym użytkownikom."""
+
+    def __init__(self, dim=QUESTION_INDEX_DIM, max_users=QUESTION_INDEX_MAX_USERS):
+        self.dim = dim
+        self.max_users = max_users
+        self.questions = []
+        self.sources = []
+        self._ids = {}
+        self._rows = []
+        self._counts = np.zeros((0, dim), dtype=np.float32)
+        self._matrix = None
+        self._idf = None
+        self._asked = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.questions)
+
+    def add(self, question, source="bank", extra_text=""):
+        """Dodaje pytanie do indeksu (duplikaty są pomijane). Zwraca numer pytania."""
+        question = (question or "").strip()
+        if not question:
+            return None
+        with self._lock:
+            if question in self._ids:
+                return self._ids[question]
+            self._ids[question] = len(self.questions)
+            self.questions.append(question)
+            self.sources.append(source)
+            self._rows.append(vectorize(f"{question} {extra_text}", self.dim))
+            self._matrix = None
+            return self._ids[question]
+
+    def add_many(self, questions, source="bank"):
+        for question in questions:
+            self.add(question, source)
+
+    def _ensure_matrix(self):
+        """Przelicza macierz TF-IDF po dodaniu pytań (wywoływane pod blokadą)."""
+        if self._matrix is not None:
+            return
+        if self._rows:
+            self._counts = np.vstack([self._counts] + self._rows)
+            self._rows = []
+        documents = len(self._counts)
+        df = np.count_nonzero(self._counts, axis=0)
+        self._idf = (np.log((1.0 + documents) / (1.0 + df)) + 1.0).astype(np.float32)
+        matrix = self._counts * self._idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._matrix = matrix / np.maximum(norms, 1e-9)
+
+    def scores(self, text):
+        """Podobieństwo (cosinus) tekstu do każdego pytania w indeksie."""
+        query = vectorize(text, self.dim)
+        with self._lock:
+            self._ensure_matrix()
+            query = query * self._idf
+            norm = np.linalg.norm(query)
+            if not norm:
+                return np.zeros(len(self.questions), dtype=np.float32)
+            return self._matrix @ (query / norm)
+
+    def ids_of(self, questions):
+        """Numery podanych pytań obecnych w indeksie."""
+        return {self._ids[q.strip()] for q in questions if q and q.strip() in self._ids}
+
+    def asked(self, user_id):
+        """Numery pytań zadanych użytkownikowi (kopia) albo None, jeśli użytkownik jest nieznany."""
+        with self._lock:
+            if user_id not in self._asked:
+                return None
+            self._asked.move_to_end(user_id)
+            return frozenset(self._asked[user_id])
+
+    def mark_asked(self, user_id, questions):
+        """Zapamiętuje pytania zadane użytkownikowi (spoza indeksu są pomijane)."""
+        with self._lock:
+            asked = self._asked.setdefault(user_id, set())
+            self._asked.move_to_end(user_id)
+            asked.update(self.ids_of(questions))
+            while len(self._asked) > self.max_users:
+                self._asked.popitem(last=False)
+
+    def select(self, text, exclude=(), min_score=QUESTION_INDEX_MIN_SCORE):
+        """
+        Najbardziej podobne pytanie spoza `exclude`.
+
+        Returns:
+            tuple: (pytanie, podobieństwo) albo (None, 0.0), gdy nic nie przekracza min_score
+        """
+        scores = self.scores(text)
+        if exclude:
+            scores = scores.copy()
+            scores[list(exclude)] = -1.0
+        if not len(scores):
+            return None, 0.0
+        best = int(np.argmax(scores))
+        if scores[best] < min_score:
+            return None, 0.0
+        return self.questions[best], float(scores[best])
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _build_bank_index():
+    from therapy import CONTEXTUAL_QUESTIONS, FOLLOW_UP_QUESTIONS, KEYWORDS
+
+    index = QuestionIndex()
+    for theme, questions in CONTEXTUAL_QUESTIONS.items():
+        # Słowa kluczowe tematu przybliżają pytanie do słownictwa odpowiedzi
+        extra_text = " ".join([theme] + KEYWORDS.get(theme, []))
+        for question in questions:
+            index.add(question, source=theme, extra_text=extra_text)
+    index.add_many(FOLLOW_UP_QUESTIONS, source="follow_up")
+    return index
+
+
+def get_index():
+    """Indeks banku pytań procesu (budowany przy pierwszym użyciu)."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _build_bank_index()
+                logger.info(f"Indeks pytań: {len(_index)} pytań z banku")
+    return _index
+
+
+def _load_asked(index, user_id):
+    """Wczytuje pytania zadane użytkownikowi z bazy (raz na proces)."""
+    from sqlalchemy import select
+    from flask import has_app_context
+    from app import db
+    from models import Conversation
+
+    questions = []
+    if has_app_context():
+        try:
+            questions = db.session.execute(
+                select(Conversation.question).where(Conversation.user_id == user_id).distinct()
+            ).scalars().all()
+        except Exception as e:
+            logger.error(f"Nie można wczytać pytań zadanych użytkownikowi {user_id}: {str(e)}")
+    index.mark_asked(user_id, questions)
+
+
+def select_question(context, user_id=None):
+    """
+    Dobiera pytanie do ostatnich odpowiedzi użytkownika.
+
+    Args:
+        context (list): Wpisy rozmowy z kluczami 'question' i 'response'
+        user_id (int, optional): Użytkownik - pomija pytania już mu zadane
+
+    Returns:
+        str | None: Pytanie albo None, gdy odpowiedzi nic nie pasuje
+    """
+    text = " ".join(entry.get("response") or "" for entry in context or [])
+    if not text.strip():
+        return None
+
+    index = get_index()
+    context_questions = [entry.get("question") for entry in context]
+    if user_id is None:
+        exclude = index.ids_of(context_questions)
+    else:
+        if index.asked(user_id) is None:
+            _load_asked(index, user_id)
+        index.mark_asked(user_id, context_questions)
+        exclude = index.asked(user_id)
+
+    question, score = index.select(text, exclude)
+    if question is not None and user_id is not None:
+        index.mark_asked(user_id, [question])
+    return question
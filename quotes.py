@@ -1,21 +1,21 @@
-
+import os
 import random
 import logging
-from anthropic import Anthropic
-import os
+import threading
+
+from llm_client import (
+    DeadlineExceeded, is_anthropic_available, create_message_async, run_within_deadline_async,
+)
 
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Inicjalizacja klienta Anthropic
-anthropic_client = None
-try:
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if api_key:
-        anthropic_client = Anthropic(api_key=api_key)
-except Exception as e:
-    logger.warning(f"Nie można zainicjalizować Anthropic API: {str(e)}")
+# Limit czasu odczytu odpowiedzi przy generowaniu cytatu (s)
+QUOTE_READ_TIMEOUT = float(os.environ.get("QUOTE_READ_TIMEOUT", 10.0))
+
+# Maksymalna liczba wygenerowanych cytatów przechowywanych jako pula zastępcza
+QUOTE_POOL_SIZE = int(os.environ.get("QUOTE_POOL_SIZE", 50))
 
 # Domyślna pula cytatów
 DEFAULT_QUOTES = [
@@ -26,42 +26,70 @@ DEFAULT_QUOTES = [
     "Uważność to klucz do zrozumienia siebie.",
 ]
 
+# Pula cytatów wygenerowanych wcześniej przez Claude (cytat -> True), w kolejności dodania
 quote_cache = {}
+_quote_cache_lock = threading.Lock()
 
-def generate_therapeutic_quote(context=None):
+def _remember_quote(quote):
+    """Dodaje cytat do puli, usuwając najstarsze ponad QUOTE_POOL_SIZE."""
+    with _quote_cache_lock:
+        quote_cache[quote] = True
+        while len(quote_cache) > QUOTE_POOL_SIZE:
+            quote_cache.pop(next(iter(quote_cache)))
+
+def pick_pool_quote():
+    """Losowy cytat z puli domyślnej i wcześniej wygenerowanych."""
+    with _quote_cache_lock:
+        generated = list(quote_cache)
+    return random.choice(DEFAULT_QUOTES + generated)
+
+QUOTE_PROMPT = """
+    Wygeneruj jeden krótki, mądry cytat terapeutyczny w języku polskim.
+    Cytat powinien być inspirujący, głęboki i związany z samorozwojem, 
+    ale nie dłuższy niż jedno zdanie.
+    
+    Odpowiedz tylko samym cytatem, bez cudzysłowów czy dodatkowego tekstu.
+    """
+
+QUOTE_REQUEST = dict(
+    model="claude-3-sonnet-20240229",
+    read_timeout=QUOTE_READ_TIMEOUT,
+    max_tokens=100,
+    temperature=0.7,
+    messages=[
+        {"role": "user", "content": QUOTE_PROMPT}
+    ]
+)
+
+async def _fetch_quote_async():
+    message = await create_message_async(**QUOTE_REQUEST)
+    quote = message.content[0].text.strip()
+    _remember_quote(quote)
+    return quote
+
+async def generate_therapeutic_quote_async(context=None, deadline=None):
     """
     Generuje lub wybiera terapeutyczny cytat.
     
     Args:
         context (str, optional): Kontekst dla generowania cytatu
+        deadline (Deadline, optional): Budżet czasu żądania. Jeśli Claude nie zdąży,
+            zwracany jest cytat z puli, a nowy cytat trafi do puli po zakończeniu w tle.
         
     Returns:
         str: Terapeutyczny cytat
     """
-    if not anthropic_client:
-        return random.choice(DEFAULT_QUOTES)
-        
+    if not is_anthropic_available():
+        return pick_pool_quote()
+
     try:
-        prompt = """
-        Wygeneruj jeden krótki, mądry cytat terapeutyczny w języku polskim.
-        Cytat powinien być inspirujący, głęboki i związany z samorozwojem, 
-        ale nie dłuższy niż jedno zdanie.
-        
-        Odpowiedz tylko samym cytatem, bez cudzysłowów czy dodatkowego tekstu.
-        """
-        
-        message = anthropic_client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=100,
-            temperature=0.7,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        quote = message.content[0].text.strip()
-        return quote
-        
+        if deadline is None:
+            return await _fetch_quote_async()
+        return await run_within_deadline_async("therapeutic_quote", _fetch_quote_async, deadline)
+
+    except DeadlineExceeded:
+        logger.info("Generowanie cytatu nie zmieściło się w limicie czasu żądania. Używam cytatu z puli.")
+        return pick_pool_quote()
     except Exception as e:
         logger.error(f"Błąd podczas generowania cytatu: {str(e)}")
-        return random.choice(DEFAULT_QUOTES)
+        return pick_pool_quote()
@@ -8,11 +8,15 @@ oraz zarządzania harmonogramem przypomnień.
 import os
 import logging
 import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 import pytz
 
+from metrics import REMINDERS_DISPATCHED, REMINDERS_ENQUEUED
+from tracing import span, traced
+
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -51,6 +55,12 @@ SMTP_USERNAME = os.environ.get("SMTP_USERNAME")
 SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
 SENDER_EMAIL = os.environ.get("SENDER_EMAIL", SMTP_USERNAME)
 
+# Konfiguracja kolejki powiadomień (outbox)
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 3))
+OUTBOX_RETRY_DELAY = int(os.environ.get("OUTBOX_RETRY_DELAY", 60))  # sekundy, rośnie wykładniczo
+OUTBOX_SENDING_TIMEOUT = int(os.environ.get("OUTBOX_SENDING_TIMEOUT", 600))  # po tym czasie 'sending' wraca do kolejki
+
 def send_email_reminder(user):
     """
     Wysyła przypomnienie e-mail do użytkownika.
@@ -177,10 +187,228 @@ def send_reminder(user):
     
     return success, error
 
-def check_and_send_due_reminders():
+def enqueue_reminder(user, idempotency_key):
     """
-    Sprawdza i wysyła zaplanowane przypomnienia dla wszystkich użytkowników.
-    
+    Dodaje przypomnienie do kolejki wysyłki zamiast wysyłać je od razu.
+
+    Wpis w kolejce i wpis ReminderLog (ze statusem 'pending') powstają w jednej
+    transakcji, więc UI od razu widzi oczekujące powiadomienie.
+
+    Args:
+        user: Obiekt User, do którego wysyłamy przypomnienie
+        idempotency_key (str): Klucz chroniący przed ponownym dodaniem tego samego powiadomienia
+
+    Returns:
+        tuple: (wpis NotificationOutbox, czy_utworzono_nowy: bool)
+    """
+    from models import ReminderLog, NotificationOutbox
+    from app import db
+    from sqlalchemy.exc import IntegrityError
+
+    existing = NotificationOutbox.query.filter_by(idempotency_key=idempotency_key).first()
+    if existing:
+        return existing, False
+
+    log = ReminderLog(
+        user_id=user.id,
+        method=user.reminder_method,
+        status='pending'
+    )
+    db.session.add(log)
+    db.session.flush()
+
+    message = NotificationOutbox(
+        user_id=user.id,
+        reminder_log_id=log.id,
+        method=user.reminder_method,
+        idempotency_key=idempotency_key
+    )
+    db.session.add(message)
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Ten sam klucz został właśnie dodany przez inny proces
+        db.session.rollback()
+        return NotificationOutbox.query.filter_by(idempotency_key=idempotency_key).first(), False
+
+    # Rodzaj przypomnienia to prefiks klucza, np. "daily" lub "test"
+    REMINDERS_ENQUEUED.labels(kind=idempotency_key.split(':', 1)[0]).inc()
+    return message, True
+
+def _claim_message(message_id):
+    """Oznacza wiadomość jako wysyłaną; zwraca False, jeśli przejął ją już inny proces."""
+    from models import NotificationOutbox
+    from app import db
+    from sqlalchemy import update
+
+    result = db.session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id == message_id, NotificationOutbox.status == 'pending')
+        .values(status='sending', attempts=NotificationOutbox.attempts + 1, available_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+@traced("reminders.deliver_pending_notifications")
+def deliver_pending_notifications(batch_size=OUTBOX_BATCH_SIZE, keep_going=None):
+    """
+    Wysyła oczekujące powiadomienia z kolejki, paczkami.
+
+    Każda wiadomość jest najpierw przejmowana warunkowym UPDATE, więc kilka
+    równoległych procesów nie wyśle tej samej wiadomości dwa razy.
+
+    Args:
+        batch_size (int): Maksymalna liczba wiadomości pobieranych w jednej paczce
+        keep_going (callable, optional): Wywoływana przed każdą paczką; False przerywa
+            wysyłkę (harmonogram odnawia w niej swoją dzierżawę)
+
+    Returns:
+        int: Liczba pomyślnie wysłanych powiadomień
+    """
+    from models import User, ReminderLog, NotificationOutbox
+    from app import db
+    from sqlalchemy import update
+
+    now = datetime.now()
+
+    # Wiadomości porzucone w stanie 'sending' (np. po awarii procesu) wracają do kolejki
+    db.session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.status == 'sending',
+               NotificationOutbox.available_at < now - timedelta(seconds=OUTBOX_SENDING_TIMEOUT))
+        .values(status='pending')
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    sent_count = 0
+    while True:
+        if keep_going is not None and not keep_going():
+            break
+        batch = NotificationOutbox.query\
+            .filter(NotificationOutbox.status == 'pending', NotificationOutbox.available_at <= now)\
+            .order_by(NotificationOutbox.id.asc())\
+            .limit(batch_size)\
+            .all()
+        if not batch:
+            break
+
+        for message in batch:
+            if not _claim_message(message.id):
+                continue
+
+            db.session.refresh(message)
+            user = db.session.get(User, message.user_id)
+            log = db.session.get(ReminderLog, message.reminder_log_id) if message.reminder_log_id else None
+
+            if user is None:
+                # Konto usunięte po dodaniu wiadomości do kolejki - nie ma do kogo wysłać
+                message.status = 'failed'
+                message.last_error = "Użytkownik nie istnieje"
+                if log:
+                    log.status = 'failed'
+                    log.error_message = message.last_error
+                REMINDERS_DISPATCHED.labels(method=message.method, outcome='failed').inc()
+                db.session.commit()
+                continue
+
+            with span("reminder.send", attributes={
+                "reminder.method": message.method,
+                "reminder.outbox_id": message.id,
+                "reminder.attempt": message.attempts,
+            }) as send_span:
+                if message.method == 'sms':
+                    success, error = send_sms_reminder(user)
+                else:  # domyślnie email
+                    success, error = send_email_reminder(user)
+                send_span.set_attribute("reminder.success", success)
+                send_span.set_attribute("reminder.error", error)
+
+            if success:
+                message.status = 'sent'
+                message.sent_at = datetime.now()
+                message.last_error = None
+                user.last_reminder_sent = datetime.now(pytz.utc)
+                if log:
+                    log.status = 'success'
+                    log.error_message = None
+                    log.timestamp = message.sent_at
+                sent_count += 1
+                REMINDERS_DISPATCHED.labels(method=message.method, outcome='sent').inc()
+            elif message.attempts >= OUTBOX_MAX_ATTEMPTS:
+                message.status = 'failed'
+                message.last_error = error
+                if log:
+                    log.status = 'failed'
+                    log.error_message = error
+                REMINDERS_DISPATCHED.labels(method=message.method, outcome='failed').inc()
+            else:
+                # Ponów później z wykładniczym opóźnieniem
+                message.status = 'pending'
+                message.last_error = error
+                message.available_at = datetime.now() + timedelta(seconds=OUTBOX_RETRY_DELAY * (2 ** (message.attempts - 1)))
+                if log:
+                    log.error_message = error
+                REMINDERS_DISPATCHED.labels(method=message.method, outcome='retry').inc()
+
+            db.session.commit()
+
+        if len(batch) < batch_size:
+            break
+
+    return sent_count
+
+_delivery_lock = threading.Lock()
+_delivery_state = {"running": False, "requested": False}
+
+def deliver_in_background(app):
+    """
+    Opróżnia kolejkę powiadomień w wątku w tle, bez blokowania bieżącego żądania.
+
+    W procesie działa najwyżej jeden taki wątek. Wywołanie w trakcie wysyłki nie
+    tworzy nowego wątku, tylko zleca działającemu jeszcze jedno przejście kolejki.
+
+    Returns:
+        threading.Thread lub None: Nowy wątek albo None, jeśli wysyłka już trwa
+    """
+    with _delivery_lock:
+        _delivery_state["requested"] = True
+        if _delivery_state["running"]:
+            return None
+        _delivery_state["running"] = True
+
+    def _worker():
+        from app import db
+        while True:
+            with _delivery_lock:
+                if not _delivery_state["requested"]:
+                    _delivery_state["running"] = False
+                    return
+                _delivery_state["requested"] = False
+            with app.app_context():
+                try:
+                    deliver_pending_notifications()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Błąd podczas opróżniania kolejki powiadomień: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=_worker, name="notification-delivery", daemon=True)
+    thread.start()
+    return thread
+
+@traced("reminders.check_and_send_due_reminders")
+def check_and_send_due_reminders(keep_going=None):
+    """
+    Dodaje do kolejki zaplanowane przypomnienia dla wszystkich użytkowników
+    i wysyła oczekujące powiadomienia.
+
+    Args:
+        keep_going (callable, optional): Jak w deliver_pending_notifications
+
     Returns:
         int: Liczba wysłanych przypomnień
     """
@@ -189,17 +417,22 @@ def check_and_send_due_reminders():
     
     logger.info("Sprawdzanie przypomnień do wysłania...")
     users = User.query.filter_by(reminder_enabled=True).all()
-    sent_count = 0
+    queued_count = 0
     
     for user in users:
         if user.is_reminder_due():
-            logger.info(f"Wysyłanie przypomnienia do {user.username}")
-            success, error = send_reminder(user)
+            # Jedno przypomnienie dziennie (wg daty w strefie czasowej użytkownika)
+            local_date = datetime.now(pytz.timezone(user.reminder_timezone)).date()
+            _, created = enqueue_reminder(user, f"daily:{user.id}:{local_date.isoformat()}")
             
-            if success:
-                sent_count += 1
+            if created:
+                logger.info(f"Dodano przypomnienie dla {user.username} do kolejki")
+                queued_count += 1
+    
+    sent_count = deliver_pending_notifications(keep_going=keep_going)
     
-    logger.info(f"Wysłano {sent_count} przypomnień spośród {len(users)} aktywnych użytkowników")
+    logger.info(f"Dodano do kolejki {queued_count} i wysłano {sent_count} przypomnień "
+                f"({len(users)} aktywnych użytkowników)")
     return sent_count
 
 # Jeśli ten plik jest uruchamiany bezpośrednio, sprawdź i wyślij przypomnienia
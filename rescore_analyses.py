@@ -0,0 +1,129 @@
+"""
+Ponowne obliczenie wyników EI i wyników cech dla zapisanych analiz.
+
+Analizy są czytane partiami po kluczu głównym (WHERE id > ostatnie_id), więc
+pamięć i czas zapytania nie rosną z rozmiarem tabeli. Wyniki partii są liczone
+wektorowo (psychology.score_counts), a zmienione wiersze zapisywane jednym
+UPDATE wykonywanym dla całej partii (executemany).
+
+Analizy z najwyżej jednym wglądem (wynik 0 wg formuły, np. analizy zastępcze
+zapisane przy błędzie) zachowują dotychczasowy wynik.
+
+Przykłady:
+    python rescore_analyses.py --dry-run
+    python rescore_analyses.py --batch-size 5000
+"""
+
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+from sqlalchemy import select, update, bindparam
+
+from psychology import score_counts, category_counts, compute_trait_scores
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _rescore_batch(rows):
+    """Zwraca (zmiany wyników, zmiany danych JSON, liczba błędnych wierszy) dla partii."""
+    parsed = []
+    invalid = 0
+    for row in rows:
+        try:
+            data = json.loads(row.analysis_data)
+        except (TypeError, ValueError):
+            invalid += 1
+            continue
+        if isinstance(data, dict):
+            parsed.append((row, data))
+        else:
+            invalid += 1
+
+    if not parsed:
+        return [], [], invalid
+
+    scores = score_counts(np.array([category_counts(data) for _, data in parsed]))
+    score_updates = []
+    data_updates = []
+    for (row, data), score in zip(parsed, scores.tolist()):
+        if score > 0 and score != row.emotional_intelligence_score:
+            score_updates.append({"b_id": row.id, "b_score": score})
+
+        trait_scores = compute_trait_scores(data)
+        if data.get("trait_scores", {}) != trait_scores:
+            data["trait_scores"] = trait_scores
+            data_updates.append({"b_id": row.id, "b_data": json.dumps(data)})
+    return score_updates, data_updates, invalid
+
+
+def rescore(engine, batch_size=1000, dry_run=False):
+    """
+    Przelicza wyniki wszystkich analiz w bazie.
+
+    Args:
+        engine: Silnik SQLAlchemy
+        batch_size (int): Liczba analiz w partii
+        dry_run (bool): Tylko policz zmiany, bez zapisu
+
+    Returns:
+        dict: Podsumowanie (liczba przejrzanych i zmienionych analiz, czas)
+    """
+    from models import PsychologicalAnalysis
+
+    table = PsychologicalAnalysis.__table__
+    select_batch = (select(table.c.id, table.c.analysis_data, table.c.emotional_intelligence_score)
+                    .where(table.c.id > bindparam("last_id"))
+                    .order_by(table.c.id)
+                    .limit(batch_size))
+    update_score = (update(table).where(table.c.id == bindparam("b_id"))
+                    .values(emotional_intelligence_score=bindparam("b_score")))
+    update_data = (update(table).where(table.c.id == bindparam("b_id"))
+                   .values(analysis_data=bindparam("b_data")))
+
+    summary = {"scanned": 0, "scores_updated": 0, "trait_scores_updated": 0, "invalid": 0}
+    start = time.perf_counter()
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(select_batch, {"last_id": last_id}).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        score_updates, data_updates, invalid = _rescore_batch(rows)
+        if not dry_run and (score_updates or data_updates):
+            with engine.begin() as conn:
+                if score_updates:
+                    conn.execute(update_score, score_updates)
+                if data_updates:
+                    conn.execute(update_data, data_updates)
+
+        summary["scanned"] += len(rows)
+        summary["scores_updated"] += len(score_updates)
+        summary["trait_scores_updated"] += len(data_updates)
+        summary["invalid"] += invalid
+        logger.info(f"Przeliczono {summary['scanned']} analiz (do id {last_id}): "
+                    f"zmienione wyniki {summary['scores_updated']}, zmienione cechy {summary['trait_scores_updated']}")
+
+    elapsed = time.perf_counter() - start
+    summary["elapsed_s"] = elapsed
+    summary["rows_per_s"] = summary["scanned"] / elapsed if elapsed else 0.0
+    summary["dry_run"] = dry_run
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ponowne obliczenie wyników EI zapisanych analiz")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Liczba analiz w partii")
+    parser.add_argument("--dry-run", action="store_true", help="Tylko policz zmiany, bez zapisu")
+    args = parser.parse_args()
+
+    from app import app, db
+    with app.app_context():
+        result = rescore(db.engine, batch_size=args.batch_size, dry_run=args.dry_run)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,336 @@
+"""
+Moduł harmonogramu przypomnień.
+
+Cyklicznie wywołuje `reminders.check_and_send_due_reminders`. Może działać jako
+osobny proces (`python scheduler.py`) albo jako wątek wewnątrz aplikacji
+(zmienna REMINDER_SCHEDULER_IN_APP=1). Niezależnie od liczby uruchomionych
+instancji (np. workerów gunicorna) przypomnienia wysyła naraz tylko jedna z nich -
+ta, która trzyma dzierżawę (SchedulerLease) w bazie danych. Lider odnawia
+dzierżawę między paczkami wysyłki; jeśli odnowienie się nie uda (dzierżawę
+przejął inny proces), przerywa bieżący cykl.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import signal
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Konfiguracja harmonogramu
+SCHEDULER_INTERVAL = float(os.environ.get("REMINDER_SCHEDULER_INTERVAL", 60))  # sekundy między cyklami
+# Dzierżawa jest odnawiana między paczkami wysyłki, więc musi przetrwać jedną paczkę
+LEASE_TTL = float(os.environ.get("REMINDER_SCHEDULER_LEASE_TTL", max(SCHEDULER_INTERVAL * 3, 300)))
+LEASE_NAME = "reminders"
+
+# Metryki tej instancji (metryki lidera są dodatkowo zapisywane w SchedulerLease)
+scheduler_stats = {
+    "ticks": 0,  # cykle, w których ta instancja była liderem
+    "skipped_ticks": 0,  # cykle pominięte, bo dzierżawę trzyma inny proces
+    "failed_ticks": 0,
+    "sent_total": 0,
+    "last_lag": 0.0,
+    "last_duration": 0.0,
+    "started_at": None,
+}
+
+_instance_id = None
+_instance_pid = None
+_stop_event = threading.Event()
+_scheduler_thread = None
+
+
+def _utcnow():
+    """Aktualny czas UTC bez strefy (tak przechowujemy czasy dzierżawy)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def get_instance_id():
+    """Identyfikator procesu używany jako właściciel dzierżawy (unikalny także po fork)."""
+    global _instance_id, _instance_pid
+    if _instance_id is None or _instance_pid != os.getpid():
+        _instance_pid = os.getpid()
+        _instance_id = f"{socket.gethostname()}:{_instance_pid}:{uuid.uuid4().hex[:8]}"
+    return _instance_id
+
+
+def acquire_lease(name=LEASE_NAME, ttl=LEASE_TTL):
+    """
+    Próbuje przejąć lub odnowić dzierżawę lidera.
+
+    Przejęcie jest pojedynczym warunkowym UPDATE, więc przy wielu procesach
+    tylko jeden z nich zobaczy zmieniony wiersz.
+
+    Args:
+        name (str): Nazwa dzierżawy
+        ttl (float): Czas ważności dzierżawy w sekundach
+
+    Returns:
+        bool: True, jeśli ta instancja jest liderem
+    """
+    from models import SchedulerLease
+    from app import db
+
+    holder = get_instance_id()
+    now = _utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+
+    try:
+        result = db.session.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == name)
+            .where(or_(
+                SchedulerLease.holder == holder,
+                SchedulerLease.expires_at.is_(None),
+                SchedulerLease.expires_at < now,
+            ))
+            .values(holder=holder, expires_at=expires_at, heartbeat_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            db.session.commit()
+            return True
+
+        # Wiersz dzierżawy może jeszcze nie istnieć
+        if db.session.get(SchedulerLease, name) is None:
+            db.session.add(SchedulerLease(name=name, holder=holder, expires_at=expires_at, heartbeat_at=now))
+            db.session.commit()
+            return True
+
+        db.session.rollback()
+        return False
+
+    except IntegrityError:
+        # Inny proces utworzył wiersz dzierżawy w tym samym momencie
+        db.session.rollback()
+        return False
+
+
+def renew_lease(name=LEASE_NAME, ttl=LEASE_TTL):
+    """
+    Przedłuża dzierżawę trzymaną przez tę instancję (warunkowy UPDATE po właścicielu).
+
+    Returns:
+        bool: False, jeśli dzierżawę przejął inny proces albo została zwolniona
+    """
+    from models import SchedulerLease
+    from app import db
+
+    now = _utcnow()
+    try:
+        result = db.session.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == name,
+                   SchedulerLease.holder == get_instance_id(),
+                   SchedulerLease.expires_at.is_not(None))
+            .values(expires_at=now + timedelta(seconds=ttl), heartbeat_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Nie udało się odnowić dzierżawy {name}: {str(e)}")
+        return False
+    if result.rowcount != 1:
+        logger.warning(f"Utracono dzierżawę {name} w trakcie cyklu, przerywam wysyłkę")
+        return False
+    return True
+
+
+def release_lease(name=LEASE_NAME):
+    """Zwalnia dzierżawę, jeśli należy do tej instancji."""
+    from models import SchedulerLease
+    from app import db
+
+    try:
+        db.session.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == name, SchedulerLease.holder == get_instance_id())
+            .values(expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Nie udało się zwolnić dzierżawy {name}: {str(e)}")
+
+
+def _record_tick(name, started_at, lag, duration, sent_count):
+    """Zapisuje metryki cyklu w wierszu dzierżawy."""
+    from models import SchedulerLease
+    from app import db
+
+    db.session.execute(
+        update(SchedulerLease)
+        .where(SchedulerLease.name == name, SchedulerLease.holder == get_instance_id())
+        .values(
+            last_tick_at=started_at,
+            last_tick_lag=lag,
+            last_tick_duration=duration,
+            last_sent_count=sent_count,
+            total_ticks=SchedulerLease.total_ticks + 1,
+            total_sent=SchedulerLease.total_sent + sent_count,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def run_tick(app, scheduled_at=None):
+    """
+    Wykonuje jeden cykl harmonogramu: przejmuje dzierżawę i wysyła zaległe przypomnienia.
+
+    Args:
+        app: Aplikacja Flask (potrzebna do kontekstu bazy danych)
+        scheduled_at (float, optional): Planowany czas startu cyklu (time.monotonic())
+
+    Returns:
+        int lub None: Liczba wysłanych przypomnień albo None, jeśli liderem jest inny proces
+    """
+    from reminders import check_and_send_due_reminders
+    from app import db
+
+    start = time.monotonic()
+    lag = max(0.0, start - scheduled_at) if scheduled_at is not None else 0.0
+
+    with app.app_context():
+        try:
+            if not acquire_lease():
+                scheduler_stats["skipped_ticks"] += 1
+                return None
+
+            started_at = _utcnow()
+            sent_count = check_and_send_due_reminders(keep_going=renew_lease)
+            duration = time.monotonic() - start
+
+            _record_tick(LEASE_NAME, started_at, lag, duration, sent_count)
+
+            scheduler_stats["ticks"] += 1
+            scheduler_stats["sent_total"] += sent_count
+            scheduler_stats["last_lag"] = lag
+            scheduler_stats["last_duration"] = duration
+
+            throughput = sent_count / duration if duration > 0 else 0.0
+            logger.info(f"Cykl harmonogramu: wysłano {sent_count}, opóźnienie {lag:.2f}s, "
+                        f"czas {duration:.2f}s ({throughput:.1f} przypomnień/s)")
+            return sent_count
+
+        except Exception as e:
+            db.session.rollback()
+            scheduler_stats["failed_ticks"] += 1
+            logger.error(f"Błąd w cyklu harmonogramu przypomnień: {str(e)}")
+            return None
+        finally:
+            db.session.remove()
+
+
+def run_scheduler(app, interval=SCHEDULER_INTERVAL, stop_event=None):
+    """
+    Pętla harmonogramu. Kolejne cykle są planowane w stałym rytmie, więc opóźnienie
+    (lag) mierzy, o ile później niż planowano rozpoczął się cykl.
+
+    Args:
+        app: Aplikacja Flask
+        interval (float): Odstęp między cyklami w sekundach
+        stop_event (threading.Event, optional): Zdarzenie kończące pętlę
+    """
+    stop_event = stop_event or _stop_event
+    scheduler_stats["started_at"] = _utcnow().isoformat()
+    logger.info(f"Uruchomiono harmonogram przypomnień ({get_instance_id()}, co {interval:.0f}s)")
+
+    next_tick = time.monotonic()
+    while not stop_event.is_set():
+        run_tick(app, scheduled_at=next_tick)
+
+        next_tick += interval
+        # Jeśli cykl trwał dłużej niż interwał, nie nadrabiamy pominiętych cykli
+        if next_tick < time.monotonic():
+            next_tick = time.monotonic()
+        stop_event.wait(max(0.0, next_tick - time.monotonic()))
+
+    with app.app_context():
+        release_lease()
+        from app import db
+        db.session.remove()
+    logger.info("Zatrzymano harmonogram przypomnień")
+
+
+def start_scheduler_thread(app, interval=SCHEDULER_INTERVAL):
+    """Uruchamia harmonogram w wątku w tle (jeden na proces)."""
+    global _scheduler_thread
+    if _scheduler_thread is not None and _scheduler_thread.is_alive():
+        return _scheduler_thread
+
+    _stop_event.clear()
+    _scheduler_thread = threading.Thread(
+        target=run_scheduler,
+        args=(app, interval, _stop_event),
+        name="reminder-scheduler",
+        daemon=True,
+    )
+    _scheduler_thread.start()
+    return _scheduler_thread
+
+
+def stop_scheduler():
+    """Zatrzymuje pętlę harmonogramu (wątek lub proces)."""
+    _stop_event.set()
+
+
+def get_scheduler_metrics():
+    """
+    Zwraca metryki harmonogramu: lokalne dla tej instancji oraz metryki lidera z bazy.
+
+    Returns:
+        dict: Słownik z kluczami 'instance' i 'leader'
+    """
+    from models import SchedulerLease
+    from app import db
+
+    lease = db.session.get(SchedulerLease, LEASE_NAME)
+    leader = None
+    if lease is not None:
+        now = _utcnow()
+        leader = {
+            "holder": lease.holder,
+            "active": lease.expires_at is not None and lease.expires_at > now,
+            "last_tick_at": lease.last_tick_at.isoformat() if lease.last_tick_at else None,
+            "seconds_since_last_tick": (now - lease.last_tick_at).total_seconds() if lease.last_tick_at else None,
+            "last_tick_lag": lease.last_tick_lag,
+            "last_tick_duration": lease.last_tick_duration,
+            "last_sent_count": lease.last_sent_count,
+            "last_throughput": (lease.last_sent_count / lease.last_tick_duration) if lease.last_tick_duration else 0.0,
+            "total_ticks": lease.total_ticks,
+            "total_sent": lease.total_sent,
+        }
+
+    return {
+        "instance": dict(scheduler_stats, instance_id=get_instance_id()),
+        "leader": leader,
+    }
+
+
+# Uruchomienie jako osobny proces: python scheduler.py [--once | --status]
+if __name__ == "__main__":
+    from app import app
+
+    if "--status" in sys.argv:
+        with app.app_context():
+            print(json.dumps(get_scheduler_metrics(), indent=2, default=str))
+    elif "--once" in sys.argv:
+        run_tick(app)
+    else:
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_scheduler())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop_scheduler())
+        run_scheduler(app)
@@ -0,0 +1,311 @@
+"""
+Generator syntetycznych danych do testów w dużej skali.
+
+Tworzy użytkowników wraz z historią rozmów (odpowiedzi po polsku ze słownictwa
+therapy.KEYWORDS), historią analiz psychologicznych i ustawieniami przypomnień.
+Wiersze są wstawiane paczkami przez executemany (SQLAlchemy Core), więc miliony
+wierszy ładują się w minutach zarówno na SQLite, jak i na PostgreSQL.
+
+Przykłady:
+    python seed_data.py --users 1000
+    python seed_data.py --conversations 10000000 --conversations-per-user 200 --distribution lognormal
+"""
+
+import json
+import bisect
+import math
+import time
+import random
+import logging
+import argparse
+from datetime import datetime, timedelta, time as dt_time
+
+from sqlalchemy import func, select, text
+from werkzeug.security import generate_password_hash
+
+from therapy import KEYWORDS, DEFAULT_FIRST_QUESTIONS, FOLLOW_UP_QUESTIONS, CONTEXTUAL_QUESTIONS
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SEED_PASSWORD = "seed-password"
+
+# Słowa wypełniające, aby odpowiedzi przypominały naturalny tekst
+FILLER_WORDS = [
+    "dzisiaj", "często", "czuję", "myślę", "bardzo", "trochę", "ostatnio", "wieczorem", "rano",
+    "mam", "jest", "było", "bardziej", "mniej", "chyba", "naprawdę", "zawsze", "czasem",
+    "dlatego", "kiedy", "że", "się", "mnie", "mój", "moja", "tego", "który", "przez",
+]
+
+EMOTION_PATTERN_TEMPLATES = [
+    "Radość w codziennych sprawach ({0}/5)",
+    "Smutek związany z przeszłością ({0}/5)",
+    "Lęk przed oceną innych ({0}/5)",
+    "Gniew w sytuacjach konfliktowych ({0}/5)",
+    "Zaskoczenie własnymi reakcjami ({0}/5)",
+]
+
+TIMEZONES = ["Europe/Warsaw", "Europe/London", "Europe/Berlin", "America/New_York", "UTC"]
+
+
+def sample_count(rng, mean, distribution):
+    """Losuje liczbę elementów o zadanej średniej i rozkładzie."""
+    if mean <= 0:
+        return 0
+    if distribution == "fixed":
+        return int(round(mean))
+    if distribution == "uniform":
+        return rng.randint(0, int(round(2 * mean)))
+    if distribution == "exponential":
+        return int(rng.expovariate(1.0 / mean))
+    if distribution == "lognormal":
+        sigma = 1.0
+        return int(rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma))
+    raise ValueError(f"Nieznany rozkład: {distribution}")
+
+
+class TextFactory:
+    """Szybkie generowanie pytań i odpowiedzi po polsku."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.keywords = [word for words in KEYWORDS.values() for word in words]
+        self.vocabulary = self.keywords + FILLER_WORDS * 2
+        self.questions = DEFAULT_FIRST_QUESTIONS + FOLLOW_UP_QUESTIONS + [
+            q for questions in CONTEXTUAL_QUESTIONS.values() for q in questions
+        ]
+
+    def question(self):
+        return self.rng.choice(self.questions)
+
+    def response(self, mean_words):
+        words = self.rng.choices(self.vocabulary, k=max(3, sample_count(self.rng, mean_words, "lognormal")))
+        # Podziel na zdania co ok. 12 słów
+        sentences = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        return ". ".join(s.capitalize() for s in sentences) + "."
+
+    def analysis(self):
+        rng = self.rng
+        return {
+            "personality_traits": rng.sample(["Refleksyjność", "Empatia", "Sumienność", "Otwartość", "Wrażliwość"], 3),
+            "emotional_patterns": [t.format(rng.randint(1, 5)) for t in rng.sample(EMOTION_PATTERN_TEMPLATES, 3)],
+            "cognitive_patterns": rng.sample(["Analityczne myślenie", "Perfekcjonizm", "Orientacja na rozwiązania"], 2),
+            "insights": ["Regularna refleksja pomaga w rozwoju samoświadomości.",
+                         "Relacje z bliskimi są dla Ciebie ważnym zasobem."],
+            "growth_areas": rng.sample(["Samowspółczucie", "Stawianie granic", "Odpoczynek"], 2),
+        }
+
+
+class BatchWriter:
+    """Bufor wierszy wstawianych paczkami przez executemany."""
+
+    def __init__(self, engine, table, batch_size, depends_on=()):
+        self.engine = engine
+        self.table = table
+        self.batch_size = batch_size
+        self.depends_on = depends_on  # bufory, które muszą trafić do bazy wcześniej (klucze obce)
+        self.rows = []
+        self.written = 0
+        self.elapsed = 0.0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        for writer in self.depends_on:
+            writer.flush()
+        start = time.perf_counter()
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), self.rows)
+        self.elapsed += time.perf_counter() - start
+        self.written += len(self.rows)
+        self.rows = []
+
+
+def _next_id(engine, table):
+    with engine.connect() as conn:
+        return (conn.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+
+def _prepare_connection(engine):
+    """Przyspiesza masowe ładowanie na SQLite (na PostgreSQL nic nie zmienia)."""
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text("PRAGMA journal_mode=WAL"))
+            conn.execute(text("PRAGMA synchronous=OFF"))
+
+
+def _reset_sequences(engine, tables):
+    """Po wstawieniu jawnych ID ustawia sekwencje PostgreSQL na maksimum."""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        for table in tables:
+            name = engine.dialect.identifier_preparer.quote(table.name)
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE(MAX(id), 1)) FROM {name}"
+            ))
+
+
+def seed(engine, users=1000, conversations_per_user=50.0, distribution="lognormal", response_words=60.0,
+         analyses_per_user=3.0, pending_ratio=0.3, reminder_ratio=0.3, days=365, batch_size=10000, seed=42):
+    """
+    Wstawia syntetycznych użytkowników i ich dane.
+
+    Args:
+        engine: Silnik SQLAlchemy (np. db.engine)
+        users (int): Liczba użytkowników
+        conversations_per_user (float): Średnia liczba rozmów na użytkownika
+        distribution (str): Rozkład liczby rozmów: fixed, uniform, exponential, lognormal
+        response_words (float): Średnia długość odpowiedzi w słowach (rozkład log-normalny)
+        analyses_per_user (float): Średnia liczba analiz psychologicznych na użytkownika
+        pending_ratio (float): Odsetek użytkowników z pytaniem czekającym na odpowiedź
+        reminder_ratio (float): Odsetek użytkowników z włączonymi przypomnieniami
+        days (int): Zakres historii w dniach
+        batch_size (int): Liczba wierszy w jednej paczce executemany
+        seed (int): Ziarno generatora (te same parametry dają te same dane)
+
+    Returns:
+        dict: Liczba wstawionych wierszy i szybkość dla każdej tabeli
+    """
+    from models import User, Conversation, PsychologicalAnalysis, EmotionIntensity
+    from visualization import extract_emotion_intensities
+
+    rng = random.Random(seed)
+    texts = TextFactory(rng)
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    now = datetime.now()
+
+    _prepare_connection(engine)
+    user_table, conversation_table = User.__table__, Conversation.__table__
+    analysis_table = PsychologicalAnalysis.__table__
+    intensity_table = EmotionIntensity.__table__
+
+    user_writer = BatchWriter(engine, user_table, batch_size)
+    conversation_writer = BatchWriter(engine, conversation_table, batch_size, depends_on=[user_writer])
+    analysis_writer = BatchWriter(engine, analysis_table, max(1, batch_size // 10), depends_on=[user_writer])
+    intensity_writer = BatchWriter(engine, intensity_table, batch_size, depends_on=[analysis_writer])
+
+    user_id = _next_id(engine, user_table)
+    conversation_id = _next_id(engine, conversation_table)
+    analysis_id = _next_id(engine, analysis_table)
+    run_tag = f"{seed}_{user_id}"
+
+    start = time.perf_counter()
+    for i in range(users):
+        joined = now - timedelta(days=rng.uniform(1, days))
+        reminder_enabled = rng.random() < reminder_ratio
+        method = "sms" if reminder_enabled and rng.random() < 0.2 else "email"
+        user_writer.add({
+            "id": user_id,
+            "username": f"seed_{run_tag}_{i}",
+            "email": f"seed_{run_tag}_{i}@example.com",
+            "password_hash": password_hash,
+            "joined_date": joined,
+            "phone_number": f"+48{rng.randint(500000000, 799999999)}" if method == "sms" else None,
+            "reminder_enabled": reminder_enabled,
+            "reminder_time": dt_time(rng.randint(6, 22), rng.choice([0, 15, 30, 45])),
+            "reminder_timezone": rng.choice(TIMEZONES),
+            "reminder_method": method,
+            "last_reminder_sent": now - timedelta(days=rng.randint(0, 3)) if reminder_enabled and rng.random() < 0.7 else None,
+        })
+
+        count = sample_count(rng, conversations_per_user, distribution)
+        span = (now - joined).total_seconds()
+        timestamps = sorted(joined + timedelta(seconds=rng.uniform(0, span)) for _ in range(count))
+        pending = count > 0 and rng.random() < pending_ratio
+        answered = []  # (timestamp, id) odpowiedzi - znacznik świeżości analiz
+        for n, timestamp in enumerate(timestamps):
+            is_pending = pending and n == count - 1
+            if not is_pending:
+                answered.append((timestamp, conversation_id))
+            conversation_writer.add({
+                "id": conversation_id,
+                "user_id": user_id,
+                "question": texts.question(),
+                "response": None if is_pending else texts.response(response_words),
+                "timestamp": timestamp,
+            })
+            conversation_id += 1
+
+        analyses = sample_count(rng, analyses_per_user, "uniform") if count >= 2 else 0
+        for timestamp in sorted(joined + timedelta(seconds=rng.uniform(0, span)) for _ in range(analyses)):
+            covered = bisect.bisect_right(answered, (timestamp, float("inf")))
+            watermark_at, watermark_id = answered[covered - 1] if covered else (None, None)
+            analysis = texts.analysis()
+            analysis_writer.add({
+                "id": analysis_id,
+                "user_id": user_id,
+                "timestamp": timestamp,
+                "analysis_data": json.dumps(analysis, ensure_ascii=False),
+                "emotional_intelligence_score": rng.randint(30, 95),
+                "last_conversation_id": watermark_id,
+                "last_conversation_at": watermark_at,
+            })
+            for emotion, intensity in extract_emotion_intensities(analysis):
+                intensity_writer.add({
+                    "analysis_id": analysis_id,
+                    "user_id": user_id,
+                    "timestamp": timestamp,
+                    "emotion": emotion,
+                    "intensity": intensity,
+                })
+            analysis_id += 1
+
+        user_id += 1
+
+        if (i + 1) % 10000 == 0:
+            logger.info(f"Wygenerowano {i + 1}/{users} użytkowników, {conversation_writer.written} rozmów")
+
+    user_writer.flush()
+    conversation_writer.flush()
+    analysis_writer.flush()
+    intensity_writer.flush()
+    _reset_sequences(engine, [user_table, conversation_table, analysis_table])
+    total_time = time.perf_counter() - start
+
+    summary = {"total_time_s": total_time}
+    for name, writer in [("user", user_writer), ("conversation", conversation_writer),
+                         ("psychological_analysis", analysis_writer), ("emotion_intensity", intensity_writer)]:
+        summary[name] = {
+            "rows": writer.written,
+            "insert_time_s": writer.elapsed,
+            "rows_per_s": writer.written / writer.elapsed if writer.elapsed else 0.0,
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generator syntetycznych danych")
+    parser.add_argument("--users", type=int, default=1000, help="Liczba użytkowników")
+    parser.add_argument("--conversations", type=int,
+                        help="Docelowa łączna liczba rozmów (wylicza liczbę użytkowników)")
+    parser.add_argument("--conversations-per-user", type=float, default=50.0)
+    parser.add_argument("--distribution", default="lognormal", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--response-words", type=float, default=60.0, help="Średnia długość odpowiedzi w słowach")
+    parser.add_argument("--analyses-per-user", type=float, default=3.0)
+    parser.add_argument("--pending-ratio", type=float, default=0.3)
+    parser.add_argument("--reminder-ratio", type=float, default=0.3)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    users = args.users
+    if args.conversations:
+        users = max(1, int(round(args.conversations / args.conversations_per_user)))
+
+    from app import app, db
+    with app.app_context():
+        result = seed(
+            db.engine, users=users, conversations_per_user=args.conversations_per_user,
+            distribution=args.distribution, response_words=args.response_words,
+            analyses_per_user=args.analyses_per_user, pending_ratio=args.pending_ratio,
+            reminder_ratio=args.reminder_ratio, days=args.days, batch_size=args.batch_size, seed=args.seed,
+        )
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,385 @@
+"""
+Lekki tracing żądań bez zewnętrznego kolektora.
+
+Spany tworzone są dla:
+    - żądania Flask (span główny, z obsługą nagłówka W3C traceparent),
+    - każdego zapytania SQLAlchemy,
+    - każdego wywołania Anthropic/OpenAI (model, tokeny, ponowienia, trafienia cache),
+    - renderowania wykresów matplotlib, chmury słów i szablonów,
+    - wysyłki przypomnień.
+
+Bieżący span jest przechowywany w contextvars, więc spany zagnieżdżają się
+automatycznie (także w korutynach wykonywanych na pętli zdarzeń llm_client).
+Zakończone spany trafiają do pliku TRACE_FILE w formacie OTLP/JSON - jedna linia
+to jeden ExportTraceServiceRequest z kompletem spanów śladu z danego procesu.
+Plik można wczytać np. do Jaegera lub otel-collectora (odbiornik otlpjsonfile).
+
+Tracing jest włączony tylko, gdy ustawiono TRACE_FILE. Parametr phase= spana
+dodatkowo mierzy czas jako fazę żądania (profiling.phase), niezależnie od tego,
+czy tracing jest włączony.
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+from profiling import push_phase, pop_phase
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.environ.get("TRACE_FILE")
+TRACING_ENABLED = bool(TRACE_FILE)
+SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "therapy-app")
+
+# Maksymalna długość zapisywanej treści zapytania SQL
+MAX_STATEMENT_LENGTH = 1000
+
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+_buffer_lock = threading.Lock()
+_buffers = {}       # trace_id -> lista zakończonych spanów
+_open_spans = {}    # trace_id -> liczba otwartych spanów w tym procesie
+
+
+def _new_id(nbytes):
+    return "%0*x" % (nbytes * 2, random.getrandbits(nbytes * 8))
+
+
+class Span:
+    """Pojedynczy span; kończy się przez end() lub wyjście z bloku span()."""
+
+    def __init__(self, name, kind="internal", attributes=None, parent=None, trace_id=None, parent_id=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else (trace_id or _new_id(16))
+        self.span_id = _new_id(8)
+        self.parent_id = parent.span_id if parent else parent_id
+        self.attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+        self.events = []
+        self.status_code = 0
+        self.status_message = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+        with _buffer_lock:
+            _open_spans[self.trace_id] = _open_spans.get(self.trace_id, 0) + 1
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def increment_attribute(self, key, amount=1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def add_event(self, name, attributes=None):
+        self.events.append((time.time_ns(), name, dict(attributes or {})))
+
+    def record_exception(self, error):
+        self.status_code = 2
+        self.status_message = str(error)[:500]
+        self.add_event("exception", {"exception.type": type(error).__name__,
+                                     "exception.message": str(error)[:500]})
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.status_code == 0:
+            self.status_code = 1
+        _finish_span(self)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": self.status_code},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        if self.events:
+            span["events"] = [{"timeUnixNano": str(ts), "name": name, "attributes": _otlp_attributes(attrs)}
+                              for ts, name, attrs in self.events]
+        return span
+
+
+class _NoopSpan:
+    """Span używany, gdy tracing jest wyłączony."""
+
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def increment_attribute(self, key, amount=1):
+        pass
+
+    def add_event(self, name, attributes=None):
+        pass
+
+    def record_exception(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def _finish_span(span):
+    """Buforuje zakończony span; gdy w procesie nie ma już otwartych spanów śladu, zapisuje je."""
+    with _buffer_lock:
+        _buffers.setdefault(span.trace_id, []).append(span)
+        remaining = _open_spans.get(span.trace_id, 1) - 1
+        if remaining > 0:
+            _open_spans[span.trace_id] = remaining
+            return
+        _open_spans.pop(span.trace_id, None)
+        spans = _buffers.pop(span.trace_id)
+    _export(spans)
+
+
+def _export(spans):
+    document = {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({
+                "service.name": SERVICE_NAME,
+                "process.pid": os.getpid(),
+            })},
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [s.to_otlp() for s in spans],
+            }],
+        }]
+    }
+    line = json.dumps(document, ensure_ascii=False) + "\n"
+    try:
+        # Jeden zapis w trybie dopisywania - linie z wielu workerów się nie przeplatają
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        logger.error(f"Nie można zapisać śladu do {TRACE_FILE}: {str(e)}")
+
+
+def current_span():
+    """Bieżący span (lub NOOP_SPAN)."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def start_span(name, kind="internal", attributes=None, trace_id=None, parent_id=None):
+    """
+    Rozpoczyna span jako dziecko bieżącego spana (bez ustawiania go jako bieżący).
+
+    trace_id/parent_id pozwalają kontynuować ślad z innego procesu (traceparent).
+    """
+    if not TRACING_ENABLED:
+        return NOOP_SPAN
+    return Span(name, kind, attributes, parent=_current_span.get(), trace_id=trace_id, parent_id=parent_id)
+
+
+@contextmanager
+def span(name, kind="internal", attributes=None, phase=None):
+    """
+    Blok kodu jako span (bieżący wewnątrz bloku).
+
+    Args:
+        name (str): Nazwa spana
+        kind (str): 'internal', 'server' lub 'client'
+        attributes (dict, optional): Atrybuty spana
+        phase (str, optional): Nazwa fazy żądania mierzonej przez profiling.phase
+    """
+    if phase:
+        push_phase(phase)
+    current = start_span(name, kind, attributes)
+    token = _current_span.set(current) if current is not NOOP_SPAN else None
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        if token is not None:
+            _current_span.reset(token)
+        current.end()
+        if phase:
+            pop_phase()
+
+
+def traced(name, **span_kwargs):
+    """Dekorator wykonujący funkcję wewnątrz spana o podanej nazwie."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **span_kwargs):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind_current_span(func):
+    """
+    Zwraca funkcję, która w innym wątku wykona `func` z bieżącym spanem jako rodzicem.
+
+    Przenoszony jest tylko span, nie cały kontekst (np. kontekst żądania Flask).
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return func
+
+    def bound():
+        token = _current_span.set(parent)
+        try:
+            return func()
+        finally:
+            _current_span.reset(token)
+    return bound
+
+
+def _parse_traceparent(header):
+    """Zwraca (trace_id, parent_id) z nagłówka W3C traceparent albo (None, None)."""
+    parts = (header or "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return None, None
+
+
+def _install_sql_instrumentation(engine):
+    """Span i faza 'sql' dla każdego zapytania SQLAlchemy."""
+    from sqlalchemy import event
+
+    dialect = engine.dialect.name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        push_phase("sql")
+        if _current_span.get() is None:
+            # Zapytania poza żądaniem i zadaniem tła (np. create_all przy starcie) nie tworzą osobnych śladów
+            conn.info.setdefault("_trace_spans", []).append(NOOP_SPAN)
+            return
+        current = start_span(statement.split(None, 1)[0].upper() if statement else "SQL", "client", {
+            "db.system": dialect,
+            "db.statement": statement[:MAX_STATEMENT_LENGTH],
+            "db.executemany": executemany,
+        })
+        conn.info.setdefault("_trace_spans", []).append(current)
+
+    def _finish_sql(conn, error=None):
+        spans = conn.info.get("_trace_spans")
+        if spans:
+            current = spans.pop()
+            if error is not None:
+                current.record_exception(error)
+            current.end()
+        pop_phase()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("_trace_spans")
+        if spans and cursor is not None and cursor.rowcount is not None and cursor.rowcount >= 0:
+            spans[-1].set_attribute("db.rowcount", cursor.rowcount)
+        _finish_sql(conn)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        if exception_context.connection is not None:
+            _finish_sql(exception_context.connection, exception_context.original_exception)
+        else:
+            pop_phase()
+
+
+def init_app(app, db):
+    """Rejestruje spany żądań, zapytań SQL i szablonów w aplikacji Flask."""
+    from flask import g, request
+    from flask.signals import before_render_template, template_rendered
+
+    with app.app_context():
+        _install_sql_instrumentation(db.engine)
+
+    def _template_started(sender, template, context, **extra):
+        push_phase("template")
+        current = start_span(f"render_template {template.name}", attributes={"template.name": template.name})
+        g.setdefault("_template_spans", []).append(current)
+
+    def _template_finished(sender, template, context, **extra):
+        spans = g.get("_template_spans")
+        if spans:
+            spans.pop().end()
+        pop_phase()
+
+    before_render_template.connect(_template_started, app, weak=False)
+    template_rendered.connect(_template_finished, app, weak=False)
+
+    if not TRACING_ENABLED:
+        return app
+
+    @app.before_request
+    def _start_request_span():
+        if request.endpoint == "static":
+            return
+        trace_id, parent_id = _parse_traceparent(request.headers.get("traceparent"))
+        root = start_span(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+                          "server", {
+                              "http.method": request.method,
+                              "http.target": request.full_path.rstrip("?"),
+                              "http.route": request.url_rule.rule if request.url_rule else None,
+                              "flask.endpoint": request.endpoint,
+                          }, trace_id=trace_id, parent_id=parent_id)
+        g._trace_root = (root, _current_span.set(root))
+
+    @app.after_request
+    def _annotate_request_span(response):
+        root = g.get("_trace_root")
+        if root is not None:
+            root[0].set_attribute("http.status_code", response.status_code)
+            response.headers["traceparent"] = f"00-{root[0].trace_id}-{root[0].span_id}-01"
+        return response
+
+    @app.teardown_request
+    def _end_request_span(exception):
+        root = g.pop("_trace_root", None)
+        if root is None:
+            return
+        current, token = root
+        if exception is not None:
+            current.record_exception(exception)
+            current.set_attribute("http.status_code", 500)
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Token z innego kontekstu (np. widok asynchroniczny) - wystarczy wyczyścić bieżący span
+            _current_span.set(None)
+        current.end()
+
+    return app
@@ -1,14 +1,86 @@
-import matplotlib.pyplot as plt
 import matplotlib
+from matplotlib.figure import Figure
 import base64
 import io
+import re
 import json
 from datetime import datetime, timedelta
 import numpy as np
 
+from metrics import timed_render
+
 # Ustawienie nieinteraktywnego backendu
 matplotlib.use('Agg')
 
+# Wykresy są rysowane na osobnych obiektach Figure, bez globalnego stanu pyplot -
+# workery gunicorna (gthread) renderują je równolegle w wielu wątkach
+
+# Emocje śledzone na wykresie
+EMOTIONS = ['Radość', 'Smutek', 'Lęk', 'Gniew', 'Zaskoczenie']
+
+# Intensywność zapisana w tekście wzorca, np. "Wysoki poziom lęku (4/5)"
+INTENSITY_PATTERN = re.compile(r'(\d+)[/](\d+)')
+
+# Wartość, gdy wzorzec nie zawiera intensywności
+DEFAULT_INTENSITY = 3
+
+def extract_emotion_intensities(analysis_data):
+    """
+    Wyodrębnia intensywności emocji z wzorców emocjonalnych jednej analizy.
+
+    Wywoływane przy zapisie analizy (PsychologicalAnalysis.set_analysis);
+    wykresy czytają gotowe wartości z tabeli EmotionIntensity.
+    
+    Args:
+        analysis_data (dict): Dane analizy psychologicznej (wynik get_analysis())
+    
+    Returns:
+        list: Lista par (emocja, intensywność 1-5)
+    """
+    if not analysis_data or 'emotional_patterns' not in analysis_data:
+        return []
+    
+    intensities = []
+    for pattern in analysis_data['emotional_patterns']:
+        if not isinstance(pattern, str):
+            continue
+        pattern_lower = pattern.lower()
+        found = [emotion for emotion in EMOTIONS if emotion.lower() in pattern_lower]
+        if not found:
+            continue
+
+        # Próbujemy wyodrębnić liczbę z tekstu (np. "Wysoki poziom lęku (4/5)"), domyślnie szacunkowe 3
+        match = INTENSITY_PATTERN.search(pattern)
+        intensity = int(match.group(1)) if match else DEFAULT_INTENSITY
+        intensities.extend((emotion, intensity) for emotion in found)
+    return intensities
+
+def get_emotion_series(user_id, since=None):
+    """
+    Pobiera szeregi intensywności emocji użytkownika z tabeli EmotionIntensity.
+
+    Args:
+        user_id (int): ID użytkownika
+        since (datetime, optional): Najwcześniejszy czas analizy
+
+    Returns:
+        dict: Emocja -> lista par (czas analizy, intensywność) w kolejności chronologicznej
+    """
+    from app import db
+    from models import EmotionIntensity
+
+    query = (db.select(EmotionIntensity.emotion, EmotionIntensity.timestamp, EmotionIntensity.intensity)
+             .where(EmotionIntensity.user_id == user_id))
+    if since is not None:
+        query = query.where(EmotionIntensity.timestamp >= since)
+    query = query.order_by(EmotionIntensity.timestamp, EmotionIntensity.id)
+
+    series = {emotion: [] for emotion in EMOTIONS}
+    for emotion, timestamp, intensity in db.session.execute(query):
+        series.setdefault(emotion, []).append((timestamp, intensity))
+    return series
+
+@timed_render("emotion_chart")
 def generate_emotion_chart(psychological_analyses, days=30):
     """
     Generuje wykres zmian emocjonalnych na podstawie analizy psychologicznej.
@@ -38,72 +110,48 @@ def generate_emotion_chart(psychological_analyses, days=30):
     dates = [a.timestamp for a in recent_analyses]
     ei_scores = [a.emotional_intelligence_score for a in recent_analyses]
     
-    # Zbierz dane o emocjach
-    emotions = {'Radość': [], 'Smutek': [], 'Lęk': [], 'Gniew': [], 'Zaskoczenie': []}
-    
-    for analysis in recent_analyses:
-        data = analysis.get_analysis()
-        if not data or 'emotional_patterns' not in data:
-            continue
-            
-        # Szukamy wzorców emocjonalnych w danych
-        for pattern in data['emotional_patterns']:
-            for emotion in emotions.keys():
-                if emotion.lower() in pattern.lower():
-                    # Dodajemy szacunkową intensywność emocji (1-5)
-                    intensity = 3  # Domyślna wartość
-                    
-                    # Próbujemy wyodrębnić liczbę z tekstu (np. "Wysoki poziom lęku (4/5)")
-                    import re
-                    match = re.search(r'(\d+)[/](\d+)', pattern)
-                    if match:
-                        try:
-                            numerator = int(match.group(1))
-                            denominator = int(match.group(2))
-                            intensity = numerator
-                        except ValueError:
-                            pass
-                            
-                    emotions[emotion].append((analysis.timestamp, intensity))
+    # Zbierz dane o emocjach (wyodrębnione przy zapisie analiz)
+    emotions = get_emotion_series(recent_analyses[0].user_id, since=dates[0])
     
     # Inicjalizuj wykres
-    plt.figure(figsize=(10, 6))
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
     
     # Wykres inteligencji emocjonalnej
-    plt.plot(dates, ei_scores, 'o-', label='Inteligencja Emocjonalna', color='purple', linewidth=2)
+    ax.plot(dates, ei_scores, 'o-', label='Inteligencja Emocjonalna', color='purple', linewidth=2)
     
     # Dodaj wykresy dla emocji, dla których mamy dane
     colors = {'Radość': 'green', 'Smutek': 'blue', 'Lęk': 'orange', 'Gniew': 'red', 'Zaskoczenie': 'cyan'}
     
     for emotion, data_points in emotions.items():
-        if data_points:
+        if data_points and emotion in colors:
             emotion_dates = [d[0] for d in data_points]
             emotion_values = [d[1] for d in data_points]
             if len(emotion_dates) > 1:  # Tylko jeśli mamy więcej niż jeden punkt danych
-                plt.plot(emotion_dates, emotion_values, 'o--', label=emotion, color=colors[emotion], alpha=0.7)
+                ax.plot(emotion_dates, emotion_values, 'o--', label=emotion, color=colors[emotion], alpha=0.7)
     
     # Formatowanie wykresu
-    plt.title('Rozwój Emocjonalny w Czasie', fontsize=16)
-    plt.xlabel('Data', fontsize=12)
-    plt.ylabel('Intensywność / Wynik', fontsize=12)
-    plt.ylim(0, 5.5)  # Skala od 0 do 5, z małym marginesem na górze
-    plt.grid(True, linestyle='--', alpha=0.7)
-    plt.legend(loc='best')
+    ax.set_title('Rozwój Emocjonalny w Czasie', fontsize=16)
+    ax.set_xlabel('Data', fontsize=12)
+    ax.set_ylabel('Intensywność / Wynik', fontsize=12)
+    ax.set_ylim(0, 5.5)  # Skala od 0 do 5, z małym marginesem na górze
+    ax.grid(True, linestyle='--', alpha=0.7)
+    ax.legend(loc='best')
     
     # Formatowanie osi x
-    plt.gcf().autofmt_xdate()
+    fig.autofmt_xdate()
     
     # Zapisz wykres do bufora
     buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
+    fig.savefig(buf, format='png', dpi=100, bbox_inches='tight')
     buf.seek(0)
     
     # Koduj obraz do base64
     img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-    plt.close()
     
     return img_base64
 
+@timed_render("emotional_intelligence_progress")
 def generate_emotional_intelligence_progress(psychological_analyses):
     """
     Generuje wykres postępu inteligencji emocjonalnej.
@@ -125,10 +173,11 @@ def generate_emotional_intelligence_progress(psychological_analyses):
     ei_scores = [a.emotional_intelligence_score for a in analyses]
     
     # Inicjalizuj wykres
-    plt.figure(figsize=(10, 6))
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
     
     # Wykres inteligencji emocjonalnej
-    plt.plot(dates, ei_scores, 'o-', color='purple', linewidth=2)
+    ax.plot(dates, ei_scores, 'o-', color='purple', linewidth=2)
     
     # Dodaj linię trendu
     if len(dates) > 2:
@@ -139,27 +188,26 @@ def generate_emotional_intelligence_progress(psychological_analyses):
         
         trend_x = np.array([min(x), max(x)])
         trend_dates = [dates[0] + timedelta(seconds=float(val)) for val in trend_x]
-        plt.plot(trend_dates, p(trend_x), "r--", alpha=0.8, label='Trend')
+        ax.plot(trend_dates, p(trend_x), "r--", alpha=0.8, label='Trend')
     
     # Formatowanie wykresu
-    plt.title('Postęp Inteligencji Emocjonalnej', fontsize=16)
-    plt.xlabel('Data', fontsize=12)
-    plt.ylabel('Wynik Inteligencji Emocjonalnej', fontsize=12)
-    plt.ylim(0, 100)  # Skala od 0 do 100
-    plt.grid(True, linestyle='--', alpha=0.7)
+    ax.set_title('Postęp Inteligencji Emocjonalnej', fontsize=16)
+    ax.set_xlabel('Data', fontsize=12)
+    ax.set_ylabel('Wynik Inteligencji Emocjonalnej', fontsize=12)
+    ax.set_ylim(0, 100)  # Skala od 0 do 100
+    ax.grid(True, linestyle='--', alpha=0.7)
     if len(dates) > 2:
-        plt.legend()
+        ax.legend()
     
     # Formatowanie osi x
-    plt.gcf().autofmt_xdate()
+    fig.autofmt_xdate()
     
     # Zapisz wykres do bufora
     buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
+    fig.savefig(buf, format='png', dpi=100, bbox_inches='tight')
     buf.seek(0)
     
     # Koduj obraz do base64
     img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-    plt.close()
     
     return img_base64
\ No newline at end of file
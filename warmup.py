@@ -0,0 +1,188 @@
+"""
+Rozgrzewanie aplikacji przed przyjęciem ruchu i endpoint gotowości /readyz.
+
+warm_up(app) wykonuje jednorazowo kosztowne inicjalizacje, które inaczej
+spadłyby na pierwsze żądania każdego workera: kompilację szablonów Jinja,
+stopwords NLTK, indeks pytań, słowniki klasyfikatora emocji, konfigurację mapperów
+SQLAlchemy, referencyjne skróty haseł oraz pamięć podręczną czcionek matplotlib
+i WordCloud.
+
+Pod gunicornem z preload_app (gunicorn.conf.py) rozgrzewanie odbywa się raz
+w procesie nadrzędnym, a workery dziedziczą gotowe obiekty po fork (strony
+współdzielone copy-on-write). Bez preload każdy worker rozgrzewa się sam,
+zanim zacznie przyjmować połączenia.
+
+/readyz zwraca 200 dopiero po zakończeniu rozgrzewania, gdy baza danych
+odpowiada i schemat jest aktualny (python init_db.py); w przeciwnym razie 503.
+"""
+
+import io
+import time
+import logging
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Stan rozgrzewania procesu (dziedziczony przez workery po fork)
+_state = {"ready": False, "steps": {}, "errors": {}, "schema": None}
+
+SAMPLE_CONTEXT = [
+    {"question": "Jak się dziś czujesz?", "response": "Czuję stres w pracy, ale też radość z rodziny.",
+     "date": None},
+    {"question": "Co daje Ci spokój?", "response": "Sen, odpoczynek i rozmowa z przyjacielem.", "date": None},
+]
+
+
+def _warm_templates(app):
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+
+
+def _warm_stopwords(app):
+    # Import pobiera i wczytuje stopwords NLTK
+    from wordcloud_analyzer import ALL_STOPWORDS, preprocess_text
+    preprocess_text("Rozgrzewanie wyrażeń regularnych")
+    return len(ALL_STOPWORDS)
+
+
+def _warm_question_bank(app):
+    from therapy import generate_question, analyze_context
+    from question_index import get_index, select_question
+    from emotion_classifier import classify as classify_emotions
+    import claude_api  # noqa: F401
+    import quotes  # noqa: F401
+
+    # Indeks banku pytań
+    get_index()
+    analyze_context(SAMPLE_CONTEXT)
+    generate_question(SAMPLE_CONTEXT)
+    # Ścieżka zastępcza claude_api (wektoryzacja odpowiedzi i dopasowanie)
+    select_question(SAMPLE_CONTEXT)
+    classify_emotions(SAMPLE_CONTEXT)
+    return len(get_index())
+
+
+def _warm_sqlalchemy(app):
+    from sqlalchemy.orm import configure_mappers
+    import models  # noqa: F401
+    configure_mappers()
+
+
+def _warm_passwords(app):
+    # Skróty referencyjne liczone raz przed fork zamiast przy pierwszym logowaniu w workerze
+    import passwords
+    passwords._current_method()
+    passwords._dummy_hash()
+
+
+def _warm_charts(app):
+    from matplotlib.figure import Figure
+    from wordcloud import WordCloud
+    from visualization import generate_emotion_chart  # noqa: F401 - ustawia backend Agg
+
+    fig = Figure(figsize=(1, 1))
+    ax = fig.add_subplot()
+    ax.plot([0, 1], [0, 1], label="rozgrzewanie")
+    ax.legend()
+    fig.savefig(io.BytesIO(), format="png")
+    WordCloud(width=50, height=50).generate_from_frequencies({"rozgrzewanie": 1})
+
+
+WARMUP_STEPS = [
+    ("templates", _warm_templates),
+    ("stopwords", _warm_stopwords),
+    ("question_bank", _warm_question_bank),
+    ("sqlalchemy", _warm_sqlalchemy),
+    ("passwords", _warm_passwords),
+    ("charts", _warm_charts),
+]
+
+
+def check_schema(db):
+    """Zwraca listę brakujących tabel i kolumn (pusta = schemat aktualny)."""
+    from sqlalchemy import inspect
+    from init_db import ADDED_COLUMNS
+
+    inspector = inspect(db.engine)
+    existing = set(inspector.get_table_names())
+    missing = [table for table in db.metadata.tables if table not in existing]
+    for table, columns in ADDED_COLUMNS.items():
+        if table in existing:
+            present = {column["name"] for column in inspector.get_columns(table)}
+            missing.extend(f"{table}.{name}" for name, _ in columns if name not in present)
+    return missing
+
+
+def warm_up(app):
+    """
+    Wykonuje kroki rozgrzewania i sprawdza schemat bazy danych.
+
+    Błąd kroku jest logowany, ale nie przerywa startu - brakujący schemat
+    lub niedostępna baza danych są zgłaszane przez /readyz.
+
+    Returns:
+        dict: Czas (s) każdego kroku
+    """
+    from app import db
+
+    start = time.perf_counter()
+    for name, step in WARMUP_STEPS:
+        step_start = time.perf_counter()
+        try:
+            step(app)
+        except Exception as e:
+            _state["errors"][name] = str(e)
+            logger.error(f"Rozgrzewanie '{name}' nie powiodło się: {str(e)}")
+        _state["steps"][name] = round(time.perf_counter() - step_start, 3)
+
+    with app.app_context():
+        try:
+            _state["schema"] = check_schema(db)
+            if _state["schema"]:
+                logger.error(f"Schemat bazy danych jest nieaktualny (uruchom python init_db.py): {_state['schema']}")
+        except Exception as e:
+            _state["errors"]["schema"] = str(e)
+            logger.error(f"Nie można sprawdzić schematu bazy danych: {str(e)}")
+        finally:
+            # Połączenia otwarte przed fork nie mogą trafić do workerów
+            db.engine.dispose()
+
+    _state["ready"] = True
+    logger.info(f"Rozgrzewanie zakończone w {time.perf_counter() - start:.2f}s: {_state['steps']}")
+    return dict(_state["steps"])
+
+
+def readiness(db):
+    """Zwraca (gotowość, szczegóły) dla /readyz."""
+    from sqlalchemy import text
+
+    details = {
+        "warmed_up": _state["ready"],
+        "warmup_s": _state["steps"],
+        "warmup_errors": _state["errors"],
+        "missing_schema": _state["schema"],
+    }
+    # Schemat None = nie udało się go sprawdzić
+    ready = _state["ready"] and _state["schema"] == []
+
+    try:
+        db.session.execute(text("SELECT 1"))
+        details["database"] = "ok"
+    except Exception as e:
+        details["database"] = str(e)
+        ready = False
+    return ready, details
+
+
+def init_app(app, db):
+    """Rejestruje endpoint gotowości /readyz."""
+    from flask import jsonify
+
+    @app.route('/readyz')
+    def readyz():
+        ready, details = readiness(db)
+        details["status"] = "ready" if ready else "not_ready"
+        return jsonify(details), 200 if ready else 503
+
+    return app
@@ -5,10 +5,12 @@ import json
 from collections import Counter
 import nltk
 from wordcloud import WordCloud
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import numpy as np
 from PIL import Image
 
+from metrics import timed_render
+
 # Download NLTK stopwords
 nltk.download('stopwords', quiet=True)
 
@@ -82,6 +84,7 @@ def extract_keywords(responses, max_words=100):
     # Zwróć najczęstsze słowa
     return dict(word_counts.most_common(max_words))
 
+@timed_render("wordcloud")
 def generate_wordcloud(word_frequencies, width=800, height=400):
     """
     Generuje chmurę tagów na podstawie częstotliwości słów.
@@ -114,20 +117,20 @@ def generate_wordcloud(word_frequencies, width=800, height=400):
     # Generujemy chmurę tagów
     wordcloud.generate_from_frequencies(word_frequencies)
     
-    # Tworzymy wykres matplotlib
-    plt.figure(figsize=(width/100, height/100), facecolor='#0d1117')
-    plt.imshow(wordcloud, interpolation='bilinear')
-    plt.axis("off")
-    plt.tight_layout(pad=0)
+    # Tworzymy wykres matplotlib (osobny Figure - bez globalnego stanu pyplot, bezpieczne w wielu wątkach)
+    fig = Figure(figsize=(width/100, height/100), facecolor='#0d1117')
+    ax = fig.add_subplot()
+    ax.imshow(wordcloud, interpolation='bilinear')
+    ax.axis("off")
+    fig.tight_layout(pad=0)
     
     # Zapisujemy do bufora
     buf = io.BytesIO()
-    plt.savefig(buf, format='png', facecolor='#0d1117', bbox_inches='tight', pad_inches=0, dpi=100)
+    fig.savefig(buf, format='png', facecolor='#0d1117', bbox_inches='tight', pad_inches=0, dpi=100)
     buf.seek(0)
     
     # Kodujemy do base64
     img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-    plt.close()
     
     return img_base64
     
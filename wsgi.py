@@ -0,0 +1,15 @@
+"""
+Produkcyjny punkt wejścia WSGI.
+
+Uruchomienie (po jednorazowej migracji schematu `python init_db.py`):
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Aplikacja jest rozgrzewana przy imporcie modułu. Z preload_app dzieje się to
+raz w procesie nadrzędnym gunicorna, zanim workery zaczną przyjmować ruch.
+"""
+
+from app import app
+import warmup
+
+warmup.warm_up(app)